@@ -1,8 +1,10 @@
 import logging
 
+from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
 from .action_backends_base import BaseAction
+from .buffer import get_submission_buffer
 
 
 logger = logging.getLogger(__name__)
@@ -11,10 +13,27 @@ logger = logging.getLogger(__name__)
 class DefaultAction(BaseAction):
     verbose_name = _('Default')
 
+    def form_valid(self, cmsplugin, instance, request, form):
+        # With the email outbox, the notifications are
+        # only queued if the submission is saved.
+        with transaction.atomic():
+            recipients = cmsplugin.send_notifications(instance, form)
+            form.instance.set_recipients(recipients)
+            form.save()
+
+
+class BufferedAction(BaseAction):
+    """
+    Like DefaultAction, but the submission is buffered and written to the
+    database in batches by a background thread (see aldryn_forms.buffer).
+    """
+    verbose_name = _('Default (buffered)')
+
     def form_valid(self, cmsplugin, instance, request, form):
         recipients = cmsplugin.send_notifications(instance, form)
         form.instance.set_recipients(recipients)
-        form.save()
+        form.instance.set_form_data(form)
+        get_submission_buffer().append(form.instance)
 
 
 class EmailAction(BaseAction):
@@ -1,5 +1,13 @@
+from django.conf import settings
+from django.db.models import Max
+
 from tablib import Dataset
 
+from ..models import (
+    DecodedFormField, FormSubmissionValue, SerializedFormField,
+    get_schema_fields,
+)
+
 
 class Exporter(object):
 
@@ -10,40 +18,35 @@ class Exporter(object):
         headers = [field.rpartition('-')[0] for field in fields]
         dataset = Dataset(headers=headers)
 
-        for submission in self.queryset.only('data').iterator():
-            row_data = []
-            form_fields = [field for field in submission.get_form_data()
-                           if field.field_id in fields]
+        for submission in self.queryset.only('data', 'schema_version').iterator():
+            values = {}
+
+            for field in submission.get_form_data():
+                # The first field with a given id wins.
+                values.setdefault(field.field_id, field.value)
 
-            for header in fields:
-                for field in form_fields:
-                    if field.field_id == header:
-                        row_data.append(field.value)
-                        break
-                else:
-                    row_data.append('')
+            row_data = [values.get(header, '') for header in fields]
 
             if row_data:
                 dataset.append(row_data)
         return dataset
 
     def get_fields_for_export(self):
+        if self.has_submission_values():
+            return self.get_fields_for_export_from_values()
+
         old_fields = []
         old_field_ids = []
 
         # A user can add fields to the form over time,
         # knowing this we use the latest form submission as a way
         # to get the latest form state.
-        submissions = self.queryset.only('data').iterator()
-
-        latest_data = next(submissions)
+        latest_data = next(self.queryset.only('data', 'schema_version').iterator())
         latest_fields = [field for field in latest_data.get_form_data()
                          if field.label]
         latest_field_ids = [field.field_id for field in latest_fields]
 
-        for submission in submissions:
-            fields = submission.get_form_data()
-
+        for fields in self.iter_submitted_fields():
             for field in fields:
                 if not field.label:
                     continue
@@ -54,3 +57,74 @@ class Exporter(object):
                     old_fields.append(field)
                     old_field_ids.append(field_id)
         return (latest_fields, old_fields)
+
+    def iter_submitted_fields(self):
+        """
+        Yields the fields of the submissions, newest first.
+        The submissions sharing a schema version are read only once.
+        """
+        schema_versions = (
+            self.queryset
+            .filter(schema_version__isnull=False)
+            .values('schema_version')
+            .annotate(last_sent_at=Max('sent_at'))
+            .order_by('-last_sent_at')
+        )
+
+        for row in schema_versions:
+            yield [
+                DecodedFormField.create(name, label, field_occurrence, '', field_id)
+                for name, label, field_occurrence, field_id in get_schema_fields(row['schema_version'])
+            ]
+
+        # Submissions stored before schema versions
+        submissions = self.queryset.filter(schema_version__isnull=True).only('data')
+
+        for submission in submissions.iterator():
+            yield submission.get_form_data()
+
+    def has_submission_values(self):
+        """
+        Returns True if the values of all the submissions are stored
+        in the FormSubmissionValue table.
+        """
+        if not getattr(settings, 'ALDRYN_FORMS_STORE_SUBMISSION_VALUES', False):
+            return False
+        return not self.queryset.filter(submission_values__isnull=True).exists()
+
+    def get_fields_for_export_from_values(self):
+        """
+        Same as get_fields_for_export() but the fields of older
+        submissions are collected by the database.
+        """
+        latest_data = self.queryset.only('data', 'schema_version').first()
+        latest_fields = [field for field in latest_data.get_form_data()
+                         if field.label]
+        latest_field_ids = [field.field_id for field in latest_fields]
+
+        rows = (
+            FormSubmissionValue
+            .objects
+            .filter(submission__in=self.queryset)
+            .exclude(field_label='')
+            .values_list('field_name', 'field_label', 'occurrence')
+            .annotate(last_sent_at=Max('submission__sent_at'))
+            .order_by('-last_sent_at', 'field_name', 'occurrence')
+        )
+
+        old_fields = []
+        old_field_ids = []
+
+        for name, label, occurrence, last_sent_at in rows:
+            field = SerializedFormField(
+                name=name,
+                label=label,
+                field_occurrence=occurrence,
+                value='',
+            )
+            field_id = field.field_id
+
+            if field.label.strip() and field_id not in old_field_ids and field_id not in latest_field_ids:
+                old_fields.append(field)
+                old_field_ids.append(field_id)
+        return (latest_fields, old_fields)
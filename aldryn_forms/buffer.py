@@ -0,0 +1,264 @@
+"""
+Buffers form submissions and writes them to the database in batches,
+used by the BufferedAction backend.
+
+Submissions are kept in append-only spool files in
+ALDRYN_FORMS_BUFFER_SPOOL_DIR, which survive a crash of the process.
+With ALDRYN_FORMS_BUFFER_IN_MEMORY they are kept in memory instead,
+and the ones not written yet are lost if the process is killed.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+
+from .schema import InstanceJSONEncoder, dump_instance, load_instance
+
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionBuffer(object):
+
+    def __init__(self, batch_size=100, interval=5, spool_dir=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_dir = spool_dir
+        self._submissions = []
+        self._pending_count = 0
+        # Guards the pending submissions, held while adding or taking them.
+        self._lock = threading.Lock()
+        # Only one flush at a time, appends don't wait for it.
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    @property
+    def spool_path(self):
+        return os.path.join(self.spool_dir, 'submissions-{}.jsonl'.format(os.getpid()))
+
+    def append(self, submission):
+        """
+        Adds an unsaved FormSubmission to the buffer.
+        """
+        if self.spool_dir:
+            line = json.dumps(dump_instance(submission), cls=InstanceJSONEncoder)
+
+        with self._lock:
+            if self.spool_dir:
+                with open(self.spool_path, 'a') as spool:
+                    spool.write(line + '\n')
+                    spool.flush()
+                    os.fsync(spool.fileno())
+            else:
+                self._submissions.append(submission)
+            self._pending_count += 1
+            pending_count = self._pending_count
+
+        if pending_count >= self.batch_size:
+            self._wakeup.set()
+
+    def get_pending_count(self):
+        """
+        Returns the number of submissions appended by this process
+        and not taken by a flush yet.
+        """
+        return self._pending_count
+
+    def flush(self):
+        """
+        Writes all the buffered submissions to the database.
+        """
+        with self._flush_lock:
+            if self.spool_dir:
+                self.flush_spool()
+            else:
+                self.flush_queue()
+
+    def flush_queue(self):
+        with self._lock:
+            submissions, self._submissions = self._submissions, []
+            self._pending_count = 0
+
+        try:
+            self.write(submissions)
+        except WriteError as error:
+            # Keep the batches which weren't stored for the next flush.
+            with self._lock:
+                self._submissions[:0] = error.remaining
+                self._pending_count += len(error.remaining)
+            raise
+
+    def flush_spool(self):
+        with self._lock:
+            if os.path.exists(self.spool_path):
+                flushing_path = '{}.{}.flushing'.format(self.spool_path, time.time())
+                os.rename(self.spool_path, flushing_path)
+            self._pending_count = 0
+
+        for path in self.get_spool_files():
+            with open(path) as spool:
+                lines = spool.read().splitlines()
+
+            submissions = []
+
+            for line in lines:
+                try:
+                    submissions.append((line, load_instance(json.loads(line))))
+                except ValueError:
+                    # A line cut short by a crash, it was never acknowledged.
+                    logger.warning('Skipping an incomplete line in %s', path)
+
+            try:
+                self.write([submission for line, submission in submissions])
+            except WriteError as error:
+                # Only keep the lines of the batches which weren't stored.
+                remaining = submissions[len(submissions) - len(error.remaining):]
+                self.rewrite_spool(path, [line for line, submission in remaining])
+                raise
+            # The file is only removed once its submissions are stored.
+            os.remove(path)
+
+    def rewrite_spool(self, path, lines):
+        # Not matched by get_spool_files() if left behind by a crash.
+        rewritten_path = os.path.join(self.spool_dir, '.{}.tmp'.format(os.path.basename(path)))
+
+        with open(rewritten_path, 'w') as spool:
+            spool.write(''.join(line + '\n' for line in lines))
+            spool.flush()
+            os.fsync(spool.fileno())
+        os.replace(rewritten_path, path)
+
+    def get_spool_files(self):
+        """
+        Returns the spool files being flushed by this process,
+        and the ones left behind by processes that are gone.
+        """
+        paths = []
+
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'submissions-*'))):
+            pid = int(os.path.basename(path).split('-')[1].split('.')[0])
+
+            if pid == os.getpid():
+                if path.endswith('.flushing'):
+                    paths.append(path)
+            elif not is_process_alive(pid):
+                claimed_path = '{}.{}.{}.flushing'.format(self.spool_path, pid, time.time())
+
+                try:
+                    os.rename(path, claimed_path)
+                except FileNotFoundError:
+                    # Claimed by another process.
+                    continue
+                paths.append(claimed_path)
+        return paths
+
+    def write(self, submissions):
+        """
+        Stores the submissions, one transaction per batch.
+        Raises WriteError with the submissions of the failed
+        batch and the following ones if a batch can't be stored.
+        """
+        for start in range(0, len(submissions), self.batch_size):
+            try:
+                self.write_batch(submissions[start:start + self.batch_size])
+            except Exception as error:
+                raise WriteError(submissions[start:]) from error
+
+    def write_batch(self, batch):
+        from .models import FormSubmission
+
+        with transaction.atomic():
+            created = FormSubmission.objects.bulk_create(batch)
+
+            if getattr(settings, 'ALDRYN_FORMS_STORE_SUBMISSION_VALUES', False):
+                # Only possible if the database returns the new pks,
+                # aldryn_forms_fill_submission_values handles the others.
+                for submission in created:
+                    if submission.pk is not None:
+                        submission.create_values()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='aldryn-forms-buffer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write buffered form submissions')
+            finally:
+                close_old_connections()
+
+
+class WriteError(Exception):
+
+    def __init__(self, remaining):
+        super(WriteError, self).__init__('{} submissions were not stored'.format(len(remaining)))
+        self.remaining = remaining
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_submission_buffer():
+    """
+    Returns the buffer of the current process, started on first use
+    and flushed when the process exits.
+
+    The submissions are spooled to ALDRYN_FORMS_BUFFER_SPOOL_DIR, keeping
+    them in memory has to be enabled with ALDRYN_FORMS_BUFFER_IN_MEMORY.
+    """
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None:
+            spool_dir = getattr(settings, 'ALDRYN_FORMS_BUFFER_SPOOL_DIR', None)
+
+            if not spool_dir and not getattr(settings, 'ALDRYN_FORMS_BUFFER_IN_MEMORY', False):
+                raise ImproperlyConfigured(
+                    'Buffered form submissions need ALDRYN_FORMS_BUFFER_SPOOL_DIR. '
+                    'Set ALDRYN_FORMS_BUFFER_IN_MEMORY = True to keep them in memory '
+                    'instead, they are then lost if the process is killed.'
+                )
+
+            _buffer = SubmissionBuffer(
+                batch_size=getattr(settings, 'ALDRYN_FORMS_BUFFER_BATCH_SIZE', 100),
+                interval=getattr(settings, 'ALDRYN_FORMS_BUFFER_INTERVAL', 5),
+                spool_dir=spool_dir,
+            )
+            _buffer.start()
+            atexit.register(_buffer.stop)
+    return _buffer
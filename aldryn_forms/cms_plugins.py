@@ -1,19 +1,30 @@
+import hashlib
+import time
 from typing import Dict
+from uuid import uuid4
 
 from PIL import Image
 from aldryn_forms.models import FormPlugin
 from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
+from cms.utils.conf import get_cms_setting
+from cms.utils.placeholder import restore_sekizai_context
 from django import forms
+from django.conf import settings
 from django.contrib.admin import TabularInline
+from django.core.cache import cache
 from django.core.validators import MinLengthValidator
+from django.db.models import prefetch_related_objects
 from django.db.models import query
-from django.template.loader import select_template
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext
 from django.utils.translation import ugettext_lazy as _
-from emailit.api import send_mail
+from emailit.api import construct_mail
 from filer.models import filemodels
 from filer.models import imagemodels
+from sekizai.helpers import Watcher
 
 from . import models
 from .forms import BooleanFieldForm
@@ -25,27 +36,37 @@ from .forms import FormSubmissionBaseForm
 from .forms import HiddenFieldForm
 from .forms import ImageFieldForm
 from .forms import MultipleSelectFieldForm
+from .forms import OptionChoiceField
+from .forms import OptionMultipleChoiceField
 from .forms import RadioFieldForm
 from .forms import RestrictedFileField
 from .forms import RestrictedImageField
 from .forms import SelectFieldForm
 from .forms import TextAreaFieldForm
 from .forms import TextFieldForm
-from .helpers import get_user_name
 from .models import FileUploadFieldPlugin
 from .models import SerializedFormField
+from .outbox import SubmissionMessages
+from .outbox import collect_form_messages
+from .outbox import send_form_messages
 from .signals import form_post_save
 from .signals import form_pre_save
 from .sizefield.utils import filesizeformat
+from .utils import LRUCache
 from .utils import get_action_backends
+from .utils import get_nested_plugins
+from .utils import get_plugin_tree_version
+from .utils import select_cached_template
 from .validators import MaxChoicesValidator
 from .validators import MinChoicesValidator
-from .validators import is_valid_recipient
 
 
 class FormElement(CMSPluginBase):
     # Don't cache anything.
     cache = False
+    # Whether the unbound markup of this element can be cached
+    # by the form plugin, see FormPlugin.cache_markup.
+    markup_cacheable = True
     module = _('Forms')
 
 
@@ -61,6 +82,21 @@ class FormPlugin(FieldContainer):
     form = FormPluginForm
     filter_horizontal = ['recipients']
 
+    # Form classes are expensive to build,
+    # they're shared by all requests in the current process.
+    form_class_cache = LRUCache(
+        maxsize=getattr(settings, 'ALDRYN_FORMS_FORM_CLASS_CACHE_SIZE', 500),
+    )
+
+    # Cache the markup of unbound forms, only the csrf token
+    # and the submission token are filled in on every request.
+    cache_markup = getattr(settings, 'ALDRYN_FORMS_CACHE_MARKUP', False)
+    markup_template = 'aldryn_forms/form_markup.html'
+    markup_csrf_token = 'ALDRYN-FORMS-CSRF-TOKEN'
+    markup_submission_token = 'ALDRYN-FORMS-SUBMISSION-TOKEN'
+
+    rate_limit_message = _('Too many submissions, please try again later.')
+
     fieldsets = (
         (None, {
             'fields': (
@@ -82,6 +118,20 @@ class FormPlugin(FieldContainer):
                 'form_attributes',
             )
         }),
+        (_('Rate limiting'), {
+            'classes': ('collapse',),
+            'fields': (
+                'rate_limit_by',
+                ('rate_limit_burst', 'rate_limit_sustained'),
+            )
+        }),
+        (_('Digest'), {
+            'classes': ('collapse',),
+            'fields': (
+                ('digest_frequency', 'digest_count'),
+                'digest_csv',
+            )
+        }),
     )
 
     def render(self, context, instance, placeholder):
@@ -94,11 +144,80 @@ class FormPlugin(FieldContainer):
             context['post_success'] = True
             context['form_success_url'] = self.get_success_url(instance)
         context['form'] = form
+
+        if self.is_markup_cacheable(context, instance, form):
+            context['form_markup'] = self.get_form_markup(context, instance)
+        else:
+            context['form_markup'] = None
         return context
 
     def get_render_template(self, context, instance, placeholder):
+        if context.get('form_markup') is not None:
+            return self.markup_template
         return instance.form_template
 
+    def is_markup_cacheable(self, context, instance, form):
+        if not self.cache_markup or form.is_bound:
+            return False
+
+        if form.is_rate_limited or form.errors:
+            # The errors were added for this request only.
+            return False
+
+        user = getattr(context['request'], 'user', None)
+
+        if user is not None and user.is_staff:
+            # Staff might be editing the page, same as the cms placeholder cache.
+            return False
+
+        for plugin in get_nested_plugins(instance):
+            plugin_class = plugin.get_plugin_class()
+
+            if not getattr(plugin_class, 'markup_cacheable', plugin_class.cache):
+                return False
+        return True
+
+    def get_form_markup_cache_key(self, instance):
+        return 'aldryn_forms:form_markup:{}:{}:{}:{}:{}'.format(
+            instance.pk,
+            instance.language,
+            instance.form_schema_generation,
+            get_plugin_tree_version(instance),
+            instance.form_template,
+        )
+
+    def get_form_markup(self, context, instance):
+        """
+        Returns the markup of the unbound form, rendering it
+        only if it's not in the cache yet.
+        """
+        cache_key = self.get_form_markup_cache_key(instance)
+        cached = cache.get(cache_key)
+
+        if cached is None:
+            watcher = Watcher(context)
+            content = self.render_form_markup(context, instance)
+            cached = {'content': content, 'sekizai': watcher.get_changes()}
+            cache.set(cache_key, cached, get_cms_setting('CACHE_DURATIONS')['content'])
+        else:
+            restore_sekizai_context(context, cached['sekizai'])
+
+        csrf_token = get_token(context['request'])
+        content = cached['content'].replace(self.markup_csrf_token, csrf_token)
+        content = content.replace(self.markup_submission_token, uuid4().hex)
+        return mark_safe(content)
+
+    def render_form_markup(self, context, instance):
+        template_context = context.flatten()
+        template_context['csrf_token'] = self.markup_csrf_token
+        template_context['form'].fields['submission_token'].initial = self.markup_submission_token
+        template = select_cached_template([instance.form_template])
+        return template.render(template_context)
+
+    def save_model(self, request, obj, form, change):
+        super(FormPlugin, self).save_model(request, obj, form, change)
+        obj.update_form_schema()
+
     def form_valid(self, instance, request, form):
         action_backend = get_action_backends()[form.form_plugin.action_backend]()
         return action_backend.form_valid(self, instance, request, form)
@@ -109,50 +228,216 @@ class FormPlugin(FieldContainer):
 
     def process_form(self, instance, request):
         form_class = self.get_form_class(instance)
+        is_submitted = request.POST.get('form_plugin_id') == str(instance.id)
+
+        if is_submitted and self.get_rate_limit_retry_after(instance, request) is not None:
+            # Don't bind nor validate the data.
+            form = form_class(form_plugin=instance, request=request)
+            form.is_rate_limited = True
+            form._add_error(message=self.rate_limit_message)
+            return form
+
         form_kwargs = self.get_form_kwargs(instance, request)
         form = form_class(**form_kwargs)
 
         if request.POST.get('form_plugin_id') == str(instance.id) and form.is_valid():
-            fields = [field for field in form.base_fields.values()
-                      if hasattr(field, '_plugin_instance')]
-
-            # pre save field hooks
-            for field in fields:
-                field._plugin_instance.form_pre_save(
-                    instance=field._model_instance,
-                    form=form,
-                    request=request,
-                )
-
-            form_pre_save.send(
-                sender=models.FormPlugin,
-                instance=instance,
+            if self.claim_submission_token(instance, form):
+                try:
+                    self.process_valid_form(instance, request, form)
+                except Exception:
+                    # Allow the user to try again.
+                    self.release_submission_token(instance, form)
+                    raise
+            else:
+                form.is_duplicate = True
+        elif request.POST.get('form_plugin_id') == str(instance.id) and request.method == 'POST':
+            # only call form_invalid if request is POST and form is not valid
+            self.form_invalid(instance, request, form)
+        return form
+
+    def process_valid_form(self, instance, request, form):
+        fields = [field for field in form.base_fields.values()
+                  if hasattr(field, '_plugin_instance')]
+
+        # the emails of the submission are sent together with the
+        # notifications, before their recipients are stored
+        form.submission_messages = SubmissionMessages()
+
+        # pre save field hooks
+        for field in fields:
+            field._plugin_instance.form_pre_save(
+                instance=field._model_instance,
                 form=form,
                 request=request,
             )
 
-            self.form_valid(instance, request, form)
+        form_pre_save.send(
+            sender=models.FormPlugin,
+            instance=instance,
+            form=form,
+            request=request,
+        )
 
-            # post save field hooks
-            for field in fields:
-                field._plugin_instance.form_post_save(
-                    instance=field._model_instance,
-                    form=form,
-                    request=request,
-                )
+        # the hooks may have changed the cleaned data, e.g. file uploads
+        form.reset_serialized_fields()
 
-            form_post_save.send(
-                sender=models.FormPlugin,
-                instance=instance,
+        # emails of the fields, collected before the submission is saved
+        # so that the outbox queues them with the notifications
+        for field in fields:
+            field._plugin_instance.form_pre_notify(
+                instance=field._model_instance,
                 form=form,
                 request=request,
             )
-        elif request.POST.get('form_plugin_id') == str(instance.id) and request.method == 'POST':
-            # only call form_invalid if request is POST and form is not valid
-            self.form_invalid(instance, request, form)
-        return form
+
+        self.form_valid(instance, request, form)
+
+        # post save field hooks
+        for field in fields:
+            field._plugin_instance.form_post_save(
+                instance=field._model_instance,
+                form=form,
+                request=request,
+            )
+
+        form_post_save.send(
+            sender=models.FormPlugin,
+            instance=instance,
+            form=form,
+            request=request,
+        )
+
+        # the messages added after the notifications were sent,
+        # the submission is already saved
+        form.submission_messages.send(fail_silently=True)
+
+    def get_submission_token_cache_key(self, instance, form):
+        token = form.cleaned_data.get('submission_token')
+
+        if not token:
+            return None
+        return 'aldryn_forms:submission_token:{}:{}'.format(instance.pk, token)
+
+    def claim_submission_token(self, instance, form):
+        """
+        Returns False if the form was already submitted with the same
+        token within ALDRYN_FORMS_SUBMISSION_TOKEN_TIMEOUT seconds.
+        """
+        cache_key = self.get_submission_token_cache_key(instance, form)
+
+        if cache_key is None:
+            # Posted by a client which didn't render the form.
+            return True
+
+        timeout = getattr(settings, 'ALDRYN_FORMS_SUBMISSION_TOKEN_TIMEOUT', 3600)
+        return cache.add(cache_key, True, timeout)
+
+    def release_submission_token(self, instance, form):
+        cache_key = self.get_submission_token_cache_key(instance, form)
+
+        if cache_key is not None:
+            cache.delete(cache_key)
+
+    def get_rate_limit_client(self, instance, request):
+        if instance.rate_limit_by == instance.RATE_LIMIT_BY_SESSION:
+            session = getattr(request, 'session', None)
+
+            if session is not None and session.session_key:
+                return 'session:' + session.session_key
+            # Clients without a session are limited by IP address.
+
+        header = getattr(settings, 'ALDRYN_FORMS_RATE_LIMIT_IP_HEADER', 'REMOTE_ADDR')
+        trusted_proxies = getattr(settings, 'ALDRYN_FORMS_RATE_LIMIT_TRUSTED_PROXIES', 1)
+        addresses = [address.strip() for address in request.META.get(header, '').split(',')]
+        addresses = [address for address in addresses if address]
+
+        if addresses:
+            # Each proxy appends the address it got the request from, the
+            # addresses before the ones added by our proxies can be spoofed.
+            ip_address = addresses[-min(max(trusted_proxies, 1), len(addresses))]
+        else:
+            ip_address = request.META.get('REMOTE_ADDR', '')
+        return 'ip:' + ip_address
+
+    def get_rate_limit_retry_after(self, instance, request):
+        """
+        Counts the submission and returns the number of seconds to wait if
+        the client went over the limits of the form, None otherwise.
+
+        Submissions are counted once per request.
+        """
+        limits = [
+            (instance.rate_limit_burst, 60),
+            (instance.rate_limit_sustained, 3600),
+        ]
+        limits = [(limit, period) for limit, period in limits if limit]
+
+        if not instance.rate_limit_by or not limits:
+            return None
+
+        checked = getattr(request, '_aldryn_forms_rate_limits', None)
+
+        if checked is None:
+            checked = request._aldryn_forms_rate_limits = {}
+
+        if instance.pk in checked:
+            return checked[instance.pk]
+
+        client = self.get_rate_limit_client(instance, request)
+        client_hash = hashlib.md5(client.encode('utf-8')).hexdigest()
+        now = time.time()
+        retry_after = None
+
+        for limit, period in limits:
+            window = int(now // period)
+            cache_key = 'aldryn_forms:rate_limit:{}:{}:{}:{}'.format(instance.pk, period, window, client_hash)
+            # add() and incr() are atomic, the counter is shared by all processes.
+            cache.add(cache_key, 0, period)
+
+            try:
+                count = cache.incr(cache_key)
+            except ValueError:
+                # Expired in between.
+                cache.add(cache_key, 1, period)
+                count = 1
+
+            if count > limit:
+                retry_after = max(retry_after or 0, int((window + 1) * period - now) + 1)
+
+        checked[instance.pk] = retry_after
+        return retry_after
+
+    def get_rate_limited_response(self, instance, request, retry_after):
+        response = HttpResponse(self.rate_limit_message, status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(retry_after)
+        return response
 
     def get_form_class(self, instance):
+        """
+        Returns the form class for the given instance.
+
+        The class is cached until any of the instance's descendants changes.
+        """
+        cache_key = self.get_form_class_cache_key(instance)
+        form_class = self.form_class_cache.get(cache_key)
+
+        if form_class is None:
+            form_class = self.build_form_class(instance)
+            self.form_class_cache.set(cache_key, form_class)
+        return form_class
+
+    def get_form_class_cache_key(self, instance):
+        return (
+            instance.plugin_type,
+            instance.pk,
+            instance.language,
+            # Changed in the database for every process, the tree
+            # version only if the django cache is shared.
+            instance.form_schema_generation,
+            get_plugin_tree_version(instance),
+        )
+
+    def build_form_class(self, instance):
         """
         Constructs form class basing on children plugin instances.
         """
@@ -165,7 +450,15 @@ class FormPlugin(FieldContainer):
 
     def get_form_fields(self, instance: models.FormPlugin) -> Dict:
         form_fields = {}
-        fields = instance.get_form_fields()
+        fields = instance.get_form_field_index().fields
+
+        # Load the options of all choice fields in a single query,
+        # plugins loaded from the form schema have them already.
+        prefetch_related_objects(
+            [field.plugin_instance for field in fields
+             if isinstance(field.plugin_instance, models.FieldPlugin)],
+            'option_set',
+        )
 
         for field in fields:
             plugin_instance = field.plugin_instance
@@ -190,10 +483,14 @@ class FormPlugin(FieldContainer):
         return instance.success_url
 
     def send_notifications(self, instance, form):
-        users = instance.recipients.exclude(email='')
+        if instance.is_digest_enabled():
+            # see aldryn_forms_send_digests
+            return []
+
+        users_notified = instance.get_notification_recipients()
 
-        recipients = [user for user in users.iterator()
-                      if is_valid_recipient(user.email)]
+        if not users_notified:
+            return []
 
         context = {
             'form_name': instance.name,
@@ -201,15 +498,13 @@ class FormPlugin(FieldContainer):
             'form_plugin': instance,
         }
 
-        send_mail(
-            recipients=[user.email for user in recipients],
+        message = construct_mail(
+            recipients=[email for name, email in users_notified],
             context=context,
             template_base='aldryn_forms/emails/notification',
             language=instance.language,
         )
-
-        users_notified = [
-            (get_user_name(user), user.email) for user in recipients]
+        send_form_messages(form, [message])
         return users_notified
 
 
@@ -240,7 +535,7 @@ class Fieldset(FieldContainer):
             # unfortunately, there's no builtin way to enforce this on the cms
             form_plugin = None
         templates = self.get_template_names(instance, form_plugin)
-        return select_template(templates)
+        return select_cached_template(templates)
 
     def get_template_names(self, instance, form_plugin=None):
         template_names = ['aldryn_forms/fieldset.html']
@@ -285,7 +580,7 @@ class Field(FormElement):
     ]
 
     def serialize_value(self, instance, value, is_confirmation=False):
-        if isinstance(value, query.QuerySet):
+        if isinstance(value, (list, tuple, query.QuerySet)):
             value = u', '.join(map(str, value))
         elif value is None:
             value = '-'
@@ -381,7 +676,7 @@ class Field(FormElement):
             # unfortunately, there's no builtin way to enforce this on the cms
             form_plugin = None
         templates = self.get_template_names(instance, form_plugin)
-        return select_template(templates)
+        return select_cached_template(templates)
 
     def get_fieldsets(self, request, obj=None):
         if self.fieldsets or self.fields:
@@ -438,6 +733,9 @@ class Field(FormElement):
     def form_pre_save(self, instance, form, **kwargs):
         pass
 
+    def form_pre_notify(self, instance, form, **kwargs):
+        pass
+
     def form_post_save(self, instance, form, **kwargs):
         pass
 
@@ -555,14 +853,15 @@ class EmailField(BaseTextField):
             'form_data': form.get_serialized_field_choices(is_confirmation=True),
             'body_text': form_field_instance.email_body,
         }
-        send_mail(
+        message = construct_mail(
             recipients=[email],
             context=context,
             subject=form_field_instance.email_subject,
             template_base=self.email_template_base
         )
+        collect_form_messages(form, [message])
 
-    def form_post_save(self, instance, form, **kwargs):
+    def form_pre_notify(self, instance, form, **kwargs):
         field_name = form.form_plugin.get_form_field_name(field=instance)
 
         email = form.cleaned_data.get(field_name)
@@ -724,7 +1023,7 @@ class SelectField(Field):
     name = _('Select Field')
 
     form = SelectFieldForm
-    form_field = forms.ModelChoiceField
+    form_field = OptionChoiceField
     form_field_widget = form_field.widget
     form_field_enabled_options = [
         'label',
@@ -748,8 +1047,10 @@ class SelectField(Field):
 
     def get_form_field_kwargs(self, instance):
         kwargs = super(SelectField, self).get_form_field_kwargs(instance)
-        kwargs['queryset'] = instance.option_set.all()
-        for opt in kwargs['queryset']:
+        # The options are prefetched for the whole form,
+        # the field validates against them without querying.
+        kwargs['options'] = list(instance.option_set.all())
+        for opt in kwargs['options']:
             if opt.default_value:
                 kwargs['initial'] = opt.pk
                 break
@@ -760,7 +1061,7 @@ class MultipleSelectField(SelectField):
     name = _('Multiple Select Field')
 
     form = MultipleSelectFieldForm
-    form_field = forms.ModelMultipleChoiceField
+    form_field = OptionMultipleChoiceField
     form_field_widget = forms.CheckboxSelectMultiple
     form_field_enabled_options = [
         'label',
@@ -791,7 +1092,7 @@ class MultipleSelectField(SelectField):
         if hasattr(instance, 'min_value') and instance.min_value == 0:
             kwargs['required'] = False
 
-        kwargs['initial'] = [o.pk for o in kwargs['queryset'] if o.default_value]
+        kwargs['initial'] = [o.pk for o in kwargs['options'] if o.default_value]
         return kwargs
 
 
@@ -803,7 +1104,7 @@ class RadioSelectField(Field):
     name = _('Radio Select Field')
 
     form = RadioFieldForm
-    form_field = forms.ModelChoiceField
+    form_field = OptionChoiceField
     form_field_widget = forms.RadioSelect
     form_field_enabled_options = [
         'label',
@@ -827,9 +1128,9 @@ class RadioSelectField(Field):
 
     def get_form_field_kwargs(self, instance):
         kwargs = super(RadioSelectField, self).get_form_field_kwargs(instance)
-        kwargs['queryset'] = instance.option_set.all()
+        kwargs['options'] = list(instance.option_set.all())
         kwargs['empty_label'] = None
-        for opt in kwargs['queryset']:
+        for opt in kwargs['options']:
             if opt.default_value:
                 kwargs['initial'] = opt.pk
                 break
@@ -844,6 +1145,8 @@ else:
     # Don't like doing this. But we shouldn't force captcha.
     class CaptchaField(Field):
         name = _('Captcha Field')
+        # Each rendering generates a new challenge.
+        markup_cacheable = False
         form = CaptchaFieldForm
         form_field = CaptchaField
         form_field_widget = CaptchaTextInput
@@ -0,0 +1,78 @@
+"""
+Compression of the FormSubmission.data payloads.
+
+Compressed payloads are stored as text, a format marker followed by the
+base64 encoded compressed JSON. Payloads without a marker are plain JSON,
+so rows written before compression was enabled are read unchanged.
+"""
+import base64
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZLIB_MARKER = 'zlib:'
+ZSTD_MARKER = 'zstd:'
+
+
+def get_compression():
+    compression = getattr(settings, 'ALDRYN_FORMS_DATA_COMPRESSION', 'auto')
+
+    if compression == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+
+    if compression == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('ALDRYN_FORMS_DATA_COMPRESSION is "zstd" but zstandard is not installed.')
+    return compression
+
+
+def compress_data(data):
+    """
+    Returns the data compressed if it's longer than
+    ALDRYN_FORMS_DATA_COMPRESSION_THRESHOLD characters.
+    """
+    threshold = getattr(settings, 'ALDRYN_FORMS_DATA_COMPRESSION_THRESHOLD', 2048)
+    compression = get_compression()
+
+    if threshold is None or not compression or len(data) < threshold:
+        return data
+
+    raw = data.encode('utf-8')
+
+    if compression == 'zstd':
+        marker, compressed = ZSTD_MARKER, zstandard.ZstdCompressor().compress(raw)
+    else:
+        marker, compressed = ZLIB_MARKER, zlib.compress(raw, 6)
+
+    encoded = marker + base64.b64encode(compressed).decode('ascii')
+
+    if len(encoded) >= len(data):
+        # Not worth it, e.g. for random values.
+        return data
+    return encoded
+
+
+def decompress_data(data):
+    if data.startswith(ZLIB_MARKER):
+        try:
+            raw = zlib.decompress(base64.b64decode(data[len(ZLIB_MARKER):]))
+        except zlib.error as error:
+            raise ValueError(error)
+    elif data.startswith(ZSTD_MARKER):
+        if zstandard is None:
+            raise ImproperlyConfigured('zstandard is required to read this form submission.')
+
+        try:
+            raw = zstandard.ZstdDecompressor().decompress(base64.b64decode(data[len(ZSTD_MARKER):]))
+        except zstandard.ZstdError as error:
+            raise ValueError(error)
+    else:
+        return data
+    return raw.decode('utf-8')
@@ -3,13 +3,13 @@ from email.utils import parseaddr
 from typing import List
 
 from django.contrib import admin
-from django.core.mail import get_connection
 from django.template.defaultfilters import safe
 from django.utils.translation import ugettext_lazy as _
 
 from cms.plugin_pool import plugin_pool
 
 from aldryn_forms.cms_plugins import FormPlugin
+from aldryn_forms.outbox import send_form_messages
 from aldryn_forms.validators import is_valid_recipient
 
 from .models import EmailNotification, EmailNotificationFormPlugin
@@ -57,6 +57,13 @@ class ExistingEmailNotificationInline(admin.StackedInline):
                 'reply_to_email',
             )
         }),
+        (_('Digest'), {
+            'classes': ('collapse',),
+            'fields': (
+                ('digest_frequency', 'digest_count'),
+                'digest_csv',
+            )
+        }),
     )
 
     readonly_fields = ['text_variables']
@@ -155,6 +162,13 @@ class EmailNotificationForm(FormPlugin):
                 'action_backend',
             )
         }),
+        (_('Rate limiting'), {
+            'classes': ('collapse',),
+            'fields': (
+                'rate_limit_by',
+                ('rate_limit_burst', 'rate_limit_sustained'),
+            )
+        }),
     )
 
     def get_inline_instances(self, request, obj=None):
@@ -168,21 +182,31 @@ class EmailNotificationForm(FormPlugin):
         return inlines
 
     def send_notifications(self, instance, form):
+        emails, recipients = self.prepare_notifications(instance, form)
+
+        if not emails:
+            return recipients
+
         try:
-            connection = get_connection(fail_silently=False)
-            connection.open()
+            send_form_messages(form, emails)
         except:  # noqa
             # I use a "catch all" in order to not couple this handler to a specific email backend
             # different email backends have different exceptions.
             logger.exception("Could not send notification emails.")
-            return []
+            recipients = []
+        return recipients
 
-        notifications = instance.email_notifications.select_related('form')
+    def prepare_notifications(self, instance, form):
+        notifications = instance.get_email_notifications()
 
         emails = []
         recipients = []
 
         for notification in notifications:
+            if notification.is_digest_enabled():
+                # see aldryn_forms_send_digests
+                continue
+
             email = notification.prepare_email(form=form)
 
             to_email = email.to[0]
@@ -190,14 +214,7 @@ class EmailNotificationForm(FormPlugin):
             if is_valid_recipient(to_email):
                 emails.append(email)
                 recipients.append(parseaddr(to_email))
-
-        try:
-            connection.send_messages(emails)
-        except:  # noqa
-            # again, we catch all exceptions to be backend agnostic
-            logger.exception("Could not send notification emails.")
-            recipients = []
-        return recipients
+        return emails, recipients
 
 
 plugin_pool.register_plugin(EmailNotificationForm)
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_notifications', '0006_emailnotification_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailnotification',
+            name='last_digest_submission_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
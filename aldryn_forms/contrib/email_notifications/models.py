@@ -4,6 +4,8 @@ from functools import partial
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext
 from django.utils.translation import ugettext_lazy as _
 
@@ -11,7 +13,10 @@ from djangocms_text_ckeditor.fields import HTMLField
 from emailit.api import construct_mail
 
 from aldryn_forms.helpers import get_user_name
-from aldryn_forms.models import FormPlugin
+from aldryn_forms.models import (
+    FormPlugin, NotificationDigest, notifications_changed,
+)
+from aldryn_forms.schema import dump_instance, load_instance
 
 from .helpers import (
     get_email_template_name, get_theme_template_name, render_text,
@@ -25,6 +30,13 @@ EMAIL_THEMES = getattr(
 )
 
 
+def dump_user(user):
+    data = dump_instance(user)
+    # Not needed to send an email, keep it out of the cache.
+    data['values'].pop('password', None)
+    return data
+
+
 class EmailNotificationFormPlugin(FormPlugin):
     class Meta:
         proxy = True
@@ -35,6 +47,33 @@ class EmailNotificationFormPlugin(FormPlugin):
             item.form = self
             item.save()
 
+    def dump_notifications(self):
+        notifications = super(EmailNotificationFormPlugin, self).dump_notifications()
+        notifications['email_notifications'] = [
+            {
+                'notification': dump_instance(notification),
+                'to_user': dump_user(notification.to_user) if notification.to_user_id else None,
+            }
+            for notification in self.email_notifications.select_related('to_user')
+        ]
+        return notifications
+
+    def get_email_notifications(self):
+        """
+        Returns the email notifications of the form,
+        with their users, without queries once cached.
+        """
+        notifications = []
+
+        for data in self.get_cached_notifications()['email_notifications']:
+            notification = load_instance(data['notification'])
+
+            if data['to_user'] is not None:
+                notification.to_user = load_instance(data['to_user'])
+            notification.form = self
+            notifications.append(notification)
+        return notifications
+
     def get_notification_conf(self):
         plugin_class = self.get_plugin_class()
         return plugin_class.notification_conf_class(form_plugin=self)
@@ -50,7 +89,7 @@ class EmailNotificationFormPlugin(FormPlugin):
         return choices
 
 
-class EmailNotification(models.Model):
+class EmailNotification(NotificationDigest):
 
     class Meta:
         verbose_name = _('Email notification')
@@ -148,6 +187,22 @@ class EmailNotification(models.Model):
             email = ''
         return email
 
+    def get_recipient(self, text_context):
+        """
+        Returns the recipient address, which can use the text variables.
+        """
+        render = partial(render_text, context=text_context)
+
+        recipient_name = self.get_recipient_name()
+
+        recipient_email = self.get_recipient_email()
+        recipient_email = render(recipient_email)
+
+        if recipient_name:
+            recipient_name = render(recipient_name)
+            recipient_email = formataddr((recipient_name, recipient_email))
+        return recipient_email
+
     def get_email_context(self, form):
         get_template = partial(get_theme_template_name, theme=self.theme)
 
@@ -190,16 +245,7 @@ class EmailNotification(models.Model):
 
         render = partial(render_text, context=text_context)
 
-        recipient_name = self.get_recipient_name()
-
-        recipient_email = self.get_recipient_email()
-        recipient_email = render(recipient_email)
-
-        if recipient_name:
-            recipient_name = render(recipient_name)
-            recipient_email = formataddr((recipient_name, recipient_email))
-
-        kwargs['recipients'] = [recipient_email]
+        kwargs['recipients'] = [self.get_recipient(text_context)]
 
         if self.from_email:
             from_email = render(self.from_email)
@@ -228,3 +274,17 @@ class EmailNotification(models.Model):
 
     def render_subject(self, context):
         return render_text(self.subject, context)
+
+
+@receiver([post_save, post_delete], sender=EmailNotification, dispatch_uid='aldryn_forms_email_notification_changed')
+def email_notification_changed(sender, instance, **kwargs):
+    notifications_changed([instance.form_id])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid='aldryn_forms_notification_user_saved')
+def notification_user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+
+    form_ids = EmailNotification.objects.filter(to_user=instance).values_list('form_id', flat=True)
+    notifications_changed(set(form_ids))
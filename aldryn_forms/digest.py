@@ -0,0 +1,81 @@
+"""
+Digests of the new submissions of a form, sent by the
+aldryn_forms_send_digests command to the recipients of the form plugins
+and of the email notifications with a digest frequency.
+
+The submissions are matched by form name and language, like the export,
+since publishing a page recreates its form plugins.
+"""
+from django.conf import settings
+from django.utils.text import slugify
+
+from emailit.api import construct_mail
+
+from .admin.exporter import Exporter
+from .models import FormSubmission
+
+
+def get_digest_submissions(form_plugin, since_id, until_id):
+    """
+    Returns the submissions of the form stored after the submission
+    since_id, up to until_id included.
+    """
+    return FormSubmission.objects.filter(
+        name=form_plugin.name,
+        language=form_plugin.language,
+        pk__gt=since_id,
+        pk__lte=until_id,
+    )
+
+
+def get_digest_csv(submissions):
+    exporter = Exporter(queryset=submissions)
+    latest_fields, old_fields = exporter.get_fields_for_export()
+    fields = [field.field_id for field in latest_fields + old_fields]
+    return exporter.get_dataset(fields=fields).export('csv')
+
+
+def construct_digest(recipients, form_plugin, submissions, attach_csv=False, **kwargs):
+    """
+    Returns the digest email of the given submissions.
+    Only the first ALDRYN_FORMS_DIGEST_MAX_SUBMISSIONS are listed
+    in the body, the csv attachment holds all of them.
+    """
+    max_submissions = getattr(settings, 'ALDRYN_FORMS_DIGEST_MAX_SUBMISSIONS', 100)
+    submission_count = submissions.count()
+    listed = [
+        {
+            'sent_at': submission.sent_at,
+            'form_data': [(field.label, field.value) for field in submission.get_form_data()],
+        }
+        for submission in submissions.only('data', 'schema_version', 'sent_at')[:max_submissions]
+    ]
+    context = {
+        'form_name': form_plugin.name,
+        'form_plugin': form_plugin,
+        'submission_count': submission_count,
+        'submissions': listed,
+        'more_count': submission_count - len(listed),
+    }
+
+    message = construct_mail(
+        recipients=recipients,
+        context=context,
+        template_base='aldryn_forms/emails/digest',
+        language=form_plugin.language,
+        **kwargs
+    )
+
+    if attach_csv:
+        filename = '{}.csv'.format(slugify(form_plugin.name) or 'submissions')
+        message.attach(filename, get_digest_csv(submissions), 'text/csv')
+    return message
+
+
+def get_submission_text_context(form_plugin, submission):
+    """
+    Returns the text variables of an email notification for the submission.
+    """
+    text_context = {field.name: field.value for field in submission.get_form_data()}
+    text_context['form_name'] = form_plugin.name
+    return text_context
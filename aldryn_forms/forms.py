@@ -1,5 +1,8 @@
+from uuid import uuid4
+
 from django import forms
 from django.conf import settings
+from django.db import transaction
 from django.forms.forms import NON_FIELD_ERRORS
 from django.forms.utils import ErrorDict
 from django.utils.translation import ugettext
@@ -80,6 +83,102 @@ class RestrictedImageField(FileSizeCheckMixin, forms.ImageField):
         return data
 
 
+class OptionChoiceField(forms.ChoiceField):
+    """
+    Choice field over the options of a select plugin.
+
+    Submitted values are the option pks, they're looked up
+    in memory instead of querying the database.
+    """
+
+    def __init__(self, options=(), empty_label='---------', **kwargs):
+        super(OptionChoiceField, self).__init__(**kwargs)
+
+        if self.required and self.initial is not None:
+            self.empty_label = None
+        else:
+            self.empty_label = empty_label
+        self.options = options
+
+    @property
+    def options(self):
+        return list(self._options.values())
+
+    @options.setter
+    def options(self, options):
+        self._options = dict((str(option.pk), option) for option in options)
+        self.choices = self.get_option_choices()
+
+    def get_option_choices(self):
+        choices = [(option.pk, str(option)) for option in self.options]
+
+        if self.empty_label is not None:
+            choices.insert(0, ('', self.empty_label))
+        return choices
+
+    def get_option(self, value):
+        try:
+            return self._options[str(value)]
+        except KeyError:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+
+    def prepare_value(self, value):
+        if hasattr(value, '_meta'):
+            return value.pk
+        return super(OptionChoiceField, self).prepare_value(value)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        return self.get_option(value)
+
+    def validate(self, value):
+        # to_python() has already checked the value is a valid option.
+        forms.Field.validate(self, value)
+
+
+class OptionMultipleChoiceField(OptionChoiceField):
+    """
+    Multiple choice variant of OptionChoiceField, cleans to a list of options.
+    """
+    hidden_widget = forms.MultipleHiddenInput
+    widget = forms.SelectMultiple
+    default_error_messages = {
+        'invalid_list': _('Enter a list of values.'),
+    }
+
+    def __init__(self, options=(), **kwargs):
+        kwargs['empty_label'] = None
+        super(OptionMultipleChoiceField, self).__init__(options, **kwargs)
+
+    def prepare_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return [super(OptionMultipleChoiceField, self).prepare_value(v) for v in value]
+        return super(OptionMultipleChoiceField, self).prepare_value(value)
+
+    def to_python(self, value):
+        if not value:
+            return []
+        elif not isinstance(value, (list, tuple)):
+            raise forms.ValidationError(self.error_messages['invalid_list'], code='invalid_list')
+        return [self.get_option(v) for v in value]
+
+    def validate(self, value):
+        if self.required and not value:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+
+    def has_changed(self, initial, data):
+        if self.disabled:
+            return False
+        initial_set = set(str(value) for value in self.prepare_value(initial or []))
+        data_set = set(str(value) for value in data or [])
+        return data_set != initial_set
+
+
 class FormSubmissionBaseForm(forms.Form):
 
     # these fields are internal.
@@ -89,6 +188,20 @@ class FormSubmissionBaseForm(forms.Form):
         widget=forms.HiddenInput()
     )
     form_plugin_id = forms.IntegerField(widget=forms.HiddenInput())
+    # New on every render, a form posted twice with
+    # the same token is only processed once.
+    submission_token = forms.CharField(
+        max_length=64,
+        required=False,
+        widget=forms.HiddenInput(),
+    )
+    # Set if the submission token was already used.
+    is_duplicate = False
+    # Set if the data was ignored, see FormPlugin.get_rate_limit_retry_after().
+    is_rate_limited = False
+    # The emails sent once the submission is processed,
+    # see FormPlugin.process_valid_form().
+    submission_messages = None
 
     def __init__(self, *args, **kwargs):
         self.form_plugin = kwargs.pop('form_plugin')
@@ -100,9 +213,12 @@ class FormSubmissionBaseForm(forms.Form):
             name=self.form_plugin.name,
             language=language,
             form_url=self.request.build_absolute_uri(self.request.path),
+            form_plugin_id=self.form_plugin.pk,
         )
         self.fields['language'].initial = language
         self.fields['form_plugin_id'].initial = self.form_plugin.pk
+        self.fields['submission_token'].initial = uuid4().hex
+        self.reset_serialized_fields()
 
     def _add_error(self, message, field=NON_FIELD_ERRORS):
         try:
@@ -112,13 +228,20 @@ class FormSubmissionBaseForm(forms.Form):
                 self._errors = ErrorDict()
             self._errors[field] = self.error_class([message])
 
-    def get_serialized_fields(self, is_confirmation=False):
+    def full_clean(self):
+        self.reset_serialized_fields()
+        super(FormSubmissionBaseForm, self).full_clean()
+
+    def reset_serialized_fields(self):
         """
-        The `is_confirmation` flag indicates if the data will be used in a
-        confirmation email sent to the user submitting the form or if it will be
-        used to render the data for the recipients/admin site.
+        Drops the serialized data, to be called when the cleaned data
+        changes after validation, e.g. in a form_pre_save hook.
         """
-        for field in self.form_plugin.get_form_fields():
+        self._serialized_fields = {}
+        self._cleaned_data = {}
+
+    def _serialize_fields(self, is_confirmation):
+        for field in self.form_plugin.get_form_field_index().fields:
             plugin = field.plugin_instance.get_plugin_class_instance()
             # serialize_field can be None or SerializedFormField  namedtuple instance.
             # if None then it means we shouldn't serialize this field.
@@ -127,6 +250,21 @@ class FormSubmissionBaseForm(forms.Form):
             if serialized_field:
                 yield serialized_field
 
+    def get_serialized_fields(self, is_confirmation=False):
+        """
+        The `is_confirmation` flag indicates if the data will be used in a
+        confirmation email sent to the user submitting the form or if it will be
+        used to render the data for the recipients/admin site.
+
+        The fields are serialized once per flag, until reset_serialized_fields().
+        """
+        try:
+            fields = self._serialized_fields[is_confirmation]
+        except KeyError:
+            fields = list(self._serialize_fields(is_confirmation))
+            self._serialized_fields[is_confirmation] = fields
+        return list(fields)
+
     def get_serialized_field_choices(self, is_confirmation=False):
         """Renders the form data in a format suitable to be serialized.
         """
@@ -135,13 +273,23 @@ class FormSubmissionBaseForm(forms.Form):
         return fields
 
     def get_cleaned_data(self, is_confirmation=False):
-        fields = self.get_serialized_fields(is_confirmation)
-        form_data = dict((field.name, field.value) for field in fields)
-        return form_data
+        try:
+            form_data = self._cleaned_data[is_confirmation]
+        except KeyError:
+            fields = self.get_serialized_fields(is_confirmation)
+            form_data = dict((field.name, field.value) for field in fields)
+            self._cleaned_data[is_confirmation] = form_data
+        # callers add their own keys, e.g. the notification text context
+        return form_data.copy()
 
     def save(self, commit=False):
         self.instance.set_form_data(self)
-        self.instance.save()
+
+        with transaction.atomic():
+            self.instance.save()
+
+            if getattr(settings, 'ALDRYN_FORMS_STORE_SUBMISSION_VALUES', False):
+                self.instance.create_values()
 
 
 class ExtandableErrorForm(forms.ModelForm):
@@ -1,3 +1,8 @@
+from collections import namedtuple
+
+from cms.plugin_pool import plugin_pool
+
+
 def get_user_name(user):
     try:
         name = user.get_full_name()
@@ -7,12 +12,73 @@ def get_user_name(user):
     return name
 
 
-def is_form_element(plugin):
+# What a plugin type is within a form, see get_plugin_role()
+PluginRole = namedtuple(
+    'PluginRole',
+    field_names=[
+        'model',
+        'is_form_element',
+        'is_field',
+        'is_container',
+        'is_submit_button',
+    ]
+)
+
+_plugin_roles = {}
+
+
+def classify_plugin_class(plugin_class):
     # import here due because of circular imports
-    from .cms_plugins import FormElement
+    from .cms_plugins import Field, FieldContainer, FormElement, SubmitButton
+
+    return PluginRole(
+        model=plugin_class.model,
+        is_form_element=issubclass(plugin_class, FormElement),
+        is_field=issubclass(plugin_class, Field),
+        is_container=issubclass(plugin_class, FieldContainer),
+        is_submit_button=issubclass(plugin_class, SubmitButton),
+    )
+
+
+def get_plugin_role(plugin_type):
+    """
+    Returns the PluginRole of the given plugin type.
+
+    All the plugins known to the plugin pool are classified
+    on first use, so this is a dict lookup afterwards.
+    """
+    try:
+        return _plugin_roles[plugin_type]
+    except KeyError:
+        pass
 
+    if not _plugin_roles:
+        plugin_pool.discover_plugins()
+
+        for name, plugin_class in plugin_pool.plugins.items():
+            _plugin_roles[name] = classify_plugin_class(plugin_class)
+
+    if plugin_type not in _plugin_roles:
+        # Registered after the registry was built.
+        plugin_class = plugin_pool.get_plugin(plugin_type)
+        _plugin_roles[plugin_type] = classify_plugin_class(plugin_class)
+    return _plugin_roles[plugin_type]
+
+
+def clear_plugin_roles():
+    _plugin_roles.clear()
+
+
+def is_form_element(plugin):
+    role = get_plugin_role(plugin.plugin_type)
     # cms_plugins.CMSPlugin subclass
-    cms_plugin = plugin.get_plugin_class_instance(None)
-    is_orphan_plugin = cms_plugin.model != plugin.__class__
-    is_element_subclass = issubclass(plugin.get_plugin_class(), FormElement)
-    return (not is_orphan_plugin) and is_element_subclass
+    is_orphan_plugin = role.model != plugin.__class__
+    return (not is_orphan_plugin) and role.is_form_element
+
+
+def is_form_field(plugin):
+    return get_plugin_role(plugin.plugin_type).is_field
+
+
+def is_submit_button(plugin):
+    return get_plugin_role(plugin.plugin_type).is_submit_button
@@ -0,0 +1,189 @@
+"""
+Reusing the mail connections of a process.
+
+Opening a connection to the mail server is usually slower than sending
+a message over it, so the connections are kept open in a bounded pool
+and reused by the following submissions of the same worker.
+"""
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+
+class ConnectionPool(object):
+    """
+    Up to `size` connections used at the same time,
+    idle connections are closed after `max_idle` seconds.
+    """
+
+    def __init__(self, size=1, max_idle=30, backend=None):
+        self.size = max(1, size)
+        self.max_idle = max_idle
+        self.backend = backend
+        self._idle = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.size)
+
+    def open_connection(self):
+        connection = get_connection(backend=self.backend, fail_silently=False)
+        connection.open()
+        return connection
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:  # noqa
+            # the server may already have closed it
+            pass
+
+    def get_idle_connection(self):
+        now = time.monotonic()
+        expired = []
+        connection = None
+
+        with self._lock:
+            while self._idle:
+                idle_connection, last_used = self._idle.pop()
+
+                if self.max_idle is not None and now - last_used > self.max_idle:
+                    expired.append(idle_connection)
+                else:
+                    connection = idle_connection
+                    break
+
+        for idle_connection in expired:
+            self.close_connection(idle_connection)
+        return connection
+
+    def release_connection(self, connection):
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields an open connection, which is closed
+        instead of reused if the block raises.
+        """
+        with self._semaphore:
+            connection = self.get_idle_connection() or self.open_connection()
+
+            try:
+                yield connection
+            except BaseException:
+                self.close_connection(connection)
+                raise
+
+            self.release_connection(connection)
+
+    def send_messages(self, messages):
+        """
+        Sends the messages over up to `size` connections at the same time,
+        raises the first error once all the messages were tried.
+        """
+        messages = [message for message in messages if message.recipients()]
+
+        if not messages:
+            # don't connect to the mail server for nothing
+            return 0
+
+        workers = min(self.size, len(messages))
+
+        if workers == 1:
+            return self.send_chunk(messages)
+
+        chunks = [messages[start::workers] for start in range(workers)]
+        executor = get_executor()
+        futures = [executor.submit(self.send_chunk, chunk) for chunk in chunks]
+        wait(futures)
+
+        for future in futures:
+            # raises the error of the chunk, if any
+            future.result()
+        return sum(future.result() for future in futures)
+
+    def send_chunk(self, messages):
+        with self._semaphore:
+            connection = self.get_idle_connection()
+
+            if connection is not None:
+                try:
+                    # Alone, so that nothing was sent if it fails.
+                    sent = connection.send_messages(messages[:1]) or 0
+                except smtplib.SMTPServerDisconnected:
+                    # The server closed the idle connection,
+                    # try once more over a new one.
+                    self.close_connection(connection)
+                except BaseException:
+                    self.close_connection(connection)
+                    raise
+                else:
+                    return sent + self.send_over(connection, messages[1:])
+            return self.send_over(self.open_connection(), messages)
+
+    def send_over(self, connection, messages):
+        try:
+            sent = connection.send_messages(messages) or 0
+        except BaseException:
+            self.close_connection(connection)
+            raise
+
+        self.release_connection(connection)
+        return sent
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection, last_used in idle:
+            self.close_connection(connection)
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the threads of this process sending the chunks of messages,
+    up to ALDRYN_FORMS_EMAIL_CONCURRENCY at the same time.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, getattr(settings, 'ALDRYN_FORMS_EMAIL_CONCURRENCY', 2)),
+                thread_name_prefix='aldryn-forms-mail',
+            )
+    return _executor
+
+
+def get_connection_pool():
+    """
+    Returns the connection pool of this process, configured by
+    ALDRYN_FORMS_EMAIL_CONCURRENCY and ALDRYN_FORMS_EMAIL_CONNECTION_MAX_IDLE.
+    """
+    key = (
+        settings.EMAIL_BACKEND,
+        getattr(settings, 'ALDRYN_FORMS_EMAIL_CONCURRENCY', 2),
+        getattr(settings, 'ALDRYN_FORMS_EMAIL_CONNECTION_MAX_IDLE', 30),
+    )
+
+    with _connection_pools_lock:
+        try:
+            pool = _connection_pools[key]
+        except KeyError:
+            pool = _connection_pools[key] = ConnectionPool(
+                size=key[1],
+                max_idle=key[2],
+                backend=key[0],
+            )
+    return pool
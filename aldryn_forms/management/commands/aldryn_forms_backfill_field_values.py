@@ -0,0 +1,71 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from aldryn_forms.models import FormSubmission, get_field_values
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills FormSubmission.field_values for the submissions stored before '
+        'ALDRYN_FORMS_STORE_FIELD_VALUES was enabled. '
+        'Runs in batches and can be interrupted and started again at any time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of submissions updated per transaction.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches, to go easy on the database.',
+        )
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'ALDRYN_FORMS_STORE_FIELD_VALUES', False):
+            raise CommandError('ALDRYN_FORMS_STORE_FIELD_VALUES is not enabled.')
+
+        batch_size = options['batch_size']
+        # Only rows which haven't been migrated yet,
+        # this is what makes the command resumable.
+        queryset = (
+            FormSubmission
+            .objects
+            .filter(field_values__isnull=True)
+            .only('pk', 'data', 'schema_version')
+            .order_by('pk')
+        )
+        last_pk = 0
+        total = 0
+
+        while True:
+            submissions = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+
+            if not submissions:
+                break
+
+            for submission in submissions:
+                submission.field_values = self.get_field_values(submission)
+
+            with transaction.atomic():
+                FormSubmission.objects.bulk_update(submissions, ['field_values'])
+
+            last_pk = submissions[-1].pk
+            total += len(submissions)
+            self.stdout.write('Updated {} submissions (up to pk {})'.format(total, last_pk))
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS('Done, {} submissions updated.'.format(total)))
+
+    def get_field_values(self, submission):
+        # Broken rows get an empty mapping so they aren't picked up again.
+        return get_field_values(field._asdict() for field in submission.get_form_data())
@@ -0,0 +1,91 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from aldryn_forms.models import FormSubmission, get_form_plugin_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Sets FormSubmission.form_plugin_id on the submissions stored before it existed, '
+        'for the forms whose name and language match a single published form plugin.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of submissions updated per query.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches, to go easy on the database.',
+        )
+
+    def handle(self, *args, **options):
+        forms = (
+            FormSubmission
+            .objects
+            .filter(form_plugin_id__isnull=True)
+            .order_by()
+            .values_list('name', 'language')
+            .distinct()
+        )
+        total = 0
+
+        for name, language in list(forms):
+            form_plugin_id = self.get_form_plugin_id(name, language)
+
+            if form_plugin_id is None:
+                self.stdout.write('Skipped "{}" ({}), no single matching form.'.format(name, language))
+                continue
+
+            updated = self.update_submissions(name, language, form_plugin_id, options)
+            total += updated
+            self.stdout.write('Updated {} submissions of "{}" ({})'.format(updated, name, language))
+        self.stdout.write(self.style.SUCCESS('Done, {} submissions updated.'.format(total)))
+
+    def get_form_plugin_id(self, name, language):
+        published = []
+        others = []
+
+        for model in get_form_plugin_models():
+            plugins = model.objects.filter(name=name, language=language).select_related('placeholder')
+
+            for plugin in plugins:
+                page = plugin.placeholder.page if plugin.placeholder_id else None
+
+                if page is not None and not page.publisher_is_draft:
+                    published.append(plugin.pk)
+                else:
+                    others.append(plugin.pk)
+
+        if len(published) == 1:
+            return published[0]
+
+        if not published and len(others) == 1:
+            return others[0]
+        return None
+
+    def update_submissions(self, name, language, form_plugin_id, options):
+        queryset = (
+            FormSubmission
+            .objects
+            .filter(name=name, language=language, form_plugin_id__isnull=True)
+            .order_by('pk')
+        )
+        updated = 0
+
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:options['batch_size']])
+
+            if not pks:
+                return updated
+
+            updated += FormSubmission.objects.filter(pk__in=pks).update(form_plugin_id=form_plugin_id)
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from aldryn_forms.models import FormSubmission
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the FormSubmissionValue table for the submissions stored before '
+        'ALDRYN_FORMS_STORE_SUBMISSION_VALUES was enabled. '
+        'Runs in batches and can be interrupted and started again at any time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of submissions processed per transaction.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches, to go easy on the database.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Submissions without any value yet,
+        # this is what makes the command resumable.
+        queryset = (
+            FormSubmission
+            .objects
+            .filter(submission_values__isnull=True)
+            .only('pk', 'data', 'schema_version')
+            .order_by('pk')
+        )
+        last_pk = 0
+        total = 0
+
+        while True:
+            submissions = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+
+            if not submissions:
+                break
+
+            with transaction.atomic():
+                for submission in submissions:
+                    submission.create_values()
+
+            last_pk = submissions[-1].pk
+            total += len(submissions)
+            self.stdout.write('Processed {} submissions (up to pk {})'.format(total, last_pk))
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS('Done, {} submissions processed.'.format(total)))
@@ -0,0 +1,83 @@
+import hashlib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from aldryn_forms.models import FormSubmission
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates database indexes on the values of the given form fields, '
+        'used by FormSubmission.objects.filter_by_value(). '
+        'Defaults to the field names in ALDRYN_FORMS_INDEXED_FIELDS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('field_names', nargs='*', help='Names of the form fields to index.')
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Drop the indexes instead of creating them.',
+        )
+        parser.add_argument(
+            '--sql',
+            action='store_true',
+            help='Print the SQL statements instead of running them.',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        field_names = options['field_names'] or getattr(settings, 'ALDRYN_FORMS_INDEXED_FIELDS', [])
+
+        if not field_names:
+            raise CommandError('No field names given.')
+
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(
+                'Indexes on field values are only supported on PostgreSQL and SQLite.'
+            )
+
+        if options['drop']:
+            statements = [self.get_drop_sql(connection, name) for name in field_names]
+        else:
+            statements = [self.get_create_sql(connection, name) for name in field_names]
+
+        for sql in statements:
+            if options['sql']:
+                self.stdout.write(sql + ';')
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql)
+                self.stdout.write(sql)
+
+    def get_index_name(self, field_name):
+        digest = hashlib.md5(field_name.encode('utf-8')).hexdigest()[:10]
+        return 'aldryn_forms_fv_{}'.format(digest)
+
+    def get_value_expression(self, connection, field_name):
+        column = connection.ops.quote_name('field_values')
+        key = field_name.replace("'", "''")
+
+        if connection.vendor == 'postgresql':
+            # Same expression as the KeyTextTransform used for filtering.
+            return "({} ->> '{}')".format(column, key)
+        return "JSON_EXTRACT({}, '$.\"{}\"')".format(column, key.replace('"', '\\"'))
+
+    def get_create_sql(self, connection, field_name):
+        concurrently = ' CONCURRENTLY' if connection.vendor == 'postgresql' else ''
+        return 'CREATE INDEX{} IF NOT EXISTS {} ON {} ({})'.format(
+            concurrently,
+            connection.ops.quote_name(self.get_index_name(field_name)),
+            connection.ops.quote_name(FormSubmission._meta.db_table),
+            self.get_value_expression(connection, field_name),
+        )
+
+    def get_drop_sql(self, connection, field_name):
+        concurrently = ' CONCURRENTLY' if connection.vendor == 'postgresql' else ''
+        return 'DROP INDEX{} IF EXISTS {}'.format(
+            concurrently,
+            connection.ops.quote_name(self.get_index_name(field_name)),
+        )
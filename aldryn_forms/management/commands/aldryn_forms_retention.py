@@ -0,0 +1,403 @@
+import datetime
+import gzip
+import json
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from aldryn_forms.models import (
+    FormSubmission, FormSubmissionValue, get_schema_fields,
+)
+from aldryn_forms.schema import InstanceJSONEncoder, dump_instance
+
+
+def add_months(date, months):
+    years, month = divmod(date.month - 1 + months, 12)
+    return date.replace(year=date.year + years, month=month + 1, day=1)
+
+
+def get_month_start(date):
+    return datetime.datetime.combine(date, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+class MonthlyArchive(object):
+    """
+    Appends submissions to one gzipped JSON lines file per month of sent_at.
+    Each line can be restored with aldryn_forms.schema.load_instance(),
+    with the fields of its schema version under "schema_fields".
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, month):
+        return os.path.join(self.directory, 'aldryn_forms_submissions-{}.jsonl.gz'.format(month))
+
+    def get_record(self, submission):
+        record = dump_instance(submission)
+
+        if submission.schema_version_id:
+            # Keeps the archive readable on its own.
+            record['schema_fields'] = get_schema_fields(submission.schema_version_id)
+        return record
+
+    def write(self, submissions):
+        months = {}
+
+        for submission in submissions:
+            months.setdefault(submission.sent_at.strftime('%Y-%m'), []).append(submission)
+
+        for month, month_submissions in months.items():
+            # Appending adds a gzip member, the file stays readable as a whole.
+            with open(self.get_path(month), 'ab') as archive_file:
+                with gzip.GzipFile(fileobj=archive_file, mode='ab') as archive:
+                    for submission in month_submissions:
+                        line = json.dumps(self.get_record(submission), cls=InstanceJSONEncoder)
+                        archive.write(line.encode('utf-8') + b'\n')
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+
+
+class Command(BaseCommand):
+    help = (
+        'Archives and deletes the form submissions older than their retention period. '
+        'The retention is set per form name in ALDRYN_FORMS_RETENTION_DAYS, other forms use '
+        '--days or ALDRYN_FORMS_DEFAULT_RETENTION_DAYS and are kept forever without either.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Retention in days of the forms without their own retention.',
+        )
+        parser.add_argument(
+            '--form',
+            action='append',
+            dest='forms',
+            help='Only process the submissions of this form, can be repeated.',
+        )
+        parser.add_argument(
+            '--archive-dir',
+            default=getattr(settings, 'ALDRYN_FORMS_ARCHIVE_DIR', None),
+            help='Directory of the monthly archives, defaults to ALDRYN_FORMS_ARCHIVE_DIR.',
+        )
+        parser.add_argument(
+            '--no-archive',
+            action='store_true',
+            help='Delete the expired submissions without archiving them.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of submissions archived and deleted per transaction.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Seconds to wait between batches, to go easy on the database.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the number of expired submissions.',
+        )
+        parser.add_argument(
+            '--partition-sql',
+            action='store_true',
+            help='Print the SQL converting the submissions table into monthly partitions (PostgreSQL).',
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Number of monthly partitions created in advance on a partitioned table.',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.connection = connections[options['database']]
+
+        if options['partition_sql']:
+            for sql in self.get_partition_sql():
+                self.stdout.write(sql)
+            return
+
+        if options['no_archive'] or options['dry_run']:
+            self.archive = None
+        elif options['archive_dir']:
+            self.archive = MonthlyArchive(options['archive_dir'])
+        else:
+            raise CommandError('Set --archive-dir or ALDRYN_FORMS_ARCHIVE_DIR, or pass --no-archive.')
+
+        policies = self.get_policies()
+
+        if not policies:
+            raise CommandError('No retention configured.')
+
+        total = 0
+
+        if self.is_partitioned():
+            self.create_partitions()
+
+            if not options['forms'] and not options['dry_run']:
+                total += self.drop_expired_partitions(policies)
+
+        for name, cutoff in policies.items():
+            deleted = self.delete_expired(self.get_expired_submissions(name, cutoff, policies))
+            total += deleted
+
+            if deleted:
+                self.stdout.write('{} {} submissions of {}'.format(
+                    self.action_label, deleted, '"{}"'.format(name) if name else 'other forms',
+                ))
+        self.stdout.write(self.style.SUCCESS('Done, {} submissions {}.'.format(
+            total, self.action_label.lower(),
+        )))
+
+    @property
+    def action_label(self):
+        return 'Found' if self.options['dry_run'] else 'Deleted'
+
+    def get_policies(self):
+        """
+        Returns the oldest sent_at kept per form name,
+        None stands for the forms without their own retention.
+        """
+        now = timezone.now()
+        retention = dict(getattr(settings, 'ALDRYN_FORMS_RETENTION_DAYS', {}))
+        default_days = self.options['days']
+
+        if default_days is None:
+            default_days = getattr(settings, 'ALDRYN_FORMS_DEFAULT_RETENTION_DAYS', None)
+
+        if default_days is not None:
+            retention[None] = default_days
+
+        forms = self.options['forms']
+        policies = {}
+
+        for name, days in retention.items():
+            if forms and name is not None and name not in forms:
+                continue
+            policies[name] = now - datetime.timedelta(days=days)
+        return policies
+
+    def get_expired_submissions(self, name, cutoff, policies):
+        queryset = FormSubmission.objects.using(self.options['database']).filter(sent_at__lt=cutoff)
+
+        if name is not None:
+            return queryset.filter(name=name)
+
+        queryset = queryset.exclude(name__in=[name for name in policies if name is not None])
+
+        if self.options['forms']:
+            queryset = queryset.filter(name__in=self.options['forms'])
+        return queryset
+
+    def iter_batches(self, queryset):
+        queryset = queryset.order_by('pk')
+        last_pk = 0
+
+        while True:
+            # Keyset pagination, each batch is an index range scan on the pk.
+            batch = list(queryset.filter(pk__gt=last_pk)[:self.options['batch_size']])
+
+            if not batch:
+                return
+
+            last_pk = batch[-1].pk
+            yield batch
+
+            if self.options['sleep']:
+                time.sleep(self.options['sleep'])
+
+    def delete_expired(self, queryset):
+        deleted = 0
+        database = self.options['database']
+
+        for batch in self.iter_batches(queryset):
+            if not self.options['dry_run']:
+                if self.archive:
+                    # Archived before deleting, an interrupted run archives
+                    # the batch again rather than losing it.
+                    self.archive.write(batch)
+
+                with transaction.atomic(using=database):
+                    FormSubmission.objects.using(database).filter(pk__in=[obj.pk for obj in batch]).delete()
+            deleted += len(batch)
+        return deleted
+
+    # Partitioning (PostgreSQL)
+
+    @property
+    def table(self):
+        return FormSubmission._meta.db_table
+
+    def get_partition_name(self, month):
+        return '{}_y{:04d}m{:02d}'.format(self.table, month.year, month.month)
+
+    def get_partition_months(self):
+        """
+        Returns the first day of the month of the existing partitions.
+        """
+        pattern = re.compile(r'^{}_y(\d{{4}})m(\d{{2}})$'.format(re.escape(self.table)))
+        sql = (
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass'
+        )
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [self.table])
+            names = [row[0] for row in cursor.fetchall()]
+
+        months = []
+
+        for name in names:
+            match = pattern.match(name)
+
+            if match:
+                months.append(datetime.date(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+
+    def is_partitioned(self):
+        if self.connection.vendor != 'postgresql':
+            return False
+
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [self.table])
+            return cursor.fetchone() is not None
+
+    def get_create_partition_sql(self, month):
+        return 'CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({});'.format(
+            self.connection.ops.quote_name(self.get_partition_name(month)),
+            self.connection.ops.quote_name(self.table),
+            "'{}'".format(month.isoformat()),
+            "'{}'".format(add_months(month, 1).isoformat()),
+        )
+
+    def create_partitions(self):
+        this_month = timezone.now().date().replace(day=1)
+
+        if self.options['dry_run']:
+            return
+
+        with self.connection.cursor() as cursor:
+            for months in range(self.options['months_ahead'] + 1):
+                cursor.execute(self.get_create_partition_sql(add_months(this_month, months)))
+
+    def drop_expired_partitions(self, policies):
+        """
+        Archives and drops the partitions whose submissions
+        are expired for every form, instead of deleting the rows.
+        """
+        if None not in policies:
+            # The forms without a retention are kept forever.
+            return 0
+
+        cutoff = min(policies.values())
+        database = self.options['database']
+        dropped = 0
+
+        for month in self.get_partition_months():
+            end = add_months(month, 1)
+
+            if end > cutoff.date():
+                continue
+
+            queryset = FormSubmission.objects.using(database).filter(
+                sent_at__gte=get_month_start(month),
+                sent_at__lt=get_month_start(end),
+            )
+            count = 0
+
+            for batch in self.iter_batches(queryset):
+                if self.archive:
+                    self.archive.write(batch)
+
+                submission_pks = [obj.pk for obj in batch]
+                FormSubmissionValue.objects.using(database).filter(submission__in=submission_pks).delete()
+                count += len(batch)
+
+            partition = self.connection.ops.quote_name(self.get_partition_name(month))
+
+            with self.connection.cursor() as cursor:
+                cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                    self.connection.ops.quote_name(self.table), partition,
+                ))
+                cursor.execute('DROP TABLE {}'.format(partition))
+            self.stdout.write('Dropped the partition of {:%Y-%m} with {} submissions'.format(month, count))
+            dropped += count
+        return dropped
+
+    def get_partition_sql(self):
+        if self.connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on PostgreSQL.')
+
+        if self.is_partitioned():
+            raise CommandError('The submissions table is already partitioned.')
+
+        quote_name = self.connection.ops.quote_name
+        table = quote_name(self.table)
+        old_table = quote_name(self.table + '_old')
+        values_table = FormSubmissionValue._meta.db_table
+
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [self.table, 'id'])
+            sequence = cursor.fetchone()[0]
+            cursor.execute(
+                'SELECT pg_get_indexdef(indexrelid) FROM pg_index '
+                'WHERE indrelid = %s::regclass AND NOT indisprimary',
+                [self.table],
+            )
+            index_definitions = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT MIN(sent_at) FROM {}'.format(table))
+            first_sent_at = cursor.fetchone()[0] or timezone.now()
+            constraints = self.connection.introspection.get_constraints(cursor, values_table)
+
+        foreign_keys = [
+            name for name, constraint in constraints.items()
+            if constraint['foreign_key'] and constraint['foreign_key'][0] == self.table
+        ]
+        first_month = first_sent_at.date().replace(day=1)
+        last_month = add_months(timezone.now().date().replace(day=1), self.options['months_ahead'])
+
+        statements = [
+            '-- Converts {} into a table partitioned by month of sent_at.'.format(self.table),
+            '-- The primary key becomes (id, sent_at) and the foreign key from {} is dropped,'.format(values_table),
+            '-- the ORM still deletes the submission values in Python. Run it in a maintenance window.',
+            'BEGIN;',
+        ]
+        statements.extend(
+            'ALTER TABLE {} DROP CONSTRAINT {};'.format(quote_name(values_table), quote_name(name))
+            for name in foreign_keys
+        )
+        statements.extend([
+            'ALTER TABLE {} RENAME TO {};'.format(table, old_table),
+            'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS, PRIMARY KEY (id, sent_at)) '
+            'PARTITION BY RANGE (sent_at);'.format(table, old_table),
+        ])
+
+        month = first_month
+
+        while month <= last_month:
+            statements.append(self.get_create_partition_sql(month))
+            month = add_months(month, 1)
+
+        statements.extend([
+            'INSERT INTO {} SELECT * FROM {};'.format(table, old_table),
+            'ALTER SEQUENCE {} OWNED BY {}.id;'.format(sequence, table),
+            'DROP TABLE {};'.format(old_table),
+        ])
+        statements.extend(definition + ';' for definition in index_definitions)
+        statements.append('COMMIT;')
+        return statements
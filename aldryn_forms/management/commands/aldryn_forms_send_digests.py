@@ -0,0 +1,250 @@
+from collections import defaultdict
+from email.utils import formataddr
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from aldryn_forms.contrib.email_notifications.helpers import render_text
+from aldryn_forms.contrib.email_notifications.models import EmailNotification
+from aldryn_forms.digest import (
+    construct_digest, get_digest_submissions, get_submission_text_context,
+)
+from aldryn_forms.models import get_form_plugin_models, get_last_submission_id
+from aldryn_forms.outbox import send_messages
+from aldryn_forms.validators import is_valid_recipient
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the digests of the new submissions for the forms and email '
+        'notifications with a digest frequency. Run it at least every hour.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--form',
+            help='Only send the digests of the forms with this name.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Send the digests with new submissions even if they are not due yet.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the digests that would be sent.',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # The submissions stored up to now, the ones stored while
+        # the digests are sent are in the next ones.
+        last_id = get_last_submission_id()
+        sent = 0
+
+        for form_plugin in self.get_form_plugins(options):
+            sent += self.send_form_plugin_digest(form_plugin, now, last_id, options)
+
+        for notification in self.get_email_notifications(options):
+            sent += self.send_email_notification_digest(notification, now, last_id, options)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Done, {} digests would be sent.'.format(sent)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Done, {} digests sent.'.format(sent)))
+
+    def get_form_plugins(self, options):
+        """
+        Yields the published form plugins with a digest,
+        once per form name and language.
+        """
+        seen = set()
+
+        for model in get_form_plugin_models():
+            queryset = (
+                model
+                .objects
+                .exclude(digest_frequency='')
+                .exclude(placeholder__page__publisher_is_draft=True)
+                .order_by('pk')
+            )
+
+            if options['form']:
+                queryset = queryset.filter(name=options['form'])
+
+            for form_plugin in queryset.iterator():
+                key = (model, form_plugin.name, form_plugin.language)
+
+                if key not in seen:
+                    seen.add(key)
+                    yield form_plugin
+
+    def get_email_notifications(self, options):
+        """
+        Yields the email notifications with a digest of the published
+        forms, once per form name, language and recipient.
+        """
+        seen = set()
+        queryset = (
+            EmailNotification
+            .objects
+            .exclude(digest_frequency='')
+            .exclude(form__placeholder__page__publisher_is_draft=True)
+            .select_related('form', 'to_user')
+            .order_by('pk')
+        )
+
+        if options['form']:
+            queryset = queryset.filter(form__name=options['form'])
+
+        for notification in queryset.iterator():
+            key = self.get_email_notification_key(notification)
+
+            if key not in seen:
+                seen.add(key)
+                yield notification
+
+    def get_email_notification_key(self, notification):
+        return (
+            notification.form.name,
+            notification.form.language,
+            notification.to_name,
+            notification.to_email,
+            notification.to_user_id,
+        )
+
+    def is_started(self, digest):
+        return digest.last_digest_at is not None and digest.last_digest_submission_id is not None
+
+    def get_due_submissions(self, digest, form_plugin, now, last_id, options):
+        if not self.is_started(digest):
+            # Enabled without save(), start from now.
+            return None
+
+        submissions = get_digest_submissions(form_plugin, since_id=digest.last_digest_submission_id, until_id=last_id)
+
+        if options['force']:
+            is_due = submissions.exists()
+        else:
+            is_due = digest.is_digest_due(submissions.count(), now)
+        return submissions if is_due else None
+
+    def send_form_plugin_digest(self, form_plugin, now, last_id, options):
+        submissions = self.get_due_submissions(form_plugin, form_plugin, now, last_id, options)
+
+        if submissions is None:
+            if not self.is_started(form_plugin) and not options['dry_run']:
+                self.set_form_plugin_digest_sent(form_plugin, now, last_id)
+            return 0
+
+        recipients = form_plugin.get_notification_recipients()
+        # One email per recipient
+        messages = [
+            construct_digest(
+                recipients=[email],
+                form_plugin=form_plugin,
+                submissions=submissions,
+                attach_csv=form_plugin.digest_csv,
+            )
+            for name, email in recipients
+        ]
+        self.send(messages, form_plugin.name, options)
+
+        if not options['dry_run']:
+            self.set_form_plugin_digest_sent(form_plugin, now, last_id)
+        return len(messages)
+
+    def send_email_notification_digest(self, notification, now, last_id, options):
+        form_plugin = notification.form
+        submissions = self.get_due_submissions(notification, form_plugin, now, last_id, options)
+
+        if submissions is None:
+            if not self.is_started(notification) and not options['dry_run']:
+                self.set_email_notification_digest_sent(notification, now, last_id)
+            return 0
+
+        messages = []
+        text_context = {'form_name': form_plugin.name}
+        kwargs = {}
+
+        if notification.from_email:
+            from_email = render_text(notification.from_email, text_context)
+
+            if notification.from_name:
+                from_email = formataddr((render_text(notification.from_name, text_context), from_email))
+            kwargs['from_email'] = from_email
+
+        if notification.reply_to_email:
+            kwargs['reply_to'] = [render_text(notification.reply_to_email, text_context)]
+
+        for recipient, recipient_submissions in self.group_by_recipient(notification, submissions):
+            if not is_valid_recipient(recipient):
+                continue
+
+            messages.append(construct_digest(
+                recipients=[recipient],
+                form_plugin=form_plugin,
+                submissions=recipient_submissions,
+                attach_csv=notification.digest_csv,
+                **kwargs
+            ))
+        self.send(messages, form_plugin.name, options)
+
+        if not options['dry_run']:
+            self.set_email_notification_digest_sent(notification, now, last_id)
+        return len(messages)
+
+    def group_by_recipient(self, notification, submissions):
+        """
+        Yields the recipients of the notification with their submissions,
+        the recipient can depend on the submitted values.
+        """
+        form_plugin = notification.form
+
+        if '$' not in notification.to_name + notification.to_email:
+            yield notification.get_recipient({'form_name': form_plugin.name}), submissions
+            return
+
+        submission_ids = defaultdict(list)
+
+        for submission in submissions.only('data', 'schema_version').iterator():
+            text_context = get_submission_text_context(form_plugin, submission)
+            submission_ids[notification.get_recipient(text_context)].append(submission.pk)
+
+        for recipient, ids in submission_ids.items():
+            yield recipient, submissions.filter(pk__in=ids)
+
+    def send(self, messages, form_name, options):
+        if options['dry_run']:
+            for message in messages:
+                self.stdout.write('{}: digest to {}'.format(form_name, ', '.join(message.to)))
+        elif messages:
+            send_messages(messages)
+
+    def set_form_plugin_digest_sent(self, form_plugin, now, last_id):
+        # Also updates the draft plugins, published
+        # plugins are copied from them.
+        (
+            type(form_plugin)
+            .objects
+            .filter(name=form_plugin.name, language=form_plugin.language)
+            .exclude(digest_frequency='')
+            .update(last_digest_at=now, last_digest_submission_id=last_id)
+        )
+
+    def set_email_notification_digest_sent(self, notification, now, last_id):
+        form_name, language, to_name, to_email, to_user_id = self.get_email_notification_key(notification)
+        (
+            EmailNotification
+            .objects
+            .filter(
+                form__name=form_name,
+                form__language=language,
+                to_name=to_name,
+                to_email=to_email,
+                to_user_id=to_user_id,
+            )
+            .exclude(digest_frequency='')
+            .update(last_digest_at=now, last_digest_submission_id=last_id)
+        )
@@ -0,0 +1,167 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from aldryn_forms.mail import ConnectionPool
+from aldryn_forms.models import EmailOutbox
+from aldryn_forms.outbox import deserialize_message
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the emails queued in the outbox (ALDRYN_FORMS_EMAIL_OUTBOX). '
+        'Failed messages are retried with an exponential backoff. '
+        'Several workers can run at the same time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of messages claimed at once.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of messages sent concurrently, each worker reuses its own connection.',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=5,
+            help='Number of attempts before a message is marked as failed.',
+        )
+        parser.add_argument(
+            '--backoff',
+            type=int,
+            default=60,
+            help='Seconds to wait before the first retry, doubled on every attempt.',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=600,
+            help='Seconds after which a claimed message is sent again if the worker died.',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep waiting for new messages instead of exiting once the outbox is empty.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Seconds to wait for new messages with --loop.',
+        )
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        # the connections are kept open between the batches
+        self.connection_pool = ConnectionPool(size=options['workers'], max_idle=options['sleep'] * 2)
+
+        try:
+            while True:
+                messages = self.claim_messages(options)
+
+                if messages:
+                    batch_sent, batch_failed = self.send_batch(messages, options)
+                    sent += batch_sent
+                    failed += batch_failed
+                    self.stdout.write('Sent {}, failed {}'.format(batch_sent, batch_failed))
+                elif options['loop']:
+                    time.sleep(options['sleep'])
+                else:
+                    break
+        finally:
+            self.connection_pool.close()
+        self.stdout.write(self.style.SUCCESS('Done, {} sent, {} failed.'.format(sent, failed)))
+
+    def claim_messages(self, options):
+        """
+        Returns the messages due, which no other worker picks up until
+        the lease expires.
+        """
+        now = timezone.now()
+        queryset = (
+            EmailOutbox
+            .objects
+            .filter(status=EmailOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')
+        )
+
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+
+            messages = list(queryset[:options['batch_size']])
+            EmailOutbox.objects.filter(pk__in=[message.pk for message in messages]).update(
+                attempts=F('attempts') + 1,
+                next_attempt_at=now + datetime.timedelta(seconds=options['lease']),
+            )
+
+        for message in messages:
+            message.attempts += 1
+        return messages
+
+    def send_batch(self, messages, options):
+        workers = max(1, min(options['workers'], len(messages)))
+        chunks = [messages[start::workers] for start in range(workers)]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = [result for chunk_results in executor.map(self.send_messages, chunks)
+                       for result in chunk_results]
+
+        now = timezone.now()
+        sent = [message.pk for message, error in results if error is None]
+        EmailOutbox.objects.filter(pk__in=sent).update(
+            status=EmailOutbox.STATUS_SENT,
+            sent_at=now,
+            last_error='',
+        )
+
+        for message, error in results:
+            if error is None:
+                continue
+
+            if message.attempts >= options['max_attempts']:
+                status = EmailOutbox.STATUS_FAILED
+            else:
+                status = EmailOutbox.STATUS_PENDING
+
+            backoff = options['backoff'] * 2 ** (message.attempts - 1)
+            EmailOutbox.objects.filter(pk=message.pk).update(
+                status=status,
+                last_error=error,
+                next_attempt_at=now + datetime.timedelta(seconds=backoff),
+            )
+        return len(sent), len(results) - len(sent)
+
+    def send_messages(self, messages):
+        """
+        Sends the messages over a single connection, returns
+        the error of each message or None if it was sent.
+        """
+        results = []
+
+        try:
+            with self.connection_pool.connection() as mail_connection:
+                for message in messages:
+                    try:
+                        mail_connection.send_messages([deserialize_message(message.message)])
+                    except Exception as error:
+                        results.append((message, repr(error)))
+                        # the next message reconnects
+                        self.connection_pool.close_connection(mail_connection)
+                    else:
+                        results.append((message, None))
+        except Exception as error:
+            return [(message, repr(error)) for message in messages]
+        return results
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0013_add_field_is_enable_autofill_from_url_params'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formplugin',
+            name='form_schema',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='form_schema_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
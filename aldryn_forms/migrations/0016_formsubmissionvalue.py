@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0015_formsubmission_field_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormSubmissionValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_name', models.CharField(max_length=255)),
+                ('field_label', models.CharField(blank=True, max_length=255)),
+                ('occurrence', models.PositiveIntegerField(default=1)),
+                ('value', models.TextField(blank=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submission_values', to='aldryn_forms.FormSubmission')),
+            ],
+            options={
+                'verbose_name': 'Form submission value',
+                'verbose_name_plural': 'Form submission values',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='formsubmissionvalue',
+            index=models.Index(fields=['field_name', 'submission'], name='aldryn_form_field_n_sub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='formsubmissionvalue',
+            index=models.Index(fields=['submission', 'field_name', 'occurrence'], name='aldryn_form_sub_field_idx'),
+        ),
+    ]
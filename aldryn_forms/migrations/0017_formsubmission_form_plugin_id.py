@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0016_formsubmissionvalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formsubmission',
+            name='form_plugin_id',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='form plugin id'),
+        ),
+        migrations.AlterField(
+            model_name='formsubmission',
+            name='sent_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='formsubmission',
+            index=models.Index(fields=['name', 'language', 'sent_at'], name='aldryn_form_name_lang_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0018_formsubmission_sent_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormSchemaVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(editable=False, max_length=40, unique=True)),
+                ('fields', models.JSONField(editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Form schema version',
+                'verbose_name_plural': 'Form schema versions',
+            },
+        ),
+        migrations.AddField(
+            model_name='formsubmission',
+            name='schema_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='aldryn_forms.formschemaversion'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0019_formschemaversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formplugin',
+            name='rate_limit_burst',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Submissions per minute'),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='rate_limit_by',
+            field=models.CharField(blank=True, choices=[('ip', 'IP address'), ('session', 'Session')], help_text='Leave empty to accept any number of submissions.', max_length=10, verbose_name='Limit submissions by'),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='rate_limit_sustained',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Submissions per hour'),
+        ),
+    ]
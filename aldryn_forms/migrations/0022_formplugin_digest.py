@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0021_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formplugin',
+            name='digest_frequency',
+            field=models.CharField(blank=True, choices=[('hourly', 'Hourly'), ('daily', 'Daily'), ('count', 'Every N submissions')], help_text='Leave empty to send a notification on every submission.', max_length=10, verbose_name='Digest'),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='digest_count',
+            field=models.PositiveIntegerField(blank=True, help_text='Used with "Every N submissions".', null=True, verbose_name='Submissions per digest'),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='digest_csv',
+            field=models.BooleanField(default=False, verbose_name='Attach the submissions as CSV'),
+        ),
+        migrations.AddField(
+            model_name='formplugin',
+            name='last_digest_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aldryn_forms', '0022_formplugin_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formplugin',
+            name='last_digest_submission_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,31 +1,71 @@
+import datetime
+import hashlib
 import json
 import warnings
 from collections import defaultdict
 from collections import namedtuple
 from functools import partial
+from types import MappingProxyType
 from typing import List
 
 from cms.models.fields import PageField
+from cms.models.placeholdermodel import Placeholder
 from cms.models.pluginmodel import CMSPlugin
-from cms.utils.plugins import downcast_plugins
+from cms.plugin_pool import plugin_pool
+from cms.signals import post_publish
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
 from django.db import models
+from django.db.models import Count, F, Max, prefetch_related_objects
+from django.db.models.fields.json import KeyTextTransform
 from django.db.models.functions import Coalesce
+from django.db.models.signals import (
+    class_prepared, m2m_changed, post_delete, post_save, pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.autoreload import file_changed
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from djangocms_attributes_field.fields import AttributesField
 from filer.fields.folder import FilerFolderField
 
-from .compat import build_plugin_tree
-from .helpers import is_form_element
+from .compression import compress_data, decompress_data
+from .helpers import (
+    get_user_name, is_form_element, is_form_field, is_submit_button,
+)
+from .schema import dump_instance, load_instance, set_prefetched_objects
 from .sizefield.models import FileSizeField
 from .utils import ALDRYN_FORMS_ACTION_BACKEND_KEY_MAX_SIZE
+from .utils import LRUCache
 from .utils import action_backend_choices
+from .utils import build_plugin_subtree
+from .utils import clear_template_cache
+from .utils import downcast_plugin_list
+from .utils import get_ancestor_paths
+from .utils import get_nested_plugins
+from .utils import get_plugin_descendants
+from .utils import invalidate_plugin_tree_versions
+from .validators import is_valid_recipient
+
+
+try:
+    from cms import operations
+    from cms.signals import post_placeholder_operation
+except ImportError:
+    # django CMS < 3.7
+    post_placeholder_operation = None
 
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
+# Per model, proxies like EmailNotificationFormPlugin dump more.
+NOTIFICATIONS_CACHE_KEY = 'aldryn_forms:notifications:{}:{}'
+
 
 # Once djangoCMS < 3.3.1 support is dropped
 # Remove the explicit cmsplugin_ptr field declarations
@@ -50,6 +90,15 @@ FormField = namedtuple(
         'field_type_occurrence',
     ]
 )
+# Read-only index of the form fields, see BaseFormPlugin.get_form_field_index
+FormFieldIndex = namedtuple(
+    'FormFieldIndex',
+    field_names=[
+        'fields',
+        'by_pk',
+        'by_name',
+    ]
+)
 Recipient = namedtuple(
     'Recipient',
     field_names=['name', 'email']
@@ -65,6 +114,46 @@ BaseSerializedFormField = namedtuple(
 )
 
 
+DecodedSchema = namedtuple(
+    'DecodedSchema',
+    field_names=[
+        'fields',
+        'positions',
+    ]
+)
+
+
+def get_field_id(name, label, field_occurrence):
+    field_label = label.strip()
+
+    if field_label:
+        field_as_string = u'{}-{}'.format(field_label, name.rpartition('_')[0])
+    else:
+        field_as_string = name
+    return u'{}:{}'.format(field_as_string, field_occurrence)
+
+
+def get_field_occurrences(fields):
+    """
+    Returns the occurrence of each (name, label) pair, fields of the
+    same type with the same label are occurrences of the same field.
+    """
+    occurrences = defaultdict(int)
+    field_occurrences = []
+
+    for name, label in fields:
+        field_label = label.strip()
+
+        if field_label:
+            key = u'{}_{}'.format(name.rpartition('_')[0], field_label)
+        else:
+            key = name
+
+        occurrences[key] += 1
+        field_occurrences.append(occurrences[key])
+    return field_occurrences
+
+
 class SerializedFormField(BaseSerializedFormField):
 
     # For _asdict() with Py3K
@@ -72,14 +161,7 @@ class SerializedFormField(BaseSerializedFormField):
 
     @property
     def field_id(self):
-        field_label = self.label.strip()
-
-        if field_label:
-            field_as_string = u'{}-{}'.format(field_label, self.field_type)
-        else:
-            field_as_string = self.name
-        field_id = u'{}:{}'.format(field_as_string, self.field_occurrence)
-        return field_id
+        return get_field_id(self.name, self.label, self.field_occurrence)
 
     @property
     def field_type_occurrence(self):
@@ -90,7 +172,93 @@ class SerializedFormField(BaseSerializedFormField):
         return self.name.rpartition('_')[0]
 
 
-class BaseFormPlugin(CMSPlugin):
+class DecodedFormField(SerializedFormField):
+    """
+    A field read from a submission, its field id is computed once.
+    """
+    # No __slots__, the field id is kept on the instance.
+
+    @classmethod
+    def create(cls, name, label, field_occurrence, value, field_id=None):
+        # Skips the argument handling of the namedtuple constructor.
+        field = tuple.__new__(cls, (name, label, field_occurrence, value))
+
+        if field_id is None:
+            field_id = get_field_id(name, label, field_occurrence)
+        field._field_id = field_id
+        return field
+
+    @property
+    def field_id(self):
+        return self._field_id
+
+
+class NotificationDigest(models.Model):
+    """
+    Notifications sent as a periodic digest of the new submissions
+    instead of on every submission, see aldryn_forms_send_digests.
+    """
+    DIGEST_HOURLY = 'hourly'
+    DIGEST_DAILY = 'daily'
+    DIGEST_COUNT = 'count'
+    DIGEST_CHOICES = [
+        (DIGEST_HOURLY, _('Hourly')),
+        (DIGEST_DAILY, _('Daily')),
+        (DIGEST_COUNT, _('Every N submissions')),
+    ]
+    DIGEST_PERIODS = {
+        DIGEST_HOURLY: datetime.timedelta(hours=1),
+        DIGEST_DAILY: datetime.timedelta(days=1),
+    }
+
+    digest_frequency = models.CharField(
+        verbose_name=_('Digest'),
+        max_length=10,
+        choices=DIGEST_CHOICES,
+        blank=True,
+        help_text=_('Leave empty to send a notification on every submission.'),
+    )
+    digest_count = models.PositiveIntegerField(
+        verbose_name=_('Submissions per digest'),
+        blank=True,
+        null=True,
+        help_text=_('Used with "Every N submissions".'),
+    )
+    digest_csv = models.BooleanField(
+        verbose_name=_('Attach the submissions as CSV'),
+        default=False,
+    )
+    last_digest_at = models.DateTimeField(blank=True, null=True, editable=False)
+    # The digests include the submissions stored after this one, by pk
+    # rather than sent_at since buffered submissions are stored later.
+    last_digest_submission_id = models.PositiveIntegerField(blank=True, null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self.digest_frequency:
+            self.last_digest_at = None
+            self.last_digest_submission_id = None
+        elif self.last_digest_at is None or self.last_digest_submission_id is None:
+            # Only the submissions from now on.
+            self.last_digest_at = timezone.now()
+            self.last_digest_submission_id = get_last_submission_id()
+        return super(NotificationDigest, self).save(*args, **kwargs)
+
+    def is_digest_enabled(self):
+        return bool(self.digest_frequency)
+
+    def is_digest_due(self, submission_count, now):
+        if not submission_count or self.last_digest_at is None:
+            return False
+
+        if self.digest_frequency == self.DIGEST_COUNT:
+            return submission_count >= (self.digest_count or 1)
+        return now >= self.last_digest_at + self.DIGEST_PERIODS[self.digest_frequency]
+
+
+class BaseFormPlugin(NotificationDigest, CMSPlugin):
     FALLBACK_FORM_TEMPLATE = 'aldryn_forms/form.html'
     DEFAULT_FORM_TEMPLATE = getattr(
         settings, 'ALDRYN_FORMS_DEFAULT_TEMPLATE', FALLBACK_FORM_TEMPLATE)
@@ -107,8 +275,19 @@ class BaseFormPlugin(CMSPlugin):
         (REDIRECT_TO_URL, _('Absolute URL')),
     ]
 
+    RATE_LIMIT_BY_IP = 'ip'
+    RATE_LIMIT_BY_SESSION = 'session'
+    RATE_LIMIT_CHOICES = [
+        (RATE_LIMIT_BY_IP, _('IP address')),
+        (RATE_LIMIT_BY_SESSION, _('Session')),
+    ]
+
+    # Bump when the structure of form_schema changes
+    FORM_SCHEMA_FORMAT = 1
+
     _form_elements = None
-    _form_field_key_cache = None
+    _form_fields = None
+    _form_field_index = None
 
     name = models.CharField(
         verbose_name=_('Name'),
@@ -183,6 +362,31 @@ class BaseFormPlugin(CMSPlugin):
         )
     )
 
+    rate_limit_by = models.CharField(
+        verbose_name=_('Limit submissions by'),
+        max_length=10,
+        choices=RATE_LIMIT_CHOICES,
+        blank=True,
+        help_text=_('Leave empty to accept any number of submissions.'),
+    )
+    rate_limit_burst = models.PositiveIntegerField(
+        verbose_name=_('Submissions per minute'),
+        blank=True,
+        null=True,
+    )
+    rate_limit_sustained = models.PositiveIntegerField(
+        verbose_name=_('Submissions per hour'),
+        blank=True,
+        null=True,
+    )
+
+    # Denormalized copy of the form fields,
+    # saves walking the plugin tree on every request.
+    form_schema = models.TextField(blank=True, editable=False)
+    # Incremented every time the plugin tree changes,
+    # guards against writing a schema built from an outdated tree.
+    form_schema_generation = models.PositiveIntegerField(default=0, editable=False)
+
     cmsplugin_ptr = CMSPluginField(
         on_delete=models.CASCADE,
     )
@@ -222,23 +426,162 @@ class BaseFormPlugin(CMSPlugin):
         for recipient in oldinstance.recipients.all():
             self.recipients.add(recipient)
 
-    def get_submit_button(self):
-        from .cms_plugins import SubmitButton
+    def get_cached_notifications(self):
+        """
+        Returns the recipients and the other notification settings of the
+        form, kept in the django cache until they change.
+        """
+        key = NOTIFICATIONS_CACHE_KEY.format(self._meta.label_lower, self.pk)
+        notifications = cache.get(key)
+
+        if notifications is None:
+            notifications = self.dump_notifications()
+            timeout = getattr(settings, 'ALDRYN_FORMS_NOTIFICATIONS_CACHE_TIMEOUT', 3600)
+            cache.set(key, notifications, timeout=timeout)
+        return notifications
+
+    def dump_notifications(self):
+        users = self.recipients.exclude(email='')
+        recipients = [
+            (get_user_name(user), user.email) for user in users.iterator()
+            if is_valid_recipient(user.email)
+        ]
+        return {'recipients': recipients}
+
+    def get_notification_recipients(self):
+        """
+        Returns the (name, email) of the users notified on submit.
+        """
+        return [tuple(recipient) for recipient in self.get_cached_notifications()['recipients']]
 
+    def get_submit_button(self):
         form_elements = self.get_form_elements()
 
         for element in form_elements:
-            plugin_class = element.get_plugin_class()
-
-            if issubclass(plugin_class, SubmitButton):
+            if is_submit_button(element):
                 return element
         return
 
     def get_form_fields(self) -> List[FormField]:
-        from .cms_plugins import Field
+        return list(self.get_form_field_index().fields)
+
+    def get_form_field_index(self) -> FormFieldIndex:
+        """
+        Returns the form fields indexed by plugin pk and by name.
+
+        The index is built once per instance.
+        """
+        if self._form_field_index is None:
+            if not self.has_form_schema():
+                fields = self.get_form_fields_from_tree()
+                self.set_form_schema(fields)
+                self._form_fields = fields
+
+            fields = tuple(self._form_fields)
+            self._form_field_index = FormFieldIndex(
+                fields=fields,
+                by_pk=MappingProxyType({field.plugin_instance.pk: field for field in fields}),
+                by_name=MappingProxyType({field.name: field for field in fields}),
+            )
+        return self._form_field_index
+
+    def has_form_schema(self):
+        """
+        Returns True if the form fields can be loaded
+        without walking the plugin tree.
+        """
+        if self._form_fields is None:
+            self._form_fields = self.get_form_fields_from_schema()
+        return self._form_fields is not None
+
+    def get_form_fields_from_schema(self):
+        """
+        Returns the form fields stored in the form schema,
+        or None if the schema is missing or outdated.
+        """
+        if not self.form_schema:
+            return
+
+        schema = json.loads(self.form_schema)
+
+        if schema.get('format') != self.FORM_SCHEMA_FORMAT:
+            return
 
         fields = []
 
+        for field_data in schema['fields']:
+            plugin_instance = load_instance(field_data['plugin'])
+
+            if field_data['options'] is not None:
+                options = [load_instance(option) for option in field_data['options']]
+                set_prefetched_objects(plugin_instance, 'option_set', options)
+
+            field = FormField(
+                name=field_data['name'],
+                label=field_data['label'],
+                plugin_instance=plugin_instance,
+                field_occurrence=field_data['field_occurrence'],
+                field_type_occurrence=field_data['field_type_occurrence'],
+            )
+            fields.append(field)
+        return fields
+
+    def get_form_schema_data(self, fields):
+        field_plugins = [field.plugin_instance for field in fields]
+        option_plugins = [plugin for plugin in field_plugins if isinstance(plugin, FieldPlugin)]
+        prefetch_related_objects(option_plugins, 'option_set')
+
+        fields_data = []
+
+        for field in fields:
+            plugin_instance = field.plugin_instance
+
+            if isinstance(plugin_instance, FieldPlugin):
+                options = [dump_instance(option) for option in plugin_instance.option_set.all()]
+            else:
+                options = None
+
+            fields_data.append({
+                'name': field.name,
+                'label': field.label,
+                'field_occurrence': field.field_occurrence,
+                'field_type_occurrence': field.field_type_occurrence,
+                'plugin': dump_instance(plugin_instance),
+                'options': options,
+            })
+        return {'format': self.FORM_SCHEMA_FORMAT, 'fields': fields_data}
+
+    def set_form_schema(self, fields):
+        if self.pk is None:
+            return
+
+        schema = json.dumps(self.get_form_schema_data(fields), cls=DjangoJSONEncoder)
+        # Only write the schema if the plugin tree hasn't changed
+        # since this instance was loaded.
+        updated = (
+            self.__class__
+            .objects
+            .filter(pk=self.pk, form_schema_generation=self.form_schema_generation)
+            .update(form_schema=schema)
+        )
+
+        if updated:
+            self.form_schema = schema
+
+    def update_form_schema(self):
+        """
+        Rebuilds the form schema from the plugin tree.
+        """
+        self.refresh_from_db(fields=['form_schema', 'form_schema_generation'])
+        self.child_plugin_instances = None
+        self._form_elements = None
+        self._form_fields = None
+        self._form_field_index = None
+        self.set_form_schema(self.get_form_fields_from_tree())
+
+    def get_form_fields_from_tree(self) -> List[FormField]:
+        fields = []
+
         # A field occurrence is how many times does a field
         # with the same label and type appear within the same form.
         # This is used as an identifier for the field within multiple forms.
@@ -252,7 +595,7 @@ class BaseFormPlugin(CMSPlugin):
         form_elements = self.get_form_elements()
         field_plugins = [
             plugin for plugin in form_elements
-            if issubclass(plugin.get_plugin_class(), Field)
+            if is_form_field(plugin)
         ]
 
         for field_plugin in field_plugins:
@@ -288,45 +631,23 @@ class BaseFormPlugin(CMSPlugin):
         return fields
 
     def get_form_field_name(self, field: 'FieldPluginBase') -> str:
-        if self._form_field_key_cache is None:
-            self._form_field_key_cache = {}
-
-        is_cache_needs_update = field.pk not in self._form_field_key_cache
-        if is_cache_needs_update:
-            form_fields: List[FormField] = self.get_form_fields()
-            for form_field in form_fields:
-                self._form_field_key_cache[form_field.plugin_instance.pk] = form_field.name
-
-        return self._form_field_key_cache[field.pk]
+        return self.get_form_field_index().by_pk[field.pk].name
 
     def get_form_fields_as_choices(self):
-        fields = self.get_form_fields()
+        fields = self.get_form_field_index().fields
 
         for field in fields:
             yield (field.name, field.label)
 
     def get_form_elements(self):
-        from .utils import get_nested_plugins
-
         if self.child_plugin_instances is None:
-            descendants = self.get_descendants().order_by('path')
-            # Set parent_id to None in order to
-            # fool the build_plugin_tree function.
-            # This is sadly necessary to avoid getting all nodes
-            # higher than the form.
-            parent_id = self.parent_id
-            self.parent_id = None
-            # Important that this is a list in order to modify
-            # the current instance
-            descendants_with_self = [self] + list(descendants)
-            # Let the cms build the tree
-            build_plugin_tree(descendants_with_self)
-            # Set back the original parent
-            self.parent_id = parent_id
+            descendants = downcast_plugin_list(get_plugin_descendants(self))
+            build_plugin_subtree(self, descendants)
 
         if self._form_elements is None:
             children = get_nested_plugins(self)
-            children_instances = downcast_plugins(children)
+            # Plugins rendered by the cms are downcasted already.
+            children_instances = downcast_plugin_list(children)
             self._form_elements = [
                 p for p in children_instances if is_form_element(p)]
         return self._form_elements
@@ -551,6 +872,119 @@ class FormButtonPlugin(CMSPlugin):
         return self.label
 
 
+class FormSchemaVersionManager(models.Manager):
+
+    def get_for_fields(self, fields):
+        """
+        Returns the schema version of the given (name, label) pairs,
+        created on first use.
+        """
+        fields = [[name, label] for name, label in fields]
+        fingerprint = hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+        schema_version, created = self.get_or_create(
+            fingerprint=fingerprint,
+            defaults={'fields': fields},
+        )
+        return schema_version
+
+
+class FormSchemaVersion(models.Model):
+    """
+    The fields of a form as submitted, stored once and shared by
+    the submissions made with the same fields. Never changed.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True, editable=False)
+    fields = models.JSONField(editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FormSchemaVersionManager()
+
+    class Meta:
+        verbose_name = _('Form schema version')
+        verbose_name_plural = _('Form schema versions')
+
+    def __str__(self):
+        return self.fingerprint
+
+    def get_fields(self):
+        """
+        Returns the (name, label, field_occurrence, field_id) of each field.
+        """
+        occurrences = get_field_occurrences(self.fields)
+        return tuple(
+            (name, label, field_occurrence, get_field_id(name, label, field_occurrence))
+            for (name, label), field_occurrence in zip(self.fields, occurrences)
+        )
+
+    def decode(self):
+        fields = self.get_fields()
+        positions = {}
+
+        for position, field in enumerate(fields):
+            positions.setdefault(field[0], position)
+        return DecodedSchema(fields=fields, positions=MappingProxyType(positions))
+
+
+schema_fields_cache = LRUCache(
+    maxsize=getattr(settings, 'ALDRYN_FORMS_SCHEMA_CACHE_SIZE', 1000),
+)
+
+
+def get_decoded_schema(schema_version_id):
+    """
+    Returns FormSchemaVersion.decode() of the given
+    schema version, cached per process.
+    """
+    schema = schema_fields_cache.get(schema_version_id)
+
+    if schema is None:
+        schema = FormSchemaVersion.objects.get(pk=schema_version_id).decode()
+        schema_fields_cache.set(schema_version_id, schema)
+    return schema
+
+
+def get_schema_fields(schema_version_id):
+    return get_decoded_schema(schema_version_id).fields
+
+
+class FormSubmissionQuerySet(models.QuerySet):
+
+    def filter_by_field(self, name):
+        """
+        Returns the submissions with a value for the given field name.
+
+        Requires ALDRYN_FORMS_STORE_FIELD_VALUES.
+        """
+        return self.filter(field_values__has_key=name)
+
+    def filter_by_value(self, name, value, lookup='exact'):
+        """
+        Returns the submissions where the given field matches the value,
+        eg. filter_by_value('email', '@example.com', lookup='iendswith').
+
+        Requires ALDRYN_FORMS_STORE_FIELD_VALUES.
+        """
+        alias = '_field_value_{}'.format(len(self.query.annotations))
+        queryset = self.annotate(**{alias: KeyTextTransform(name, 'field_values')})
+        return queryset.filter(**{'{}__{}'.format(alias, lookup): value})
+
+    def value_counts(self, name):
+        """
+        Returns how many of the submissions have each value of the given field,
+        as dicts with "value" and "count" keys, most frequent first.
+
+        Requires ALDRYN_FORMS_STORE_SUBMISSION_VALUES.
+        """
+        return (
+            FormSubmissionValue
+            .objects
+            .filter(submission__in=self, field_name=name)
+            .values('value')
+            .annotate(count=Count('pk'))
+            .order_by('-count', 'value')
+        )
+
+
 class FormSubmission(models.Model):
     name = models.CharField(
         max_length=255,
@@ -559,6 +993,21 @@ class FormSubmission(models.Model):
         editable=False
     )
     data = models.TextField(blank=True, editable=False)
+    # If set, data only holds the list of values of the schema fields.
+    schema_version = models.ForeignKey(
+        FormSchemaVersion,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.PROTECT,
+    )
+    # Field name to value mapping, used to query submissions in the database.
+    field_values = models.JSONField(
+        null=True,
+        blank=True,
+        editable=False,
+        encoder=DjangoJSONEncoder,
+    )
     recipients = models.TextField(
         verbose_name=_('users notified'),
         blank=True,
@@ -576,48 +1025,100 @@ class FormSubmission(models.Model):
         max_length=255,
         blank=True,
     )
-    sent_at = models.DateTimeField(auto_now_add=True)
+    # Not a foreign key, publishing a page recreates its plugins.
+    form_plugin_id = models.PositiveIntegerField(
+        verbose_name=_('form plugin id'),
+        null=True,
+        blank=True,
+        db_index=True,
+        editable=False,
+    )
+    sent_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+
+    objects = FormSubmissionQuerySet.as_manager()
+
+    # Memoized decoding, see _load_data() and get_form_data()
+    _loaded_data = None
+    _form_data = None
 
     class Meta:
         ordering = ['-sent_at']
         verbose_name = _('Form submission')
         verbose_name_plural = _('Form submissions')
+        indexes = [
+            # Used by the export, which filters by name, language and date.
+            models.Index(
+                fields=['name', 'language', 'sent_at'],
+                name='aldryn_form_name_lang_sent_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
-    def _form_data_hook(self, data, occurrences):
-        field_label = data['label'].strip()
-
-        if field_label:
-            field_type = data['name'].rpartition('_')[0]
-            field_id = u'{}_{}'.format(field_type, field_label)
-        else:
-            field_id = data['name']
+    def _recipients_hook(self, data):
+        return Recipient(**data)
 
-        if field_id in occurrences:
-            occurrences[field_id] += 1
+    def _load_data(self):
+        """
+        Returns the parsed data, memoized until data changes.
+        """
+        key = (self.schema_version_id, self.data)
 
-        data['field_occurrence'] = occurrences[field_id]
-        return SerializedFormField(**data)
+        if self._loaded_data is None or self._loaded_data[0] != key:
+            try:
+                data = json.loads(decompress_data(self.data))
+            except ValueError:
+                # TODO: Log this?
+                data = []
 
-    def _recipients_hook(self, data):
-        return Recipient(**data)
+            if not isinstance(data, list):
+                data = []
+            self._loaded_data = (key, data)
+        return self._loaded_data[1]
 
     def get_form_data(self):
-        occurrences = defaultdict(lambda: 1)
+        data = self._load_data()
 
-        data_hook = partial(self._form_data_hook, occurrences=occurrences)
+        if self._form_data is not None and self._form_data[0] is data:
+            return list(self._form_data[1])
 
-        try:
-            form_data = json.loads(
-                self.data,
-                object_hook=data_hook,
-            )
-        except ValueError:
-            # TODO: Log this?
-            form_data = []
-        return form_data
+        if self.schema_version_id:
+            fields = get_schema_fields(self.schema_version_id)
+            form_data = [
+                DecodedFormField.create(name, label, field_occurrence, value, field_id)
+                for (name, label, field_occurrence, field_id), value in zip(fields, data)
+            ]
+        else:
+            # Submissions stored before schema versions
+            fields = [field for field in data if isinstance(field, dict)]
+            occurrences = get_field_occurrences((field['name'], field['label']) for field in fields)
+            form_data = [
+                DecodedFormField.create(field['name'], field['label'], field_occurrence, field['value'])
+                for field, field_occurrence in zip(fields, occurrences)
+            ]
+
+        self._form_data = (data, form_data)
+        return list(form_data)
+
+    def get_field_value(self, name, default=None):
+        """
+        Returns the value of the first field with the given name,
+        without decoding the other fields.
+        """
+        data = self._load_data()
+
+        if self.schema_version_id:
+            position = get_decoded_schema(self.schema_version_id).positions.get(name)
+
+            if position is None or position >= len(data):
+                return default
+            return data[position]
+
+        for field in data:
+            if isinstance(field, dict) and field.get('name') == name:
+                return field.get('value', default)
+        return default
 
     def get_recipients(self):
         try:
@@ -634,9 +1135,336 @@ class FormSubmission(models.Model):
         fields = form.get_serialized_fields(is_confirmation=False)
         fields_as_dicts = [field._asdict() for field in fields]
 
-        self.data = json.dumps(fields_as_dicts)
+        if getattr(settings, 'ALDRYN_FORMS_SCHEMA_VERSIONS', True):
+            self.schema_version = FormSchemaVersion.objects.get_for_fields(
+                (field['name'], field['label']) for field in fields_as_dicts
+            )
+            data = [field['value'] for field in fields_as_dicts]
+        else:
+            self.schema_version = None
+            data = fields_as_dicts
+
+        self.data = compress_data(json.dumps(data))
+
+        if getattr(settings, 'ALDRYN_FORMS_STORE_FIELD_VALUES', False):
+            # Stored uncompressed next to data, this roughly doubles the row size.
+            self.field_values = get_field_values(fields_as_dicts)
 
     def set_recipients(self, recipients):
         raw_recipients = [
             {'name': rec[0], 'email': rec[1]} for rec in recipients]
         self.recipients = json.dumps(raw_recipients)
+
+    def create_values(self):
+        """
+        Stores the submitted values in the FormSubmissionValue table.
+        """
+        values = [
+            FormSubmissionValue(
+                submission=self,
+                field_name=field.name,
+                field_label=field.label,
+                occurrence=field.field_occurrence,
+                value=field.value,
+            )
+            for field in self.get_form_data()
+        ]
+        return FormSubmissionValue.objects.bulk_create(values)
+
+
+class FormSubmissionValue(models.Model):
+    """
+    One row per submitted value, filled only if
+    ALDRYN_FORMS_STORE_SUBMISSION_VALUES is enabled.
+
+    Used to aggregate and filter submissions in the database.
+    """
+    submission = models.ForeignKey(
+        FormSubmission,
+        related_name='submission_values',
+        on_delete=models.CASCADE,
+    )
+    field_name = models.CharField(max_length=255)
+    field_label = models.CharField(max_length=255, blank=True)
+    occurrence = models.PositiveIntegerField(default=1)
+    value = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = _('Form submission value')
+        verbose_name_plural = _('Form submission values')
+        indexes = [
+            models.Index(
+                fields=['field_name', 'submission'],
+                name='aldryn_form_field_n_sub_idx',
+            ),
+            models.Index(
+                fields=['submission', 'field_name', 'occurrence'],
+                name='aldryn_form_sub_field_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.field_name
+
+
+class EmailOutbox(models.Model):
+    """
+    Emails waiting to be sent by the aldryn_forms_send_outbox command,
+    used if ALDRYN_FORMS_EMAIL_OUTBOX is enabled.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_SENT, _('Sent')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+
+    # See aldryn_forms.outbox.serialize_message()
+    message = models.JSONField(editable=False, encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        verbose_name=_('status'),
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    attempts = models.PositiveIntegerField(verbose_name=_('attempts'), default=0)
+    next_attempt_at = models.DateTimeField(verbose_name=_('next attempt at'), default=timezone.now)
+    last_error = models.TextField(verbose_name=_('last error'), blank=True)
+    created_at = models.DateTimeField(verbose_name=_('created at'), default=timezone.now, editable=False)
+    sent_at = models.DateTimeField(verbose_name=_('sent at'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('Email outbox message')
+        verbose_name_plural = _('Email outbox')
+        indexes = [
+            # Used by the worker to find the messages due.
+            models.Index(
+                fields=['status', 'next_attempt_at'],
+                name='aldryn_form_outbox_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.message.get('subject', '')
+
+
+def get_field_values(fields_as_dicts):
+    """
+    Returns the field name to value mapping stored
+    in FormSubmission.field_values.
+    """
+    return {field['name']: field['value'] for field in fields_as_dicts}
+
+
+def get_last_submission_id():
+    return FormSubmission.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+
+
+def get_form_plugin_models():
+    return [
+        model for model in apps.get_models()
+        if issubclass(model, BaseFormPlugin) and not model._meta.proxy
+    ]
+
+
+def get_form_plugin_types():
+    plugin_pool.discover_plugins()
+    return [
+        name for name, plugin_class in plugin_pool.plugins.items()
+        if issubclass(plugin_class.model, BaseFormPlugin)
+    ]
+
+
+def plugin_trees_changed(paths):
+    """
+    Expires the form classes and form schemas built
+    from the plugin trees at the given paths.
+    """
+    ancestor_paths = set()
+
+    for path in paths:
+        ancestor_paths.update(get_ancestor_paths(path))
+
+    if not ancestor_paths:
+        return
+
+    invalidate_plugin_tree_versions(ancestor_paths)
+
+    # Only the forms the plugins are in, most plugins aren't in any.
+    form_plugin_ids = list(
+        CMSPlugin
+        .objects
+        .filter(path__in=ancestor_paths, plugin_type__in=get_form_plugin_types())
+        .values_list('pk', flat=True)
+    )
+
+    if not form_plugin_ids:
+        return
+
+    for model in get_form_plugin_models():
+        (
+            model
+            .objects
+            .filter(pk__in=form_plugin_ids)
+            .update(
+                form_schema='',
+                form_schema_generation=F('form_schema_generation') + 1,
+            )
+        )
+
+
+def notifications_changed(form_plugin_ids):
+    """
+    Expires the cached notifications of the given form plugins.
+    """
+    labels = [
+        model._meta.label_lower for model in apps.get_models()
+        if issubclass(model, BaseFormPlugin)
+    ]
+    keys = [NOTIFICATIONS_CACHE_KEY.format(label, pk) for pk in form_plugin_ids for label in labels]
+
+    if keys:
+        cache.delete_many(keys)
+
+
+def plugin_changed(sender, instance, **kwargs):
+    if instance.path:
+        plugin_trees_changed([instance.path])
+
+    if isinstance(instance, BaseFormPlugin):
+        instance.form_schema = ''
+        notifications_changed([instance.pk])
+
+
+def connect_plugin_model(model):
+    # Plugin models are too many to list, every
+    # CMSPlugin subclass is connected when it's defined.
+    if issubclass(model, CMSPlugin):
+        post_save.connect(plugin_changed, sender=model, dispatch_uid='aldryn_forms_plugin_changed')
+        post_delete.connect(plugin_changed, sender=model, dispatch_uid='aldryn_forms_plugin_changed')
+
+
+@receiver(class_prepared, dispatch_uid='aldryn_forms_plugin_model_prepared')
+def plugin_model_prepared(sender, **kwargs):
+    connect_plugin_model(sender)
+
+
+for app_models in list(apps.all_models.values()):
+    # Defined before this module was imported.
+    for plugin_model in list(app_models.values()):
+        connect_plugin_model(plugin_model)
+
+
+@receiver(m2m_changed, dispatch_uid='aldryn_forms_recipients_changed')
+def recipients_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if isinstance(instance, BaseFormPlugin):
+        notifications_changed([instance.pk])
+    elif reverse and issubclass(model, BaseFormPlugin):
+        if pk_set is None:
+            # user.formplugin_set.clear()
+            pk_set = model.objects.filter(recipients=instance).values_list('pk', flat=True)
+        notifications_changed(pk_set)
+
+
+@receiver(post_save, sender=AUTH_USER_MODEL, dispatch_uid='aldryn_forms_recipient_saved')
+@receiver(pre_delete, sender=AUTH_USER_MODEL, dispatch_uid='aldryn_forms_recipient_deleted')
+def recipient_changed(sender, instance, update_fields=None, **kwargs):
+    # Deleting a user doesn't send m2m_changed.
+    if update_fields and set(update_fields) == {'last_login'}:
+        # Saved on every login.
+        return
+
+    for model in get_form_plugin_models():
+        notifications_changed(model.objects.filter(recipients=instance).values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Option, dispatch_uid='aldryn_forms_option_changed')
+def option_changed(sender, instance, **kwargs):
+    path = (
+        CMSPlugin
+        .objects
+        .filter(pk=instance.field_id)
+        .values_list('path', flat=True)
+        .first()
+    )
+
+    if path:
+        plugin_trees_changed([path])
+
+
+def placeholder_operation_done(sender, operation, **kwargs):
+    # Moving, cutting and pasting plugins updates
+    # the plugin tree without sending any model signals.
+    tree_operations = (
+        operations.MOVE_PLUGIN,
+        operations.CUT_PLUGIN,
+        operations.PASTE_PLUGIN,
+        operations.PASTE_PLACEHOLDER,
+        operations.ADD_PLUGINS_FROM_PLACEHOLDER,
+    )
+
+    if operation not in tree_operations:
+        return
+
+    placeholders = [
+        value for value in kwargs.values()
+        if isinstance(value, Placeholder)
+    ]
+    paths = (
+        CMSPlugin
+        .objects
+        .filter(placeholder__in=placeholders)
+        .values_list('path', flat=True)
+    )
+    plugin_trees_changed(paths)
+
+
+if post_placeholder_operation is not None:
+    post_placeholder_operation.connect(
+        placeholder_operation_done,
+        dispatch_uid='aldryn_forms_placeholder_operation_done',
+    )
+
+
+@receiver(post_publish, dispatch_uid='aldryn_forms_page_published')
+def page_published(sender, instance, language, **kwargs):
+    # Write the schema of the live forms right away
+    # instead of on the first request.
+    public_page = getattr(instance, 'publisher_public', None)
+
+    if public_page is None:
+        return
+
+    for model in get_form_plugin_models():
+        form_plugins = model.objects.filter(
+            placeholder__page=public_page,
+            language=language,
+        )
+
+        for form_plugin in form_plugins:
+            form_plugin.update_form_schema()
+
+
+@receiver(file_changed, dispatch_uid='aldryn_forms_file_changed')
+def file_changed_in_debug(sender, file_path, **kwargs):
+    # The development server reloads templates on change,
+    # don't keep serving the old ones.
+    # Returns None so the server still restarts for python files.
+    clear_template_cache()
+
+
+@receiver(setting_changed, dispatch_uid='aldryn_forms_setting_changed')
+def templates_setting_changed(sender, setting, **kwargs):
+    if setting == 'TEMPLATES':
+        clear_template_cache()
+
+
+@receiver(post_save, sender=FormSchemaVersion, dispatch_uid='aldryn_forms_schema_version_saved')
+def schema_version_saved(sender, instance, **kwargs):
+    # Only matters if a pk is reused, e.g. after a rollback.
+    schema_fields_cache.delete(instance.pk)
@@ -0,0 +1,154 @@
+"""
+Sending the emails of the forms through the EmailOutbox table.
+
+With ALDRYN_FORMS_EMAIL_OUTBOX enabled the messages are stored in the
+current transaction and sent by the aldryn_forms_send_outbox command,
+instead of connecting to the mail server during the request.
+"""
+import base64
+import logging
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+
+from .mail import get_connection_pool
+from .models import EmailOutbox
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_outbox_enabled():
+    return getattr(settings, 'ALDRYN_FORMS_EMAIL_OUTBOX', False)
+
+
+def serialize_message(message):
+    attachments = []
+
+    for attachment in message.attachments:
+        if isinstance(attachment, MIMEBase):
+            attachment = (
+                attachment.get_filename(),
+                attachment.get_payload(decode=True),
+                attachment.get_content_type(),
+            )
+
+        filename, content, mimetype = attachment
+
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        attachments.append([filename, base64.b64encode(content).decode('ascii'), mimetype])
+
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'content_subtype': message.content_subtype,
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': message.extra_headers,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        'attachments': attachments,
+    }
+
+
+def deserialize_message(data, connection=None):
+    message = EmailMultiAlternatives(
+        subject=data['subject'],
+        body=data['body'],
+        from_email=data['from_email'],
+        to=data['to'],
+        cc=data['cc'],
+        bcc=data['bcc'],
+        reply_to=data['reply_to'],
+        headers=data['headers'],
+        alternatives=[tuple(alternative) for alternative in data['alternatives']],
+        connection=connection,
+    )
+    message.content_subtype = data['content_subtype']
+
+    for filename, content, mimetype in data['attachments']:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def queue_messages(messages):
+    """
+    Stores the messages in the outbox, in the current transaction.
+    """
+    rows = [
+        EmailOutbox(message=serialize_message(message))
+        for message in messages if message.recipients()
+    ]
+    return EmailOutbox.objects.bulk_create(rows)
+
+
+def send_messages(messages, connection=None):
+    """
+    Queues the messages if the outbox is enabled, sends them
+    otherwise, over the pooled connections unless one is given.
+    """
+    if is_outbox_enabled():
+        return len(queue_messages(messages))
+
+    if connection is None:
+        return get_connection_pool().send_messages(messages)
+    return connection.send_messages(messages)
+
+
+class SubmissionMessages(object):
+    """
+    Collects the messages of a form submission, sent at once by send().
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def add(self, messages):
+        self.messages.extend(messages)
+        return len(messages)
+
+    def send(self, fail_silently=False):
+        messages, self.messages = self.messages, []
+
+        if not messages:
+            return 0
+
+        try:
+            return send_messages(messages)
+        except:  # noqa
+            if not fail_silently:
+                raise
+            # we catch all exceptions to be backend agnostic
+            logger.exception("Could not send notification emails.")
+            return 0
+
+
+def collect_form_messages(form, messages):
+    """
+    Adds the messages to those of the submission if they're collected
+    (see FormPlugin.process_valid_form), sends them otherwise.
+    """
+    collected = form.submission_messages
+
+    if collected is None:
+        return send_messages(messages)
+    return collected.add(messages)
+
+
+def send_form_messages(form, messages):
+    """
+    Sends the messages together with the ones collected so far, raises
+    if they can't be sent. With the outbox they're queued in the
+    transaction of the submission.
+    """
+    collected = form.submission_messages
+
+    if collected is None:
+        return send_messages(messages)
+
+    collected.add(messages)
+    return collected.send()
@@ -0,0 +1,58 @@
+"""
+Helpers to store model instances in the form schema
+and to rebuild them without hitting the database.
+"""
+import datetime
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router
+
+
+class InstanceJSONEncoder(DjangoJSONEncoder):
+    """
+    Encodes dumped instances, keeping the microseconds of datetimes
+    which DjangoJSONEncoder drops.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def dump_instance(obj):
+    values = {
+        field.attname: field.value_from_object(obj)
+        for field in obj._meta.concrete_fields
+    }
+    return {'model': obj._meta.label_lower, 'values': values}
+
+
+def load_instance(data):
+    model = apps.get_model(data['model'])
+    values = data['values']
+    field_names = []
+    field_values = []
+
+    # Fields missing from the schema (added after it was written)
+    # are deferred and will be loaded on access.
+    for field in model._meta.concrete_fields:
+        if field.attname in values:
+            field_names.append(field.attname)
+            field_values.append(field.to_python(values[field.attname]))
+    return model.from_db(router.db_for_read(model), field_names, field_values)
+
+
+def set_prefetched_objects(instance, related_name, objects):
+    """
+    Makes instance.<related_name>.all() return the given objects,
+    just like prefetch_related() would.
+    """
+    queryset = getattr(instance, related_name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[related_name] = queryset
@@ -2,6 +2,11 @@ from django import template
 from django.utils import encoding
 from django.utils.safestring import mark_safe
 
+from cms.toolbar.utils import get_toolbar_from_request
+
+from ..helpers import is_form_element
+from ..utils import select_cached_template
+
 
 register = template.Library()
 
@@ -24,6 +29,35 @@ def render_form_widget(field, **kwargs):
     return mark_safe(markup)
 
 
+@register.simple_tag(takes_context=True)
+def render_form_element(context, plugin):
+    """
+    Renders a form element in the current template pass,
+    without the cms plugin rendering (context processors,
+    plugin processors and toolbar markup).
+
+    Other plugins, and all of them while the page is being edited,
+    are rendered by the cms like {% render_plugin %} does.
+    """
+    renderer = get_toolbar_from_request(context['request']).get_content_renderer()
+    editable = renderer._placeholders_are_editable
+
+    if editable or not is_form_element(plugin):
+        return renderer.render_plugin(instance=plugin, context=context, editable=editable)
+
+    plugin_class = plugin.get_plugin_class_instance()
+    placeholder = context.get('placeholder')
+
+    with context.push():
+        plugin_class.render(context, plugin, placeholder)
+        template = plugin_class._get_render_template(context, plugin, placeholder)
+
+        if isinstance(template, str):
+            template = select_cached_template([template])
+        content = template.template.render(context)
+    return mark_safe(content)
+
+
 @register.filter()
 def force_text(val):
     return encoding.force_text(val)
@@ -1,15 +1,21 @@
 from __future__ import unicode_literals
 
+from threading import RLock
+from uuid import uuid4
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.forms.forms import NON_FIELD_ERRORS
+from django.template.loader import select_template
 from django.utils.module_loading import import_string
 
 from cms.utils.moderator import get_cmsplugin_queryset
 from cms.utils.plugins import downcast_plugins
 
 from .action_backends_base import BaseAction
-from .compat import build_plugin_tree
+from .compat import OrderedDict, build_plugin_tree
+from .helpers import get_plugin_role
 
 
 DEFAULT_ALDRYN_FORMS_ACTION_BACKENDS = {
@@ -18,6 +24,7 @@ DEFAULT_ALDRYN_FORMS_ACTION_BACKENDS = {
     'none': 'aldryn_forms.action_backends.NoAction',
 }
 ALDRYN_FORMS_ACTION_BACKEND_KEY_MAX_SIZE = 15
+PLUGIN_TREE_VERSION_CACHE_KEY = 'aldryn_forms:plugin_tree_version:{}'
 
 
 def get_action_backends():
@@ -98,24 +105,63 @@ def get_plugin_tree(model, **kwargs):
 
     This function builds a plugin tree for a plugin with no placeholder context.
 
-    Makes as many database queries as many levels are in the tree.
-
-    This is ok as forms shouldn't form very deep trees.
+    Makes one query for the plugin, one for all of its descendants
+    and one per plugin type used by the descendants.
     """
     plugin = model.objects.get(**kwargs)
-    plugin.parent = None
-    current_level = [plugin]
-    plugin_list = [plugin]
-    while get_next_level(current_level).exists():
-        current_level = get_next_level(current_level)
-        current_level = downcast_plugins(current_level)
-        plugin_list += current_level
-    return build_plugin_tree(plugin_list)[0]
+    descendants = downcast_plugin_list(get_plugin_descendants(plugin))
+    build_plugin_subtree(plugin, descendants)
+    return plugin
 
 
-def get_next_level(current_level):
-    all_plugins = get_cmsplugin_queryset()
-    return all_plugins.filter(parent__in=[x.pk for x in current_level])
+def get_plugin_descendants(plugin):
+    """
+    Returns all the descendants of the given plugin,
+    in tree order, using a single query.
+    """
+    return (
+        get_cmsplugin_queryset()
+        .filter(path__startswith=plugin.path, depth__gt=plugin.depth)
+        .order_by('path')
+    )
+
+
+def build_plugin_subtree(plugin, descendants):
+    """
+    Sets child_plugin_instances on the plugin and its descendants.
+    """
+    # Set parent_id to None in order to
+    # fool the build_plugin_tree function.
+    # This is sadly necessary to avoid getting all nodes
+    # higher than the plugin.
+    parent_id = plugin.parent_id
+    plugin.parent_id = None
+    build_plugin_tree([plugin] + list(descendants))
+    # Set back the original parent
+    plugin.parent_id = parent_id
+    return plugin
+
+
+def is_downcasted(plugin):
+    return isinstance(plugin, get_plugin_role(plugin.plugin_type).model)
+
+
+def downcast_plugin_list(plugins):
+    """
+    Like downcast_plugins() but skips the plugins that
+    are already instances of their plugin model.
+    Returns a list in the same order.
+    """
+    plugins = list(plugins)
+    downcasted = {
+        plugin.pk: plugin for plugin in
+        downcast_plugins([plugin for plugin in plugins if not is_downcasted(plugin)])
+    }
+    return [
+        plugin if is_downcasted(plugin) else downcasted[plugin.pk]
+        for plugin in plugins
+        if is_downcasted(plugin) or plugin.pk in downcasted
+    ]
 
 
 def add_form_error(form, message, field=NON_FIELD_ERRORS):
@@ -123,3 +169,105 @@ def add_form_error(form, message, field=NON_FIELD_ERRORS):
         form._errors[field].append(message)
     except KeyError:
         form._errors[field] = form.error_class([message])
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most ``maxsize`` entries.
+
+    Once full, the least recently used entry is evicted.
+    A ``maxsize`` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_plugin_tree_version(plugin):
+    """
+    Returns a token that changes whenever the plugin
+    or any of its descendants is saved, moved or deleted.
+
+    Tokens are stored in the django cache, all the processes only agree
+    on them if it's shared, with LocMemCache each process has its own.
+    """
+    key = PLUGIN_TREE_VERSION_CACHE_KEY.format(plugin.path)
+    version = cache.get(key)
+
+    if version is None:
+        version = uuid4().hex
+
+        if not cache.add(key, version, timeout=None):
+            # Another process won the race, use its token.
+            version = cache.get(key, version)
+    return version
+
+
+def get_ancestor_paths(path):
+    """
+    Returns the tree paths of the plugin with the given path
+    and of all of its ancestors.
+    """
+    from cms.models import CMSPlugin
+
+    steplen = CMSPlugin.steplen
+    return [path[:end] for end in range(steplen, len(path) + 1, steplen)]
+
+
+def invalidate_plugin_tree_versions(paths):
+    keys = [PLUGIN_TREE_VERSION_CACHE_KEY.format(path) for path in paths]
+    cache.delete_many(keys)
+
+
+# Compiled templates of form elements, keyed by their candidate names.
+template_cache = LRUCache(maxsize=1000)
+
+
+def select_cached_template(template_names):
+    """
+    Same as select_template() but the resolved template is reused
+    until the templates are reloaded, see clear_template_cache().
+    """
+    key = tuple(template_names)
+    template = template_cache.get(key)
+
+    if template is None:
+        template = select_template(key)
+        template_cache.set(key, template)
+    return template
+
+
+def clear_template_cache():
+    template_cache.clear()
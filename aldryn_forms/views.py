@@ -37,14 +37,26 @@ def submit_form_view(request):
             # I believe this could be an issue as we don't check if the form submitted
             # is in anyway tied to this page.
             # But then we have a problem with static placeholders :(
-            form_plugin = get_plugin_tree(FormPlugin, pk=form_plugin_id)
+            form_plugin = FormPlugin.objects.get(pk=form_plugin_id)
         except FormPlugin.DoesNotExist:
             return HttpResponseBadRequest()
 
-        form_plugin_instance = form_plugin.get_plugin_instance()[1]
+        # The model of the plugin, e.g. the proxy of the email notifications.
+        form_plugin, plugin = form_plugin.get_plugin_instance()
+
+        # Before loading the form or looking at the data.
+        retry_after = plugin.get_rate_limit_retry_after(form_plugin, request)
+
+        if retry_after is not None:
+            return plugin.get_rate_limited_response(form_plugin, request, retry_after)
+
+        if not form_plugin.has_form_schema():
+            # The stored schema is outdated, load the whole plugin tree.
+            form_plugin = get_plugin_tree(type(form_plugin), pk=form_plugin_id)
+
         # saves the form if it's valid
-        form = form_plugin_instance.process_form(form_plugin, request)
-        success_url = form_plugin_instance.get_success_url(instance=form_plugin)
+        form = plugin.process_form(form_plugin, request)
+        success_url = plugin.get_success_url(instance=form_plugin)
 
         if form.is_valid() and success_url:
             return HttpResponseRedirect(success_url)
@@ -0,0 +1,111 @@
+"""
+Measures the storage saved by compressing FormSubmission.data and the cost
+of compressing and decompressing it, on generated submissions of a form with
+a few text inputs and several text areas.
+
+With ALDRYN_FORMS_STORE_FIELD_VALUES the values are also stored uncompressed
+in FormSubmission.field_values, the row size is the size of both columns.
+
+    python benchmarks/submission_compression.py [--submissions 1000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+import django
+from django.conf import settings
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure()
+django.setup()
+
+from aldryn_forms import compression  # noqa: E402 isort:skip
+
+
+WORDS = (
+    'order delivery invoice account support please thanks issue problem '
+    'request address payment refund product the a to and of we you our your '
+    'is was it not for on with as this that would like could help contact'
+).split()
+
+
+def get_text(rnd, words):
+    sentences = []
+
+    while words > 0:
+        length = rnd.randint(6, 18)
+        sentence = ' '.join(rnd.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + '.')
+        words -= length
+    return ' '.join(sentences)
+
+
+def get_submission(rnd):
+    fields = [
+        ('textfield_1', 'First name', rnd.choice(['Jane', 'John', 'Alex', 'Maria'])),
+        ('textfield_2', 'Last name', rnd.choice(['Doe', 'Smith', 'Müller', 'Rossi'])),
+        ('emailfield_1', 'Email', 'user{}@example.com'.format(rnd.randint(1, 10 ** 6))),
+        ('selectfield_1', 'Topic', rnd.choice(['Sales', 'Support', 'Press'])),
+    ]
+
+    for number in range(1, rnd.randint(3, 6)):
+        fields.append(('textareafield_{}'.format(number), 'Message {}'.format(number), get_text(rnd, rnd.randint(100, 1500))))
+    return [{'name': name, 'label': label, 'value': value} for name, label, value in fields]
+
+
+def measure(payloads, name):
+    settings.ALDRYN_FORMS_DATA_COMPRESSION = name
+    settings.ALDRYN_FORMS_DATA_COMPRESSION_THRESHOLD = 0 if name else None
+    stored = [compression.compress_data(payload) for payload in payloads]
+    number = 3
+
+    compress_time = timeit.timeit(lambda: [compression.compress_data(p) for p in payloads], number=number)
+    decompress_time = timeit.timeit(lambda: [compression.decompress_data(s) for s in stored], number=number)
+    count = len(payloads) * number
+    return (
+        sum(len(data.encode('utf-8')) for data in stored),
+        compress_time / count * 10 ** 6,
+        decompress_time / count * 10 ** 6,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submissions', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    submissions = [get_submission(rnd) for _ in range(args.submissions)]
+    payloads = [json.dumps(fields) for fields in submissions]
+    raw_size = sum(len(payload.encode('utf-8')) for payload in payloads)
+    # Like get_field_values(), serialized like the JSONField does.
+    values_size = sum(
+        len(json.dumps({field['name']: field['value'] for field in fields}).encode('utf-8'))
+        for fields in submissions
+    )
+    names = [None, 'zlib'] + (['zstd'] if compression.zstandard else [])
+
+    print('{} submissions, {:.1f} KB of data and {:.1f} KB of field_values on average'.format(
+        len(payloads), raw_size / len(payloads) / 1024, values_size / len(payloads) / 1024,
+    ))
+    print('{:<6} {:>10} {:>8} {:>10} {:>8} {:>14} {:>16}'.format(
+        'format', 'data KB', 'ratio', 'row KB', 'ratio', 'compress µs', 'decompress µs',
+    ))
+
+    for name in names:
+        size, compress_us, decompress_us = measure(payloads, name)
+        row_size = size + values_size
+        print('{:<6} {:>10.0f} {:>8.2f} {:>10.0f} {:>8.2f} {:>14.1f} {:>16.1f}'.format(
+            name or 'json', size / 1024, raw_size / size,
+            row_size / 1024, (raw_size + values_size) / row_size,
+            compress_us, decompress_us,
+        ))
+
+
+if __name__ == '__main__':
+    main()
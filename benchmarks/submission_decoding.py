@@ -0,0 +1,124 @@
+"""
+Microbenchmark of FormSubmission.get_form_data() and get_field_value()
+on submissions with 50 fields, reading every field id like the export does.
+No database is needed.
+
+    python benchmarks/submission_decoding.py [--fields 50] [--number 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from collections import defaultdict
+from functools import partial
+
+import django
+from django.conf import settings
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+settings.configure(
+    INSTALLED_APPS=[
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sites',
+        'cms',
+        'menus',
+        'treebeard',
+        'filer',
+        'easy_thumbnails',
+        'aldryn_forms',
+    ],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    LANGUAGES=[('en', 'English')],
+    SITE_ID=1,
+    TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {'context_processors': ['django.template.context_processors.request']},
+    }],
+    CMS_TEMPLATES=[('page.html', 'Page')],
+)
+django.setup()
+
+from aldryn_forms.models import (  # noqa: E402 isort:skip
+    FormSchemaVersion, FormSubmission, SerializedFormField, schema_fields_cache,
+)
+
+
+def legacy_form_data_hook(data, occurrences):
+    # FormSubmission._form_data_hook before decoding was memoized
+    field_label = data['label'].strip()
+
+    if field_label:
+        field_id = u'{}_{}'.format(data['name'].rpartition('_')[0], field_label)
+    else:
+        field_id = data['name']
+
+    if field_id in occurrences:
+        occurrences[field_id] += 1
+
+    data['field_occurrence'] = occurrences[field_id]
+    return SerializedFormField(**data)
+
+
+def legacy_get_form_data(submission):
+    occurrences = defaultdict(lambda: 1)
+    return json.loads(submission.data, object_hook=partial(legacy_form_data_hook, occurrences=occurrences))
+
+
+def get_fields(count):
+    fields = []
+
+    for number in range(1, count + 1):
+        field_type = ('textfield', 'emailfield', 'selectfield', 'textareafield')[number % 4]
+        # Some labels are repeated, like fields in repeated fieldsets.
+        label = 'Field {}'.format(number % 40)
+        fields.append(('{}_{}'.format(field_type, number), label, 'Value of field {}'.format(number)))
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fields', type=int, default=50)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    fields = get_fields(args.fields)
+    last_name = fields[-1][0]
+    unversioned_data = json.dumps([
+        {'name': name, 'label': label, 'field_occurrence': 1, 'value': value}
+        for name, label, value in fields
+    ])
+    schema_version = FormSchemaVersion(pk=1, fields=[[name, label] for name, label, value in fields])
+    schema_fields_cache.set(schema_version.pk, schema_version.decode())
+    versioned_data = json.dumps([value for name, label, value in fields])
+
+    def unversioned():
+        return FormSubmission(data=unversioned_data)
+
+    def versioned():
+        return FormSubmission(data=versioned_data, schema_version_id=schema_version.pk)
+
+    memoized = versioned()
+    memoized.get_form_data()
+
+    cases = [
+        ('legacy decode', lambda: [f.field_id for f in legacy_get_form_data(unversioned())]),
+        ('decode', lambda: [f.field_id for f in unversioned().get_form_data()]),
+        ('decode, schema version', lambda: [f.field_id for f in versioned().get_form_data()]),
+        ('memoized decode', lambda: [f.field_id for f in memoized.get_form_data()]),
+        ('legacy single value', lambda: [f.value for f in legacy_get_form_data(unversioned()) if f.name == last_name]),
+        ('get_field_value', lambda: unversioned().get_field_value(last_name)),
+        ('get_field_value, schema version', lambda: versioned().get_field_value(last_name)),
+    ]
+
+    print('{} fields, {} runs'.format(args.fields, args.number))
+
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3))
+        print('{:<34} {:>8.1f} µs'.format(name, seconds / args.number * 10 ** 6))
+
+
+if __name__ == '__main__':
+    main()
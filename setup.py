@@ -4,9 +4,9 @@ from aldryn_forms import __version__
 
 
 REQUIREMENTS = [
-    'django>=2.0',
+    'django>=3.1',
     'aldryn-boilerplates>=0.7.5',
-    'django-cms>=3.5',
+    'django-cms>=3.8',
     'django-emailit',
     'djangocms-text-ckeditor',
     'djangocms-attributes-field>=1.0.0',
@@ -26,12 +26,14 @@ CLASSIFIERS = [
     'License :: OSI Approved :: BSD License',
     'Operating System :: OS Independent',
     'Framework :: Django',
-    'Framework :: Django :: 2.2',
+    'Framework :: Django :: 3.1',
+    'Framework :: Django :: 3.2',
     'Programming Language :: Python',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
     'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
     'Topic :: Internet :: WWW/HTTP',
     'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     'Topic :: Software Development',
@@ -52,8 +54,10 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=REQUIREMENTS,
+    python_requires='>=3.6',
     extras_require={
         'captcha': ['django-simple-captcha'],
+        'zstd': ['zstandard'],
     },
     classifiers=CLASSIFIERS,
     test_suite='tests.settings.run',
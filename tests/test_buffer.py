@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from aldryn_forms import buffer as buffer_module
+from aldryn_forms.buffer import SubmissionBuffer, WriteError
+from aldryn_forms.models import FormSubmission
+from aldryn_forms.schema import dump_instance
+
+
+class SubmissionBufferTestCase(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+
+    def get_submission(self, name='contact'):
+        return FormSubmission(name=name, language='en', data='[]', field_values={'email': 'a@example.com'})
+
+    def test_flush_queue(self):
+        buffer = SubmissionBuffer(batch_size=2)
+
+        for name in ('one', 'two', 'three'):
+            buffer.append(self.get_submission(name))
+
+        self.assertFalse(FormSubmission.objects.exists())
+        self.assertEqual(buffer.get_pending_count(), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            buffer.flush()
+
+        inserts = [query for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+
+        self.assertEqual(buffer.get_pending_count(), 0)
+        self.assertEqual(
+            sorted(FormSubmission.objects.values_list('name', flat=True)),
+            ['one', 'three', 'two'],
+        )
+
+    def test_flush_spool(self):
+        buffer = SubmissionBuffer(spool_dir=self.spool_dir)
+        submission = self.get_submission()
+        buffer.append(submission)
+
+        self.assertEqual(buffer.get_pending_count(), 1)
+
+        buffer.flush()
+
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        stored = FormSubmission.objects.get()
+        self.assertEqual(stored.field_values, {'email': 'a@example.com'})
+        self.assertEqual(stored.sent_at, submission.sent_at)
+
+    def test_flush_spool_left_by_dead_process(self):
+        path = os.path.join(self.spool_dir, 'submissions-999999999.jsonl')
+
+        with open(path, 'w') as spool:
+            spool.write(json.dumps(dump_instance(self.get_submission()), default=str) + '\n')
+            spool.write('{"model": "aldryn_forms.formsub')
+
+        SubmissionBuffer(spool_dir=self.spool_dir).flush()
+
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(FormSubmission.objects.count(), 1)
+
+    def fail_second_batch(self, buffer):
+        write_batch = buffer.write_batch
+        calls = []
+
+        def failing_write_batch(batch):
+            calls.append(batch)
+
+            if len(calls) == 2:
+                raise ValueError('database is gone')
+            write_batch(batch)
+        return mock.patch.object(buffer, 'write_batch', failing_write_batch)
+
+    def test_flush_queue_keeps_unstored_batches(self):
+        buffer = SubmissionBuffer(batch_size=2)
+
+        for name in ('one', 'two', 'three', 'four', 'five'):
+            buffer.append(self.get_submission(name))
+
+        with self.fail_second_batch(buffer), self.assertRaises(WriteError):
+            buffer.flush()
+
+        self.assertEqual(buffer.get_pending_count(), 3)
+        buffer.flush()
+
+        self.assertEqual(
+            sorted(FormSubmission.objects.values_list('name', flat=True)),
+            ['five', 'four', 'one', 'three', 'two'],
+        )
+
+    def test_flush_spool_keeps_unstored_batches(self):
+        buffer = SubmissionBuffer(batch_size=2, spool_dir=self.spool_dir)
+
+        for name in ('one', 'two', 'three'):
+            buffer.append(self.get_submission(name))
+
+        with self.fail_second_batch(buffer), self.assertRaises(WriteError):
+            buffer.flush()
+
+        self.assertEqual(FormSubmission.objects.count(), 2)
+        buffer.flush()
+
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(
+            sorted(FormSubmission.objects.values_list('name', flat=True)),
+            ['one', 'three', 'two'],
+        )
+
+    def test_append_during_flush(self):
+        buffer = SubmissionBuffer(spool_dir=self.spool_dir)
+        buffer.append(self.get_submission('one'))
+        write_batch = buffer.write_batch
+
+        def appending_write_batch(batch):
+            # Another request, blocked if the flush held the lock of the appends.
+            thread = threading.Thread(target=buffer.append, args=[self.get_submission('two')])
+            thread.start()
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+            write_batch(batch)
+
+        with mock.patch.object(buffer, 'write_batch', appending_write_batch):
+            buffer.flush()
+
+        self.assertEqual(buffer.get_pending_count(), 1)
+        buffer.flush()
+        self.assertEqual(FormSubmission.objects.count(), 2)
+
+    @override_settings(ALDRYN_FORMS_BUFFER_SPOOL_DIR=None)
+    def test_memory_buffer_is_opt_in(self):
+        with mock.patch.object(buffer_module, '_buffer', None):
+            with self.assertRaises(ImproperlyConfigured):
+                buffer_module.get_submission_buffer()
@@ -1,12 +1,22 @@
+import re
+from unittest import mock
+
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from cms.api import add_plugin, create_page
+from cms.plugin_rendering import ContentRenderer
 from cms.test_utils.testcases import CMSTestCase
 
 from tests.test_views import CMS_3_6
 
-from aldryn_forms.models import FormSubmission
+from aldryn_forms.cms_plugins import Field, FormPlugin
+from aldryn_forms.models import FormPlugin as FormPluginModel
+from aldryn_forms.models import FormSubmission, Option
 
 
 class FormPluginTestCase(CMSTestCase):
@@ -121,3 +131,547 @@ class EmailNotificationFormPluginTestCase(CMSTestCase):
         self.assertEquals(response.status_code, 200)
         self.assertEquals(FormSubmission.objects.count(), 0)
         self.assertEquals(len(mail.outbox), 0)
+
+
+class FormClassCacheTestCase(CMSTestCase):
+    def setUp(self):
+        super(FormClassCacheTestCase, self).setUp()
+
+        self.page = create_page('test page', 'test_page.html', 'en', published=True)
+        self.placeholder = self.page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(self.placeholder, 'EmailNotificationForm', 'en', name='contact')
+        self.field = add_plugin(
+            self.placeholder,
+            'TextField',
+            'en',
+            target=self.form_plugin,
+            name='first_name',
+        )
+
+    def get_form_class(self):
+        form_plugin = self.form_plugin.__class__.objects.get(pk=self.form_plugin.pk)
+        return form_plugin.get_plugin_class_instance().get_form_class(form_plugin)
+
+    def test_form_class_is_reused(self):
+        self.assertIs(self.get_form_class(), self.get_form_class())
+
+    def test_form_class_is_rebuilt_when_a_field_is_added(self):
+        form_class = self.get_form_class()
+
+        add_plugin(self.placeholder, 'EmailField', 'en', target=self.form_plugin, name='email')
+
+        new_form_class = self.get_form_class()
+        self.assertIsNot(form_class, new_form_class)
+        self.assertIn('email', new_form_class.base_fields)
+
+    def test_form_class_is_rebuilt_by_other_processes(self):
+        form_class = self.get_form_class()
+
+        # The tree versions of another process, in its own LocMemCache.
+        with mock.patch('aldryn_forms.models.invalidate_plugin_tree_versions'):
+            add_plugin(self.placeholder, 'EmailField', 'en', target=self.form_plugin, name='email')
+
+        self.assertIsNot(form_class, self.get_form_class())
+
+    def test_form_class_is_rebuilt_when_an_option_is_saved(self):
+        select = add_plugin(self.placeholder, 'SelectField', 'en', target=self.form_plugin, name='color')
+        form_class = self.get_form_class()
+
+        select.option_set.create(value='red')
+
+        self.assertIsNot(form_class, self.get_form_class())
+
+
+class ChoiceFieldOptionsTestCase(CMSTestCase):
+    def setUp(self):
+        super(ChoiceFieldOptionsTestCase, self).setUp()
+
+        page = create_page('test page', 'test_page.html', 'en')
+        placeholder = page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+
+        for plugin_type in ('SelectField', 'RadioSelectField', 'MultipleSelectField'):
+            field = add_plugin(
+                placeholder,
+                plugin_type,
+                'en',
+                target=self.form_plugin,
+                name=plugin_type.lower(),
+            )
+            field.option_set.create(value='red')
+            field.option_set.create(value='blue', default_value=True)
+
+        self.options = {
+            (option.field.name, option.value): option
+            for option in Option.objects.select_related('field')
+        }
+
+    def get_form(self, data=None):
+        form_plugin = self.form_plugin.__class__.objects.get(pk=self.form_plugin.pk)
+        plugin = form_plugin.get_plugin_class_instance()
+        form_class = plugin.build_form_class(form_plugin)
+        return form_class(form_plugin=form_plugin, request=RequestFactory().get('/'), data=data)
+
+    def render_form(self):
+        return str(self.get_form())
+
+    def get_option_pk(self, value):
+        return self.options[value].pk
+
+    def test_options_are_loaded_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            html = self.render_form()
+
+        option_queries = [query for query in queries if 'aldryn_forms_option' in query['sql']]
+        self.assertEqual(len(option_queries), 1)
+        self.assertEqual(html.count('blue'), 3)
+
+    def test_options_are_not_queried_when_rendering(self):
+        self.render_form()
+
+        with self.assertNumQueries(1):
+            # Only the form plugin itself is loaded.
+            self.render_form()
+
+    def test_submitted_options_are_validated_without_queries(self):
+        self.render_form()
+        data = {
+            'language': 'en',
+            'form_plugin_id': self.form_plugin.pk,
+            'selectfield': self.get_option_pk(('selectfield', 'red')),
+            'radioselectfield': self.get_option_pk(('radioselectfield', 'blue')),
+            'multipleselectfield': [
+                self.get_option_pk(('multipleselectfield', 'red')),
+                self.get_option_pk(('multipleselectfield', 'blue')),
+            ],
+        }
+
+        with self.assertNumQueries(1):
+            form = self.get_form(data)
+            self.assertTrue(form.is_valid(), form.errors)
+
+        self.assertEqual(form.cleaned_data['selectfield'].value, 'red')
+        self.assertEqual(form.get_cleaned_data(), {
+            'selectfield': 'red',
+            'radioselectfield': 'blue',
+            'multipleselectfield': 'red, blue',
+        })
+
+    def test_options_of_other_fields_are_invalid(self):
+        form = self.get_form({
+            'language': 'en',
+            'form_plugin_id': self.form_plugin.pk,
+            'selectfield': self.get_option_pk(('radioselectfield', 'red')),
+            'radioselectfield': self.get_option_pk(('radioselectfield', 'blue')),
+            'multipleselectfield': [self.get_option_pk(('selectfield', 'red'))],
+        })
+
+        self.assertFalse(form.is_valid())
+        self.assertEqual(set(form.errors), {'selectfield', 'multipleselectfield'})
+
+
+@mock.patch.object(FormPlugin, 'cache_markup', True)
+class FormMarkupCacheTestCase(CMSTestCase):
+    def setUp(self):
+        super(FormMarkupCacheTestCase, self).setUp()
+        cache.clear()
+
+        self.page = create_page('test page', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name')
+        add_plugin(placeholder, 'SubmitButton', 'en', target=self.form_plugin, label='Submit')
+        self.page.publish('en')
+
+    def get_page(self):
+        with mock.patch.object(FormPlugin, 'render_form_markup', autospec=True,
+                               side_effect=FormPlugin.render_form_markup) as render_form_markup:
+            response = self.client.get(self.page.get_absolute_url('en'))
+        self.assertEqual(response.status_code, 200)
+        return response, render_form_markup.call_count
+
+    def test_markup_is_cached(self):
+        response, render_count = self.get_page()
+        self.assertEqual(render_count, 1)
+        self.assertContains(response, 'name="first_name"')
+
+        response, render_count = self.get_page()
+        self.assertEqual(render_count, 0)
+        self.assertContains(response, 'name="first_name"')
+
+    def test_markup_is_rendered_again_by_other_processes(self):
+        self.get_page()
+        placeholder = self.page.publisher_public.placeholders.get(slot='content')
+        form_plugin = placeholder.get_plugins().get(plugin_type='EmailNotificationForm')
+
+        # The tree versions of another process, in its own LocMemCache.
+        with mock.patch('aldryn_forms.models.invalidate_plugin_tree_versions'):
+            add_plugin(placeholder, 'TextField', 'en', target=form_plugin, name='last_name')
+
+        response, render_count = self.get_page()
+        self.assertEqual(render_count, 1)
+        self.assertContains(response, 'name="last_name"')
+
+    def test_csrf_token_is_filled_in_per_request(self):
+        csrf_tokens = []
+        submission_tokens = []
+
+        for _ in range(2):
+            response, _ = self.get_page()
+            self.assertNotContains(response, FormPlugin.markup_csrf_token)
+            self.assertNotContains(response, FormPlugin.markup_submission_token)
+            match = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', response.content.decode())
+            csrf_tokens.append(match.group(1))
+            match = re.search(r'name="submission_token" value="(\w+)"', response.content.decode())
+            submission_tokens.append(match.group(1))
+
+        # Tokens are masked differently on every request.
+        self.assertNotEqual(csrf_tokens[0], csrf_tokens[1])
+        self.assertNotEqual(submission_tokens[0], submission_tokens[1])
+
+    def test_submission_is_not_served_from_cache(self):
+        self.get_page()
+        form_plugin = self.page.publisher_public.placeholders.get(slot='content').get_plugins().get(
+            plugin_type='EmailNotificationForm',
+        )
+
+        response = self.client.post(self.page.get_absolute_url('en'), {
+            'form_plugin_id': form_plugin.pk,
+            'first_name': 'Jane',
+        })
+
+        self.assertContains(response, 'Thank you for submitting your information.')
+        self.assertEqual(FormSubmission.objects.count(), 1)
+
+    def test_rate_limited_form_is_not_cached(self):
+        form_plugin = self.page.publisher_public.placeholders.get(slot='content').get_plugins().get(
+            plugin_type='EmailNotificationForm',
+        )
+
+        with mock.patch.object(FormPlugin, 'get_rate_limit_retry_after', return_value=60):
+            response = self.client.post(self.page.get_absolute_url('en'), {
+                'form_plugin_id': form_plugin.pk,
+                'first_name': 'Jane',
+            })
+        self.assertContains(response, 'Too many submissions, please try again later.')
+
+        response, render_count = self.get_page()
+        self.assertEqual(render_count, 1)
+        self.assertNotContains(response, 'Too many submissions, please try again later.')
+
+
+class SubmissionTokenTestCase(CMSTestCase):
+    def setUp(self):
+        super(SubmissionTokenTestCase, self).setUp()
+        cache.clear()
+
+        self.page = create_page('test page', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name')
+        self.page.publish('en')
+        self.form_plugin = self.page.publisher_public.placeholders.get(slot='content').get_plugins().get(
+            plugin_type='EmailNotificationForm',
+        )
+
+    def submit(self, submission_token):
+        response = self.client.post(self.page.get_absolute_url('en'), {
+            'form_plugin_id': self.form_plugin.pk,
+            'first_name': 'Jane',
+            'submission_token': submission_token,
+        })
+        self.assertContains(response, 'Thank you for submitting your information.')
+
+    def test_form_has_submission_token(self):
+        response = self.client.get(self.page.get_absolute_url('en'))
+        self.assertRegex(response.content.decode(), r'name="submission_token" value="\w{32}"')
+
+    def test_duplicates_are_not_processed(self):
+        self.submit('a' * 32)
+        self.submit('a' * 32)
+        self.assertEqual(FormSubmission.objects.count(), 1)
+
+        self.submit('b' * 32)
+        self.assertEqual(FormSubmission.objects.count(), 2)
+
+    def test_token_is_released_on_error(self):
+        with mock.patch.object(FormPlugin, 'form_valid', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.submit('a' * 32)
+
+        self.submit('a' * 32)
+        self.assertEqual(FormSubmission.objects.count(), 1)
+
+
+class RateLimitTestCase(CMSTestCase):
+    def setUp(self):
+        super(RateLimitTestCase, self).setUp()
+        cache.clear()
+
+        self.page = create_page('test page', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        form_plugin = add_plugin(
+            placeholder,
+            'EmailNotificationForm',
+            'en',
+            name='contact',
+            rate_limit_by='ip',
+            rate_limit_burst=2,
+        )
+        add_plugin(placeholder, 'TextField', 'en', target=form_plugin, name='first_name')
+        self.page.publish('en')
+        self.form_plugin = self.page.publisher_public.placeholders.get(slot='content').get_plugins().get(
+            plugin_type='EmailNotificationForm',
+        ).get_bound_plugin()
+
+    def submit(self, **extra):
+        return self.client.post(self.page.get_absolute_url('en'), {
+            'form_plugin_id': self.form_plugin.pk,
+            'first_name': 'Jane',
+        }, **extra)
+
+    def test_submissions_over_the_limit_are_rejected(self):
+        for _ in range(2):
+            self.assertContains(self.submit(), 'Thank you for submitting your information.')
+
+        response = self.submit()
+        self.assertContains(response, 'Too many submissions, please try again later.')
+        self.assertEqual(FormSubmission.objects.count(), 2)
+
+        # Other clients aren't affected.
+        self.assertContains(self.submit(REMOTE_ADDR='10.0.0.2'), 'Thank you for submitting your information.')
+
+    def get_client(self, **meta):
+        plugin = self.form_plugin.get_plugin_class_instance()
+        request = RequestFactory().post('/', **meta)
+        return plugin.get_rate_limit_client(self.form_plugin, request)
+
+    @override_settings(ALDRYN_FORMS_RATE_LIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_client_address_from_forwarded_header(self):
+        # The first address is set by the client, the last one by our proxy.
+        self.assertEqual(
+            self.get_client(HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1', REMOTE_ADDR='10.0.0.9'),
+            'ip:10.0.0.1',
+        )
+
+        with self.settings(ALDRYN_FORMS_RATE_LIMIT_TRUSTED_PROXIES=2):
+            self.assertEqual(
+                self.get_client(HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1, 10.0.0.2'),
+                'ip:10.0.0.1',
+            )
+
+        self.assertEqual(self.get_client(HTTP_X_FORWARDED_FOR='', REMOTE_ADDR='10.0.0.9'), 'ip:10.0.0.9')
+        self.assertEqual(self.get_client(REMOTE_ADDR='10.0.0.9'), 'ip:10.0.0.9')
+
+    def test_retry_after(self):
+        plugin = self.form_plugin.get_plugin_class_instance()
+        request = RequestFactory().post('/')
+
+        self.assertIsNone(plugin.get_rate_limit_retry_after(self.form_plugin, request))
+        # Counted once per request.
+        self.assertIsNone(plugin.get_rate_limit_retry_after(self.form_plugin, request))
+        self.assertIsNone(plugin.get_rate_limit_retry_after(self.form_plugin, RequestFactory().post('/')))
+
+        request = RequestFactory().post('/')
+        retry_after = plugin.get_rate_limit_retry_after(self.form_plugin, request)
+        self.assertTrue(0 < retry_after <= 61)
+
+        response = plugin.get_rate_limited_response(self.form_plugin, request, retry_after)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(retry_after))
+
+
+class SinglePassFormTestCase(CMSTestCase):
+    def setUp(self):
+        super(SinglePassFormTestCase, self).setUp()
+
+        self.page = create_page('test page', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(
+            placeholder,
+            'EmailNotificationForm',
+            'en',
+            name='contact',
+            form_template='aldryn_forms/form_single_pass.html',
+        )
+        fieldset = add_plugin(placeholder, 'Fieldset', 'en', target=self.form_plugin, legend='About you')
+        add_plugin(placeholder, 'TextField', 'en', target=fieldset, name='first_name', label='First name')
+        add_plugin(placeholder, 'EmailField', 'en', target=fieldset, name='email', label='Email')
+        add_plugin(placeholder, 'SubmitButton', 'en', target=self.form_plugin, label='Send')
+        self.page.publish('en')
+
+    def get_page(self):
+        render_plugin = ContentRenderer.render_plugin
+
+        with mock.patch.object(ContentRenderer, 'render_plugin', autospec=True,
+                               side_effect=render_plugin) as mocked:
+            response = self.client.get(self.page.get_absolute_url('en'))
+        return response, mocked.call_count
+
+    def test_form_is_rendered_in_one_pass(self):
+        response, render_count = self.get_page()
+
+        # Only the form plugin goes through the cms renderer.
+        self.assertEqual(render_count, 1)
+        self.assertContains(response, '<legend>About you</legend>', html=True)
+        self.assertContains(response, 'name="first_name"')
+        self.assertContains(response, 'name="email"')
+        self.assertContains(response, 'Send')
+
+    def test_default_template_renders_each_plugin(self):
+        self.form_plugin.form_template = 'aldryn_forms/form.html'
+        self.form_plugin.save()
+        self.page.publish('en')
+
+        response, render_count = self.get_page()
+
+        self.assertEqual(render_count, 5)
+        self.assertContains(response, 'name="first_name"')
+
+
+class SerializedFieldsTestCase(CMSTestCase):
+    def setUp(self):
+        super(SerializedFieldsTestCase, self).setUp()
+
+        page = create_page('test page', 'test_page.html', 'en')
+        placeholder = page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name', label='First name')
+        add_plugin(placeholder, 'BooleanField', 'en', target=self.form_plugin, name='newsletter', label='Newsletter')
+
+    def get_form(self):
+        form_plugin = self.form_plugin.__class__.objects.get(pk=self.form_plugin.pk)
+        plugin = form_plugin.get_plugin_class_instance()
+        form_class = plugin.build_form_class(form_plugin)
+        form = form_class(form_plugin=form_plugin, request=RequestFactory().get('/'), data={
+            'language': 'en',
+            'form_plugin_id': form_plugin.pk,
+            'first_name': 'Jane',
+            'newsletter': 'on',
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def test_fields_are_serialized_once_per_flag(self):
+        form = self.get_form()
+
+        with mock.patch.object(Field, 'serialize_field', autospec=True,
+                               side_effect=Field.serialize_field) as serialize_field:
+            form.get_serialized_fields()
+            form.get_serialized_field_choices()
+            form.get_cleaned_data()
+            self.assertEqual(serialize_field.call_count, 2)
+
+            form.get_cleaned_data(is_confirmation=True)
+            form.get_serialized_field_choices(is_confirmation=True)
+            self.assertEqual(serialize_field.call_count, 4)
+
+        self.assertEqual(form.get_serialized_field_choices(), [
+            ('First name', 'Jane'),
+            ('Newsletter', 'Yes'),
+        ])
+
+    def test_cleaned_data_is_not_shared_with_callers(self):
+        form = self.get_form()
+
+        form.get_cleaned_data()['form_name'] = 'contact'
+        form.get_serialized_fields().pop()
+
+        self.assertEqual(form.get_cleaned_data(), {'first_name': 'Jane', 'newsletter': 'Yes'})
+        self.assertEqual(len(form.get_serialized_fields()), 2)
+
+    def test_reset_serialized_fields(self):
+        form = self.get_form()
+        form.get_cleaned_data()
+        form.cleaned_data['first_name'] = 'John'
+
+        self.assertEqual(form.get_cleaned_data()['first_name'], 'Jane')
+
+        form.reset_serialized_fields()
+        self.assertEqual(form.get_cleaned_data()['first_name'], 'John')
+
+
+class NotificationsCacheTestCase(CMSTestCase):
+    def setUp(self):
+        super(NotificationsCacheTestCase, self).setUp()
+        cache.clear()
+
+        page = create_page('test page', 'test_page.html', 'en')
+        placeholder = page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        self.recipient = User.objects.create_user(
+            'jane', 'jane@example.com', 'password', first_name='Jane', last_name='Doe', is_staff=True)
+        self.user = User.objects.create_user('john', 'john@example.com', 'password', is_staff=True)
+        self.form_plugin.recipients.add(self.recipient)
+        self.form_plugin.email_notifications.create(to_user=self.user, theme='default')
+
+    def get_form_plugin(self):
+        return self.form_plugin.__class__.objects.get(pk=self.form_plugin.pk)
+
+    def get_notified(self):
+        form_plugin = self.get_form_plugin()
+        notifications = form_plugin.get_email_notifications()
+        return (
+            form_plugin.get_notification_recipients(),
+            [notification.get_recipient_email() for notification in notifications],
+        )
+
+    def test_notifications_are_cached(self):
+        self.get_notified()
+        form_plugin = self.get_form_plugin()
+
+        with self.assertNumQueries(0):
+            recipients = form_plugin.get_notification_recipients()
+            notification = form_plugin.get_email_notifications()[0]
+            self.assertEqual(notification.get_recipient_email(), 'john@example.com')
+            self.assertIs(notification.form, form_plugin)
+
+        self.assertEqual(recipients, [('Jane Doe', 'jane@example.com')])
+        cache_key = 'aldryn_forms:notifications:email_notifications.emailnotificationformplugin:{}'
+        self.assertNotIn('password', str(cache.get(cache_key.format(form_plugin.pk))))
+
+    def test_notifications_are_cached_per_model(self):
+        # Like aldryn_forms_send_digests, without the email notifications.
+        form_plugin = FormPluginModel.objects.get(pk=self.form_plugin.pk)
+        self.assertEqual(form_plugin.get_notification_recipients(), [('Jane Doe', 'jane@example.com')])
+
+        self.assertEqual(self.get_notified()[1], ['john@example.com'])
+
+        self.form_plugin.recipients.add(self.user)
+        form_plugin = FormPluginModel.objects.get(pk=self.form_plugin.pk)
+        self.assertEqual(len(form_plugin.get_notification_recipients()), 2)
+
+    def test_recipients_changed(self):
+        self.get_notified()
+        self.form_plugin.recipients.add(self.user)
+
+        self.assertEqual(len(self.get_notified()[0]), 2)
+
+        self.form_plugin.recipients.remove(self.user)
+        self.assertEqual(self.get_notified()[0], [('Jane Doe', 'jane@example.com')])
+
+        self.recipient.email = 'jane.doe@example.com'
+        self.recipient.save()
+        self.assertEqual(self.get_notified()[0], [('Jane Doe', 'jane.doe@example.com')])
+
+        self.recipient.delete()
+        self.assertEqual(self.get_notified()[0], [])
+
+    def test_email_notifications_changed(self):
+        self.get_notified()
+        notification = self.form_plugin.email_notifications.create(to_email='team@example.com', theme='default')
+
+        self.assertEqual(self.get_notified()[1], ['john@example.com', 'team@example.com'])
+
+        self.user.email = 'john.doe@example.com'
+        self.user.save()
+        self.assertEqual(self.get_notified()[1], ['john.doe@example.com', 'team@example.com'])
+
+        notification.delete()
+        self.assertEqual(self.get_notified()[1], ['john.doe@example.com'])
+
+    def test_login_keeps_the_cache(self):
+        self.get_notified()
+
+        with self.assertNumQueries(1):
+            self.recipient.save(update_fields=['last_login'])
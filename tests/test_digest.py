@@ -0,0 +1,163 @@
+import datetime
+import json
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from cms.api import add_plugin, create_page
+from cms.test_utils.testcases import CMSTestCase
+
+from aldryn_forms.cms_plugins import FormPlugin as FormPluginBase
+from aldryn_forms.contrib.email_notifications.cms_plugins import (
+    EmailNotificationForm,
+)
+from aldryn_forms.contrib.email_notifications.models import EmailNotification
+from aldryn_forms.models import FormPlugin, FormSubmission
+
+
+class DigestTestCase(CMSTestCase):
+    def setUp(self):
+        super(DigestTestCase, self).setUp()
+
+        self.page = create_page('test page', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        self.users = [
+            User.objects.create_user('jane', 'jane@example.com', 'password', is_staff=True),
+            User.objects.create_user('john', 'john@example.com', 'password', is_staff=True),
+        ]
+
+    def publish(self, recipients=()):
+        self.page.publish('en')
+        public_plugin = (
+            self.page
+            .publisher_public
+            .placeholders
+            .get(slot='content')
+            .get_plugins()
+            .get(plugin_type='EmailNotificationForm')
+            .get_plugin_instance()[0]
+        )
+        # Not copied by EmailNotificationFormPlugin.copy_relations()
+        public_plugin.recipients.add(*recipients)
+        return public_plugin
+
+    def submit(self, email='visitor@example.com', count=1, **kwargs):
+        for index in range(count):
+            FormSubmission.objects.create(
+                name='contact',
+                language='en',
+                data=json.dumps([
+                    {'name': 'email', 'label': 'Email', 'field_occurrence': 1, 'value': email},
+                ]),
+                **kwargs
+            )
+
+    def send_digests(self, **options):
+        stdout = StringIO()
+        call_command('aldryn_forms_send_digests', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def make_due(self):
+        last_digest_at = timezone.now() - datetime.timedelta(days=2)
+        FormPlugin.objects.update(last_digest_at=last_digest_at)
+        EmailNotification.objects.update(last_digest_at=last_digest_at)
+
+    def test_hourly_digest(self):
+        self.form_plugin.digest_frequency = FormPlugin.DIGEST_HOURLY
+        self.form_plugin.save()
+        public_plugin = self.publish(recipients=self.users)
+
+        self.assertIsNotNone(public_plugin.last_digest_at)
+        self.assertEqual(FormPluginBase().send_notifications(public_plugin, form=None), [])
+
+        self.make_due()
+        self.submit('visitor@example.com')
+        self.submit('other@example.com')
+
+        self.send_digests()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['jane@example.com', 'john@example.com'])
+        self.assertIn('contact', mail.outbox[0].subject)
+        self.assertIn('visitor@example.com', mail.outbox[0].body)
+        self.assertIn('other@example.com', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].attachments, [])
+
+        # Not due anymore
+        self.submit()
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_late_submissions_are_in_the_next_digest(self):
+        self.form_plugin.digest_frequency = FormPlugin.DIGEST_HOURLY
+        self.form_plugin.save()
+        self.publish(recipients=self.users[:1])
+
+        self.make_due()
+        self.submit('visitor@example.com')
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Buffered before the digest was sent, stored after it.
+        self.submit('late@example.com', sent_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.make_due()
+        self.send_digests()
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('late@example.com', mail.outbox[1].body)
+        self.assertNotIn('visitor@example.com', mail.outbox[1].body)
+
+    def test_count_digest(self):
+        self.form_plugin.digest_frequency = FormPlugin.DIGEST_COUNT
+        self.form_plugin.digest_count = 3
+        self.form_plugin.digest_csv = True
+        self.form_plugin.save()
+        self.publish(recipients=self.users[:1])
+
+        self.submit(count=2)
+        self.assertIn('0 digests sent', self.send_digests())
+
+        self.submit()
+        self.send_digests()
+
+        self.assertEqual(len(mail.outbox), 1)
+        filename, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual((filename, mimetype), ('contact.csv', 'text/csv'))
+        self.assertEqual(content.splitlines(), ['Email'] + ['visitor@example.com'] * 3)
+
+    def test_dry_run(self):
+        self.form_plugin.digest_frequency = FormPlugin.DIGEST_DAILY
+        self.form_plugin.save()
+        self.publish(recipients=self.users[:1])
+        self.submit()
+
+        self.assertIn('0 digests would be sent', self.send_digests(dry_run=True))
+        self.assertIn('contact: digest to jane@example.com', self.send_digests(dry_run=True, force=True))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_email_notification_digest(self):
+        self.form_plugin.email_notifications.create(
+            theme='default',
+            to_email='${email}',
+            from_email='forms@example.com',
+            digest_frequency=EmailNotification.DIGEST_DAILY,
+        )
+        public_plugin = self.publish()
+
+        self.assertEqual(EmailNotificationForm().prepare_notifications(public_plugin, form=None), ([], []))
+
+        self.submit('visitor@example.com', count=2)
+        self.submit('other@example.com')
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.make_due()
+        self.send_digests()
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['other@example.com', 'visitor@example.com'])
+        self.assertEqual(mail.outbox[0].from_email, 'forms@example.com')
+        # The draft is updated as well, publishing again doesn't send the digest twice.
+        self.assertEqual(EmailNotification.objects.filter(last_digest_at__gt=timezone.now() - datetime.timedelta(hours=1)).count(), 2)
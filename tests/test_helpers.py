@@ -0,0 +1,55 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from cms.api import add_plugin
+from cms.models import Placeholder
+
+from aldryn_forms.helpers import (
+    clear_plugin_roles, get_plugin_role, is_form_element, is_form_field,
+    is_submit_button,
+)
+
+
+class PluginRoleTestCase(TestCase):
+    def setUp(self):
+        super(PluginRoleTestCase, self).setUp()
+        clear_plugin_roles()
+
+    def test_roles(self):
+        form = get_plugin_role('EmailNotificationForm')
+        self.assertTrue(form.is_form_element)
+        self.assertTrue(form.is_container)
+        self.assertFalse(form.is_field)
+
+        field = get_plugin_role('SelectField')
+        self.assertTrue(field.is_form_element)
+        self.assertTrue(field.is_field)
+        self.assertFalse(field.is_submit_button)
+
+        self.assertTrue(get_plugin_role('Fieldset').is_container)
+        self.assertTrue(get_plugin_role('SubmitButton').is_submit_button)
+        self.assertFalse(get_plugin_role('TextPlugin').is_form_element)
+
+    def test_plugins_are_classified_once(self):
+        get_plugin_role('TextField')
+
+        with mock.patch('aldryn_forms.helpers.classify_plugin_class') as classify_plugin_class:
+            get_plugin_role('TextField')
+            get_plugin_role('SubmitButton')
+
+        classify_plugin_class.assert_not_called()
+
+    def test_plugin_instances(self):
+        placeholder = Placeholder.objects.create(slot='test')
+        form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        field = add_plugin(placeholder, 'TextField', 'en', target=form_plugin, name='name')
+        button = add_plugin(placeholder, 'SubmitButton', 'en', target=form_plugin, label='Send')
+
+        self.assertTrue(is_form_field(field))
+        self.assertFalse(is_form_field(button))
+        self.assertTrue(is_submit_button(button))
+        self.assertTrue(is_form_element(field))
+        # Not downcasted
+        self.assertFalse(is_form_element(field.cmsplugin_ptr))
+        self.assertEqual(form_plugin.get_submit_button(), button)
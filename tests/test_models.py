@@ -1,12 +1,27 @@
 from __future__ import division, print_function, unicode_literals
 
-from django.db import IntegrityError
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from cms.api import add_plugin
 from cms.models import Placeholder
 
-from aldryn_forms.models import Option
+from aldryn_forms.admin.exporter import Exporter
+from aldryn_forms.models import (
+    FormPlugin, FormSchemaVersion, FormSubmission, FormSubmissionValue, Option,
+    SerializedFormField,
+)
 
 
 class OptionTestCase(TestCase):
@@ -89,3 +104,469 @@ class OptionTestCase(TestCase):
         self.assertEquals(option1.position, 960)  # We force a value for it on Option.save
 
         self.assertRaises(IntegrityError, Option.objects.update, position=None)  # See? Not nullable
+
+
+class FormSchemaTestCase(TestCase):
+    def setUp(self):
+        super(FormSchemaTestCase, self).setUp()
+        self.placeholder = Placeholder.objects.create(slot='test')
+        self.form_plugin = add_plugin(self.placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(self.placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name')
+        self.select = add_plugin(self.placeholder, 'SelectField', 'en', target=self.form_plugin, name='color')
+        self.select.option_set.create(value='red')
+        self.select.option_set.create(value='blue', default_value=True)
+
+    def get_form_plugin(self):
+        return FormPlugin.objects.get(pk=self.form_plugin.pk)
+
+    def test_schema_is_written_on_first_use(self):
+        self.assertEqual(self.get_form_plugin().form_schema, '')
+
+        fields = self.get_form_plugin().get_form_fields()
+
+        self.assertEqual([field.name for field in fields], ['first_name', 'color'])
+        self.assertNotEqual(self.get_form_plugin().form_schema, '')
+
+    def test_fields_are_loaded_from_schema(self):
+        expected = self.get_form_plugin().get_form_fields()
+        form_plugin = self.get_form_plugin()
+
+        with self.assertNumQueries(0):
+            fields = form_plugin.get_form_fields()
+            options = [option.value for option in fields[1].plugin_instance.option_set.all()]
+
+        self.assertEqual(fields, expected)
+        self.assertEqual(options, ['red', 'blue'])
+
+    def test_schema_is_cleared_when_the_tree_changes(self):
+        self.get_form_plugin().get_form_fields()
+
+        add_plugin(self.placeholder, 'EmailField', 'en', target=self.form_plugin, name='email')
+
+        form_plugin = self.get_form_plugin()
+        self.assertEqual(form_plugin.form_schema, '')
+        self.assertEqual(
+            [field.name for field in form_plugin.get_form_fields()],
+            ['first_name', 'color', 'email'],
+        )
+
+    def test_outdated_tree_does_not_overwrite_schema(self):
+        form_plugin = self.get_form_plugin()
+        fields = form_plugin.get_form_fields_from_tree()
+
+        self.select.option_set.create(value='green')
+        form_plugin.set_form_schema(fields)
+
+        self.assertEqual(self.get_form_plugin().form_schema, '')
+
+    def test_plugins_outside_forms_keep_schemas(self):
+        self.get_form_plugin().get_form_fields()
+
+        with CaptureQueriesContext(connection) as queries:
+            add_plugin(self.placeholder, 'TextField', 'en', name='outside')
+            FormSubmission.objects.create(name='contact')
+
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "aldryn_forms_formplugin"')]
+        self.assertEqual(updates, [])
+        self.assertNotEqual(self.get_form_plugin().form_schema, '')
+
+
+class FormFieldIndexTestCase(TestCase):
+    def setUp(self):
+        super(FormFieldIndexTestCase, self).setUp()
+        placeholder = Placeholder.objects.create(slot='test')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        self.text = add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name')
+        self.email = add_plugin(placeholder, 'EmailField', 'en', target=self.form_plugin, label='Email')
+
+    def test_fields_are_indexed_by_pk_and_name(self):
+        index = self.form_plugin.get_form_field_index()
+
+        self.assertEqual(index.by_pk[self.text.pk].name, 'first_name')
+        self.assertEqual(index.by_pk[self.email.pk].name, 'emailfield_1')
+        self.assertEqual(index.by_name['emailfield_1'].label, 'Email')
+        self.assertEqual(list(index.fields), self.form_plugin.get_form_fields())
+
+    def test_index_is_built_once(self):
+        form_plugin = FormPlugin.objects.get(pk=self.form_plugin.pk)
+        index = form_plugin.get_form_field_index()
+
+        with self.assertNumQueries(0):
+            self.assertIs(form_plugin.get_form_field_index(), index)
+            self.assertEqual(form_plugin.get_form_field_name(self.text), 'first_name')
+
+    def test_index_is_read_only(self):
+        index = self.form_plugin.get_form_field_index()
+
+        with self.assertRaises(TypeError):
+            index.by_name['first_name'] = None
+
+
+class FormSubmissionFieldValuesTestCase(TestCase):
+    def setUp(self):
+        super(FormSubmissionFieldValuesTestCase, self).setUp()
+        self.create_submission({'name': 'Jane', 'email': 'jane@example.com'})
+        self.create_submission({'name': 'John', 'email': 'john@example.org'})
+        self.create_submission({'name': 'Anon'})
+
+    def create_submission(self, values):
+        data = [{'name': name, 'label': name.title(), 'value': value} for name, value in values.items()]
+        return FormSubmission.objects.create(
+            name='contact',
+            data=json.dumps(data),
+            field_values=values,
+        )
+
+    def get_names(self, queryset):
+        return sorted(submission.field_values['name'] for submission in queryset)
+
+    def test_filter_by_field(self):
+        queryset = FormSubmission.objects.filter_by_field('email')
+        self.assertEqual(self.get_names(queryset), ['Jane', 'John'])
+
+    def test_filter_by_value(self):
+        queryset = FormSubmission.objects.filter_by_value('name', 'Jane')
+        self.assertEqual(self.get_names(queryset), ['Jane'])
+
+        queryset = (
+            FormSubmission
+            .objects
+            .filter_by_value('email', '@example.org', lookup='endswith')
+            .filter_by_value('name', 'J', lookup='startswith')
+        )
+        self.assertEqual(self.get_names(queryset), ['John'])
+
+    @override_settings(ALDRYN_FORMS_STORE_FIELD_VALUES=True)
+    def test_backfill_command(self):
+        FormSubmission.objects.update(field_values=None)
+        FormSubmission.objects.create(name='broken', data='not json')
+        FormSubmission.objects.create(
+            name='versioned',
+            data=json.dumps(['Jim', 'jim@example.com']),
+            schema_version=FormSchemaVersion.objects.get_for_fields([('name', 'Name'), ('email', 'Email')]),
+        )
+
+        call_command('aldryn_forms_backfill_field_values', batch_size=2, stdout=StringIO())
+
+        self.assertFalse(FormSubmission.objects.filter(field_values__isnull=True).exists())
+        self.assertEqual(FormSubmission.objects.get(name='broken').field_values, {})
+        self.assertEqual(
+            FormSubmission.objects.get(name='versioned').field_values,
+            {'name': 'Jim', 'email': 'jim@example.com'},
+        )
+        queryset = FormSubmission.objects.filter_by_value('email', 'jane@example.com')
+        self.assertEqual(self.get_names(queryset), ['Jane'])
+
+    def test_backfill_command_requires_setting(self):
+        with self.assertRaises(CommandError):
+            call_command('aldryn_forms_backfill_field_values', stdout=StringIO())
+
+    def test_index_command(self):
+        out = StringIO()
+        call_command('aldryn_forms_index_fields', 'email', stdout=out)
+        call_command('aldryn_forms_index_fields', 'email', drop=True, stdout=out)
+
+        self.assertIn('CREATE INDEX IF NOT EXISTS', out.getvalue())
+        self.assertIn('DROP INDEX IF EXISTS', out.getvalue())
+
+
+@override_settings(ALDRYN_FORMS_DATA_COMPRESSION='zlib', ALDRYN_FORMS_DATA_COMPRESSION_THRESHOLD=1024)
+class FormSubmissionCompressionTestCase(TestCase):
+    def setUp(self):
+        super(FormSubmissionCompressionTestCase, self).setUp()
+        placeholder = Placeholder.objects.create(slot='test')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='name')
+        add_plugin(placeholder, 'TextAreaField', 'en', target=self.form_plugin, name='message')
+
+    def submit(self, message):
+        plugin = self.form_plugin.get_plugin_class_instance()
+        form_class = plugin.get_form_class(self.form_plugin)
+        form = form_class(
+            form_plugin=self.form_plugin,
+            request=RequestFactory().post('/'),
+            data={'language': 'en', 'form_plugin_id': self.form_plugin.pk, 'name': 'Jane', 'message': message},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        return FormSubmission.objects.get()
+
+    def get_values(self, submission):
+        return [(field.name, field.value) for field in submission.get_form_data()]
+
+    def test_large_data_is_compressed(self):
+        message = '\n'.join(['The quick brown fox jumps over the lazy dog.'] * 100)
+        submission = self.submit(message)
+
+        self.assertTrue(submission.data.startswith('zlib:'))
+        self.assertLess(len(submission.data), len(message))
+        self.assertEqual(self.get_values(submission), [('name', 'Jane'), ('message', message)])
+        self.assertIsNone(submission.field_values)
+
+    @override_settings(ALDRYN_FORMS_STORE_FIELD_VALUES=True)
+    def test_field_values_are_stored_if_enabled(self):
+        message = '\n'.join(['The quick brown fox jumps over the lazy dog.'] * 100)
+        submission = self.submit(message)
+
+        self.assertTrue(submission.data.startswith('zlib:'))
+        self.assertEqual(submission.field_values, {'name': 'Jane', 'message': message})
+
+    def test_small_data_is_not_compressed(self):
+        submission = self.submit('Hello')
+
+        self.assertTrue(submission.data.startswith('['))
+        self.assertEqual(self.get_values(submission), [('name', 'Jane'), ('message', 'Hello')])
+
+
+class FormSchemaVersionTestCase(TestCase):
+    def setUp(self):
+        super(FormSchemaVersionTestCase, self).setUp()
+        placeholder = Placeholder.objects.create(slot='test')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='name', label='Name')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='alias', label='Name')
+
+    def submit(self, name, alias):
+        plugin = self.form_plugin.get_plugin_class_instance()
+        form_class = plugin.get_form_class(self.form_plugin)
+        form = form_class(
+            form_plugin=self.form_plugin,
+            request=RequestFactory().post('/'),
+            data={'language': 'en', 'form_plugin_id': self.form_plugin.pk, 'name': name, 'alias': alias},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        return FormSubmission.objects.order_by('pk').last()
+
+    def test_submissions_share_schema_version(self):
+        first = self.submit('Jane', 'J')
+        second = self.submit('John', 'Jo')
+
+        self.assertEqual(FormSchemaVersion.objects.count(), 1)
+        self.assertEqual(first.schema_version_id, second.schema_version_id)
+        self.assertEqual(json.loads(second.data), ['John', 'Jo'])
+        self.assertEqual(second.get_form_data(), [
+            SerializedFormField('name', 'Name', 1, 'John'),
+            SerializedFormField('alias', 'Name', 2, 'Jo'),
+        ])
+
+    def test_unversioned_submissions_are_read(self):
+        with override_settings(ALDRYN_FORMS_SCHEMA_VERSIONS=False):
+            unversioned = self.submit('Jane', 'J')
+
+        versioned = self.submit('Jane', 'J')
+
+        self.assertIsNone(unversioned.schema_version_id)
+        self.assertEqual(unversioned.get_form_data(), versioned.get_form_data())
+
+    def test_export_fields(self):
+        FormSubmission.objects.create(
+            name='contact',
+            data=json.dumps([{'name': 'city', 'label': 'City', 'value': 'Bern'}]),
+            sent_at=timezone.now() - datetime.timedelta(days=1),
+        )
+        self.submit('Jane', 'J')
+        self.submit('John', 'Jo')
+
+        latest_fields, old_fields = Exporter(FormSubmission.objects.all()).get_fields_for_export()
+
+        self.assertEqual([field.name for field in latest_fields], ['name', 'alias'])
+        self.assertEqual([field.name for field in old_fields], ['city'])
+
+
+class FormSubmissionDecodingTestCase(TestCase):
+    def setUp(self):
+        super(FormSubmissionDecodingTestCase, self).setUp()
+        self.fields = [('textfield_1', 'Name', 'Jane'), ('textfield_2', 'Name', 'J'), ('emailfield_1', '', 'a@b.c')]
+        self.schema_version = FormSchemaVersion.objects.get_for_fields(
+            (name, label) for name, label, value in self.fields
+        )
+
+    def get_versioned(self):
+        return FormSubmission(
+            name='contact',
+            schema_version=self.schema_version,
+            data=json.dumps([value for name, label, value in self.fields]),
+        )
+
+    def get_unversioned(self):
+        return FormSubmission(
+            name='contact',
+            data=json.dumps([{'name': name, 'label': label, 'value': value} for name, label, value in self.fields]),
+        )
+
+    def test_decoding(self):
+        for submission in (self.get_versioned(), self.get_unversioned()):
+            form_data = submission.get_form_data()
+
+            self.assertEqual(form_data, [
+                SerializedFormField('textfield_1', 'Name', 1, 'Jane'),
+                SerializedFormField('textfield_2', 'Name', 2, 'J'),
+                SerializedFormField('emailfield_1', '', 1, 'a@b.c'),
+            ])
+            self.assertEqual(
+                [field.field_id for field in form_data],
+                [SerializedFormField(*field).field_id for field in form_data],
+            )
+
+    def test_decoding_is_memoized(self):
+        submission = self.get_versioned()
+        form_data = submission.get_form_data()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(submission.get_form_data(), form_data)
+            self.assertIs(submission.get_form_data()[0], form_data[0])
+
+        submission.data = json.dumps(['John', 'Jo', 'x@y.z'])
+        self.assertEqual(submission.get_form_data()[0].value, 'John')
+
+    def test_get_field_value(self):
+        for submission in (self.get_versioned(), self.get_unversioned()):
+            self.assertEqual(submission.get_field_value('textfield_2'), 'J')
+            self.assertEqual(submission.get_field_value('emailfield_1'), 'a@b.c')
+            self.assertIsNone(submission.get_field_value('missing'))
+
+
+@override_settings(ALDRYN_FORMS_STORE_SUBMISSION_VALUES=True)
+class FormSubmissionValueTestCase(TestCase):
+    def setUp(self):
+        super(FormSubmissionValueTestCase, self).setUp()
+        self.create_submission([('Color', 'selectfield_1', 'red'), ('Email', 'emailfield_1', 'a@example.com')])
+        self.create_submission([('Color', 'selectfield_1', 'blue')])
+        self.create_submission([('Color', 'selectfield_1', 'red'), ('Name', 'textfield_1', 'Jane')])
+
+    def create_submission(self, fields, name='contact'):
+        data = [{'label': label, 'name': field_name, 'value': value} for label, field_name, value in fields]
+        submission = FormSubmission.objects.create(name=name, data=json.dumps(data))
+        submission.create_values()
+        return submission
+
+    def test_values_are_stored(self):
+        submission = FormSubmission.objects.latest('pk')
+        values = submission.submission_values.order_by('pk')
+
+        self.assertEqual(
+            [(value.field_name, value.field_label, value.occurrence, value.value) for value in values],
+            [('selectfield_1', 'Color', 1, 'red'), ('textfield_1', 'Name', 1, 'Jane')],
+        )
+
+    def test_value_counts(self):
+        self.create_submission([('Color', 'selectfield_1', 'green')], name='other')
+        counts = FormSubmission.objects.filter(name='contact').value_counts('selectfield_1')
+
+        self.assertEqual(list(counts), [
+            {'value': 'red', 'count': 2},
+            {'value': 'blue', 'count': 1},
+        ])
+
+    def test_export_fields_are_collected_in_sql(self):
+        queryset = FormSubmission.objects.filter(name='contact')
+        exporter = Exporter(queryset)
+
+        self.assertTrue(exporter.has_submission_values())
+        fields = exporter.get_fields_for_export()
+
+        with self.settings(ALDRYN_FORMS_STORE_SUBMISSION_VALUES=False):
+            expected = exporter.get_fields_for_export()
+
+        self.assertEqual(
+            [[field.field_id for field in group] for group in fields],
+            [[field.field_id for field in group] for group in expected],
+        )
+
+    def test_fill_command(self):
+        FormSubmissionValue.objects.all().delete()
+
+        call_command('aldryn_forms_fill_submission_values', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(FormSubmissionValue.objects.count(), 5)
+
+    def test_fill_command_queries(self):
+        FormSubmissionValue.objects.all().delete()
+
+        # The two selects, the savepoint and its release and one
+        # insert per submission, the deferred fields aren't loaded.
+        with self.assertNumQueries(4 + FormSubmission.objects.count()):
+            call_command('aldryn_forms_fill_submission_values', batch_size=1000, stdout=StringIO())
+
+
+class FormSubmissionFormPluginTestCase(TestCase):
+    def setUp(self):
+        super(FormSubmissionFormPluginTestCase, self).setUp()
+        placeholder = Placeholder.objects.create(slot='test')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        add_plugin(placeholder, 'TextField', 'en', target=self.form_plugin, name='first_name')
+        # Two forms with the same name, can't tell them apart.
+        add_plugin(placeholder, 'EmailNotificationForm', 'en', name='newsletter')
+        add_plugin(placeholder, 'EmailNotificationForm', 'en', name='newsletter')
+
+    def test_form_plugin_is_set_on_submit(self):
+        plugin = self.form_plugin.get_plugin_class_instance()
+        form_class = plugin.get_form_class(self.form_plugin)
+        form = form_class(
+            form_plugin=self.form_plugin,
+            request=RequestFactory().post('/'),
+            data={'language': 'en', 'form_plugin_id': self.form_plugin.pk, 'first_name': 'Jane'},
+        )
+
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(FormSubmission.objects.get().form_plugin_id, self.form_plugin.pk)
+
+    def test_backfill_command(self):
+        for name in ('contact', 'contact', 'newsletter', 'removed'):
+            FormSubmission.objects.create(name=name, language='en')
+
+        call_command('aldryn_forms_backfill_form_plugin_ids', batch_size=1, stdout=StringIO())
+
+        form_plugin_ids = FormSubmission.objects.values_list('name', 'form_plugin_id').order_by('pk')
+        self.assertEqual(list(form_plugin_ids), [
+            ('contact', self.form_plugin.pk),
+            ('contact', self.form_plugin.pk),
+            ('newsletter', None),
+            ('removed', None),
+        ])
+
+
+class RetentionCommandTestCase(TestCase):
+    def setUp(self):
+        super(RetentionCommandTestCase, self).setUp()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        now = timezone.now()
+        self.submissions = [
+            FormSubmission.objects.create(name=name, language='en', sent_at=now - datetime.timedelta(days=days))
+            for name, days in (('contact', 40), ('contact', 10), ('newsletter', 40), ('newsletter', 400))
+        ]
+
+    def get_remaining(self):
+        return list(FormSubmission.objects.order_by('pk').values_list('name', flat=True))
+
+    @override_settings(ALDRYN_FORMS_RETENTION_DAYS={'contact': 30})
+    def test_retention(self):
+        call_command('aldryn_forms_retention', days=365, archive_dir=self.archive_dir, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(self.get_remaining(), ['contact', 'newsletter'])
+
+        archived = {}
+
+        for filename in os.listdir(self.archive_dir):
+            with gzip.open(os.path.join(self.archive_dir, filename), 'rt') as archive:
+                for line in archive:
+                    values = json.loads(line)['values']
+                    archived[values['id']] = values['sent_at']
+        self.assertEqual(archived, {
+            obj.pk: obj.sent_at.isoformat() for obj in (self.submissions[0], self.submissions[3])
+        })
+
+    @override_settings(ALDRYN_FORMS_RETENTION_DAYS={'contact': 30})
+    def test_dry_run_and_form_filter(self):
+        out = StringIO()
+        call_command('aldryn_forms_retention', days=1, form=['newsletter'], dry_run=True, stdout=out)
+
+        self.assertIn('Found 2 submissions of other forms', out.getvalue())
+        self.assertEqual(len(self.get_remaining()), 4)
+
+        call_command('aldryn_forms_retention', days=1, form=['newsletter'], no_archive=True, stdout=StringIO())
+
+        self.assertEqual(self.get_remaining(), ['contact', 'contact'])
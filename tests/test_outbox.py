@@ -0,0 +1,304 @@
+import shutil
+import smtplib
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from cms.api import add_plugin, create_page
+from cms.test_utils.testcases import CMSTestCase
+
+from filer.models import Folder
+
+from aldryn_forms.mail import ConnectionPool
+from aldryn_forms.models import EmailOutbox, FormSubmission
+from aldryn_forms.outbox import (
+    deserialize_message, send_messages, serialize_message,
+)
+
+
+class EmailOutboxTestCase(TestCase):
+    def get_message(self, to='jane@example.com'):
+        message = EmailMultiAlternatives(
+            subject='New submission',
+            body='Hello',
+            from_email='forms@example.com',
+            to=[to],
+            reply_to=['john@example.com'],
+            headers={'X-Form': 'contact'},
+        )
+        message.attach_alternative('<p>Hello</p>', 'text/html')
+        message.attach('data.csv', 'a,b\n1,2\n', 'text/csv')
+        message.attach('logo.png', b'\x89PNG', 'image/png')
+        return message
+
+    def send_outbox(self, **options):
+        call_command('aldryn_forms_send_outbox', stdout=StringIO(), **options)
+
+    def test_serialize_message(self):
+        message = deserialize_message(serialize_message(self.get_message()))
+
+        self.assertEqual(message.subject, 'New submission')
+        self.assertEqual(message.to, ['jane@example.com'])
+        self.assertEqual(message.reply_to, ['john@example.com'])
+        self.assertEqual(message.extra_headers, {'X-Form': 'contact'})
+        self.assertEqual(message.alternatives, [('<p>Hello</p>', 'text/html')])
+        self.assertEqual(message.attachments, [
+            ('data.csv', 'a,b\n1,2\n', 'text/csv'),
+            ('logo.png', b'\x89PNG', 'image/png'),
+        ])
+
+    def test_messages_are_sent_without_outbox(self):
+        send_messages([self.get_message()])
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    @override_settings(ALDRYN_FORMS_EMAIL_OUTBOX=True)
+    def test_messages_are_queued(self):
+        send_messages([self.get_message(), self.get_message('john@example.com')])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING).count(), 2)
+
+        self.send_outbox(workers=2)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['jane@example.com', 'john@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>Hello</p>', 'text/html')])
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENT).count(), 2)
+
+    @override_settings(ALDRYN_FORMS_EMAIL_OUTBOX=True)
+    def test_failed_messages_are_retried(self):
+        send_messages([self.get_message()])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.send_outbox(backoff=60, max_attempts=2)
+
+            outbox = EmailOutbox.objects.get()
+            self.assertEqual(outbox.status, EmailOutbox.STATUS_PENDING)
+            self.assertEqual(outbox.attempts, 1)
+            self.assertIn('down', outbox.last_error)
+            self.assertGreater(outbox.next_attempt_at, timezone.now())
+
+            # Not due yet.
+            self.send_outbox()
+            self.assertEqual(EmailOutbox.objects.get().attempts, 1)
+
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+            self.send_outbox(max_attempts=2)
+
+        outbox = EmailOutbox.objects.get()
+        self.assertEqual(outbox.status, EmailOutbox.STATUS_FAILED)
+        self.assertEqual(outbox.attempts, 2)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class ConnectionPoolTestCase(TestCase):
+    def get_message(self, to='jane@example.com'):
+        return EmailMultiAlternatives(subject='New submission', body='Hello', to=[to])
+
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(size=2)
+
+        with mock.patch.object(pool, 'open_connection', wraps=pool.open_connection) as open_connection:
+            pool.send_messages([self.get_message()])
+            pool.send_messages([self.get_message()])
+            self.assertEqual(open_connection.call_count, 1)
+
+            # 2 concurrent connections at most
+            sent = pool.send_messages([self.get_message('user{}@example.com'.format(index)) for index in range(5)])
+            self.assertEqual(sent, 5)
+            self.assertLessEqual(open_connection.call_count, 2)
+
+        self.assertEqual(len(mail.outbox), 7)
+
+    def test_no_connection_without_recipients(self):
+        pool = ConnectionPool()
+
+        with mock.patch.object(pool, 'open_connection') as open_connection:
+            self.assertEqual(pool.send_messages([]), 0)
+            self.assertEqual(pool.send_messages([self.get_message(to=None)]), 0)
+
+        open_connection.assert_not_called()
+
+    def test_failed_connections_are_not_reused(self):
+        pool = ConnectionPool()
+        pool.send_messages([self.get_message()])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            with self.assertRaises(OSError):
+                pool.send_messages([self.get_message()])
+
+        with mock.patch.object(pool, 'open_connection', wraps=pool.open_connection) as open_connection:
+            pool.send_messages([self.get_message()])
+
+        self.assertEqual(open_connection.call_count, 1)
+
+    def test_closed_idle_connection_is_replaced(self):
+        pool = ConnectionPool()
+        pool.send_messages([self.get_message()])
+        idle_connection = pool.get_idle_connection()
+        pool.release_connection(idle_connection)
+
+        with mock.patch.object(idle_connection, 'send_messages', side_effect=smtplib.SMTPServerDisconnected):
+            with mock.patch.object(pool, 'open_connection', wraps=pool.open_connection) as open_connection:
+                self.assertEqual(pool.send_messages([self.get_message()]), 1)
+
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIsNot(pool.get_idle_connection(), idle_connection)
+
+    def test_sent_messages_are_not_retried(self):
+        pool = ConnectionPool()
+        pool.send_messages([self.get_message()])
+        idle_connection = pool.get_idle_connection()
+        pool.release_connection(idle_connection)
+        sent = []
+
+        def send_messages(messages):
+            for message in messages:
+                if message.to == ['invalid@example.com']:
+                    raise smtplib.SMTPRecipientsRefused({'invalid@example.com': (550, b'No such user')})
+                sent.append(message.to[0])
+            return len(messages)
+
+        with mock.patch.object(idle_connection, 'send_messages', side_effect=send_messages):
+            with mock.patch.object(pool, 'open_connection', wraps=pool.open_connection) as open_connection:
+                with self.assertRaises(smtplib.SMTPRecipientsRefused):
+                    pool.send_messages([self.get_message(), self.get_message('invalid@example.com')])
+
+        open_connection.assert_not_called()
+        self.assertEqual(sent, ['jane@example.com'])
+
+    def test_new_connection_is_not_retried(self):
+        pool = ConnectionPool()
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPServerDisconnected):
+            with mock.patch.object(pool, 'open_connection', wraps=pool.open_connection) as open_connection:
+                with self.assertRaises(smtplib.SMTPServerDisconnected):
+                    pool.send_messages([self.get_message()])
+
+        self.assertEqual(open_connection.call_count, 1)
+
+    def test_idle_connections_expire(self):
+        pool = ConnectionPool(max_idle=0)
+        pool.send_messages([self.get_message()])
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 3600):
+            self.assertIsNone(pool.get_idle_connection())
+
+
+class SubmissionMessagesTestCase(CMSTestCase):
+    def setUp(self):
+        super(SubmissionMessagesTestCase, self).setUp()
+
+        page = create_page('test page', 'test_page.html', 'en')
+        placeholder = page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        self.email_field = add_plugin(
+            placeholder,
+            'EmailField',
+            'en',
+            target=self.form_plugin,
+            name='email',
+            email_send_notification=True,
+            email_subject='Thanks',
+        )
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+
+        self.pool = ConnectionPool()
+        patcher = mock.patch('aldryn_forms.outbox.get_connection_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, files=None):
+        form_plugin = self.form_plugin.__class__.objects.get(pk=self.form_plugin.pk)
+        plugin = form_plugin.get_plugin_class_instance()
+        request = RequestFactory().post('/')
+        form_class = plugin.build_form_class(form_plugin)
+        form = form_class(form_plugin=form_plugin, request=request, files=files, data={
+            'language': 'en',
+            'form_plugin_id': form_plugin.pk,
+            'email': 'jane@example.com',
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+
+        with mock.patch.object(self.pool, 'open_connection', wraps=self.pool.open_connection) as open_connection:
+            plugin.process_valid_form(form_plugin, request, form)
+        return open_connection.call_count
+
+    def test_messages_are_sent_together(self):
+        self.form_plugin.email_notifications.create(to_user=self.user, theme='default')
+
+        self.assertEqual(self.submit(), 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['jane@example.com', 'staff@example.com'])
+        self.assertEqual(FormSubmission.objects.get().get_recipients()[0].email, 'staff@example.com')
+
+    def test_confirmation_with_uploaded_file(self):
+        add_plugin(
+            self.email_field.placeholder,
+            'FileField',
+            'en',
+            target=self.form_plugin,
+            name='attachment',
+            upload_to=Folder.objects.create(name='uploads'),
+        )
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        with self.settings(MEDIA_ROOT=media_root):
+            self.submit(files={'attachment': SimpleUploadedFile('cv.txt', b'Jane Doe')})
+
+        self.assertEqual(FormSubmission.objects.count(), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['jane@example.com']])
+        # Serialized once the file is stored.
+        self.assertIn('http://testserver/', mail.outbox[0].body)
+
+    def test_recipients_are_stored_once_sent(self):
+        self.form_plugin.email_notifications.create(to_user=self.user, theme='default')
+
+        with mock.patch.object(self.pool, 'send_messages', side_effect=smtplib.SMTPException):
+            self.submit()
+
+        # The submission is stored, without the recipients it couldn't notify.
+        self.assertEqual(FormSubmission.objects.get().get_recipients(), [])
+
+    def test_no_connection_without_messages(self):
+        self.email_field.email_send_notification = False
+        self.email_field.save()
+
+        self.assertEqual(self.submit(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(FormSubmission.objects.get().get_recipients(), [])
+
+    @override_settings(ALDRYN_FORMS_EMAIL_OUTBOX=True)
+    def test_messages_are_queued_with_the_submission(self):
+        self.form_plugin.email_notifications.create(to_user=self.user, theme='default')
+
+        self.assertEqual(self.submit(), 0)
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+    @override_settings(ALDRYN_FORMS_EMAIL_OUTBOX=True)
+    def test_confirmation_is_queued_before_the_submission_is_saved(self):
+        self.form_plugin.email_notifications.create(to_user=self.user, theme='default')
+        save = FormSubmission.save
+        queued = []
+
+        def queued_save(submission, *args, **kwargs):
+            # In the transaction of DefaultAction.
+            queued.extend(EmailOutbox.objects.values_list('message__to', flat=True))
+            save(submission, *args, **kwargs)
+
+        with mock.patch.object(FormSubmission, 'save', queued_save):
+            self.submit()
+
+        self.assertEqual(sorted(queued), [['jane@example.com'], ['staff@example.com']])
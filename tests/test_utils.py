@@ -1,12 +1,21 @@
+from pathlib import Path
+
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.test import override_settings
+from django.utils.autoreload import file_changed
 from django.utils.translation import ugettext_lazy as _
 
+from cms.api import add_plugin, create_page
 from cms.test_utils.testcases import CMSTestCase
 
 from aldryn_forms.action_backends import DefaultAction, EmailAction, NoAction
 from aldryn_forms.action_backends_base import BaseAction
-from aldryn_forms.utils import action_backend_choices, get_action_backends
+from aldryn_forms.models import EmailFieldPlugin, FormPlugin
+from aldryn_forms.utils import (
+    action_backend_choices, clear_template_cache, get_action_backends,
+    get_plugin_tree, select_cached_template,
+)
 
 
 class FakeValidBackend(BaseAction):
@@ -128,3 +137,69 @@ class ActionChoicesTestCase(CMSTestCase):
         choices = action_backend_choices()
 
         self.assertEquals(choices, expected)
+
+
+class GetPluginTreeTestCase(CMSTestCase):
+    def setUp(self):
+        super(GetPluginTreeTestCase, self).setUp()
+
+        page = create_page('test page', 'test_page.html', 'en')
+        placeholder = page.placeholders.get(slot='content')
+        self.form_plugin = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='contact')
+        fieldset = add_plugin(placeholder, 'Fieldset', 'en', target=self.form_plugin, legend='About you')
+
+        for name in ('first_name', 'last_name'):
+            add_plugin(placeholder, 'TextField', 'en', target=fieldset, name=name)
+        add_plugin(placeholder, 'EmailField', 'en', target=self.form_plugin, name='email')
+        add_plugin(placeholder, 'SubmitButton', 'en', target=self.form_plugin, label='Submit')
+
+        # Another form in the same placeholder.
+        other_form = add_plugin(placeholder, 'EmailNotificationForm', 'en', name='other')
+        add_plugin(placeholder, 'TextField', 'en', target=other_form, name='other_name')
+
+    def test_tree_is_built(self):
+        form_plugin = get_plugin_tree(FormPlugin, pk=self.form_plugin.pk)
+        fieldset, email, button = form_plugin.child_plugin_instances
+
+        self.assertEqual(fieldset.legend, 'About you')
+        self.assertEqual(
+            [field.name for field in fieldset.child_plugin_instances],
+            ['first_name', 'last_name'],
+        )
+        self.assertIsInstance(email, EmailFieldPlugin)
+        self.assertEqual(email.name, 'email')
+        self.assertEqual(button.plugin_type, 'SubmitButton')
+        self.assertEqual(form_plugin.parent_id, self.form_plugin.parent_id)
+
+    def test_number_of_queries(self):
+        # The form plugin, its descendants and one query
+        # per descendant plugin type (fieldset, text, email, button).
+        with self.assertNumQueries(6):
+            get_plugin_tree(FormPlugin, pk=self.form_plugin.pk)
+
+
+class SelectCachedTemplateTestCase(CMSTestCase):
+    template_names = ['aldryn_forms/fields/missing.html', 'aldryn_forms/field.html']
+
+    def setUp(self):
+        super(SelectCachedTemplateTestCase, self).setUp()
+        clear_template_cache()
+
+    def test_template_is_reused(self):
+        template = select_cached_template(self.template_names)
+
+        self.assertEqual(template.origin.template_name, 'aldryn_forms/field.html')
+        self.assertIs(select_cached_template(self.template_names), template)
+
+    def test_cache_is_cleared_on_file_change(self):
+        template = select_cached_template(self.template_names)
+
+        file_changed.send(sender=None, file_path=Path(template.origin.name))
+
+        self.assertIsNot(select_cached_template(self.template_names), template)
+
+    def test_cache_is_cleared_when_templates_change(self):
+        template = select_cached_template(self.template_names)
+
+        with override_settings(TEMPLATES=settings.TEMPLATES):
+            self.assertIsNot(select_cached_template(self.template_names), template)
@@ -1,8 +1,11 @@
 import sys
 from distutils.version import LooseVersion
-from unittest import skipIf, skipUnless
+from unittest import mock, skipIf, skipUnless
 
 from django import VERSION as DJANGO_VERSION
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import mail
+from django.test import RequestFactory
 from django.urls import clear_url_caches
 
 import cms
@@ -10,6 +13,9 @@ from cms.api import add_plugin, create_page
 from cms.appresolver import clear_app_resolvers
 from cms.test_utils.testcases import CMSTestCase
 
+from aldryn_forms.models import FormPlugin, FormSubmission
+from aldryn_forms.views import submit_form_view
+
 
 # These means "less than or equal"
 DJANGO_111 = DJANGO_VERSION[:2] >= (1, 11)
@@ -285,3 +291,54 @@ class SubmitFormViewTest(CMSTestCase):
         email_field = '<input type="email" name="{name}"'
         self.assertContains(response, email_field.format(name='email_1'))
         self.assertContains(response, email_field.format(name='email_2'))
+
+
+class SubmitFormViewEmailNotificationTest(CMSTestCase):
+
+    def setUp(self):
+        self.page = create_page('tpage', 'test_page.html', 'en')
+        placeholder = self.page.placeholders.get(slot='content')
+        form_plugin = add_plugin(
+            placeholder,
+            'EmailNotificationForm',
+            'en',
+            name='contact',
+            redirect_type='redirect_to_url',
+            url='http://www.google.com',
+        )
+        add_plugin(placeholder, 'TextField', 'en', target=form_plugin, name='first_name')
+        staff = User.objects.create_user('staff', 'staff@example.com', 'password')
+        form_plugin.email_notifications.create(to_user=staff, theme='default')
+        self.page.publish('en')
+        self.form_plugin = (
+            self.page
+            .publisher_public
+            .placeholders
+            .get(slot='content')
+            .get_plugins()
+            .get(plugin_type='EmailNotificationForm')
+            .get_bound_plugin()
+        )
+
+    def submit(self):
+        request = RequestFactory().post(self.page.get_absolute_url('en'), {
+            'form_plugin_id': self.form_plugin.pk,
+            'first_name': 'Jane',
+        })
+        request.user = AnonymousUser()
+
+        with mock.patch('aldryn_forms.views.get_page_from_request', return_value=self.page.publisher_public):
+            return submit_form_view(request)
+
+    def test_submission(self):
+        response = self.submit()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(FormSubmission.objects.count(), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['staff@example.com']])
+
+    def test_submission_with_outdated_schema(self):
+        FormPlugin.objects.filter(pk=self.form_plugin.pk).update(form_schema='')
+
+        self.assertEqual(self.submit().status_code, 302)
+        self.assertEqual(FormSubmission.objects.count(), 1)